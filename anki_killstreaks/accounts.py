@@ -1,9 +1,10 @@
+import threading
 from urllib.parse import urljoin
 import requests
 
 from ._vendor import attr
 
-from .networking import sra_base_url, shared_headers
+from .networking import sra_base_url, shared_headers, default_timeout
 
 
 class UserRepository:
@@ -34,6 +35,63 @@ class UserRepository:
             conn.execute("UPDATE users SET client_uuid = ?", (uuid,))
 
 
+class CachingUserRepository:
+    """
+    Keeps the signed in user in memory, since the auth headers are read
+    before and stored after every request to the server. save only writes
+    to the database when the credentials actually changed, so a response
+    that didn't rotate the token doesn't cost an UPDATE. A new instance is
+    made for every profile.
+
+    Writes drop the cached user rather than patching it, so logging in or
+    out always rereads what was stored.
+    """
+
+    def __init__(self, repo):
+        self._repo = repo
+        self._user = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes_skipped = 0
+
+    def load(self):
+        with self._lock:
+            if self._user is None:
+                self.misses += 1
+                self._user = self._repo.load()
+            else:
+                self.hits += 1
+
+            return self._user
+
+    def save(self, uid, token, client, expiry):
+        with self._lock:
+            if self._user is not None and (
+                self._user.uid,
+                self._user.token,
+                self._user.client,
+                self._user.expiry,
+            ) == (uid, token, client, expiry):
+                self.writes_skipped += 1
+                return
+
+            self._repo.save(uid=uid, token=token, client=client, expiry=expiry)
+            self._user = None
+
+    def set_client_uuid(self, uuid):
+        with self._lock:
+            self._repo.set_client_uuid(uuid)
+            self._user = None
+
+    def invalidate(self):
+        with self._lock:
+            self._user = None
+
+    def __getattr__(self, attr):
+        return getattr(self._repo, attr)
+
+
 @attr.s(frozen=True)
 class PersistedUser:
     id_ = attr.ib()
@@ -53,7 +111,9 @@ def login(email, password, listener, user_repo, shared_headers=shared_headers):
     url = urljoin(sra_base_url, "api/v1/auth/sign_in")
 
     try:
-        response = requests.post(url, headers=shared_headers, json=body)
+        response = requests.post(
+            url, headers=shared_headers, json=body, timeout=default_timeout
+        )
 
         if response.status_code == 200:
             store_auth_headers(user_repo, response.headers)
@@ -87,7 +147,8 @@ def logout(user_repo, listener, shared_headers=shared_headers):
     try:
         response = requests.delete(
             url,
-            headers=headers
+            headers=headers,
+            timeout=default_timeout,
         )
 
         if response.status_code == 200:
@@ -136,6 +197,7 @@ def validate_token(user_repo, listener, shared_headers=shared_headers):
         response = requests.get(
             url=urljoin(sra_base_url, "api/v1/auth/validate_token"),
             headers=headers,
+            timeout=default_timeout,
         )
 
         if response.status_code == 200:
@@ -0,0 +1,248 @@
+"""
+Anki Killstreaks add-on
+
+Optional asyncio backend for requests to the leaderboards server, turned on
+with "network_backend": "asyncio" in the config. An event loop runs on its
+own thread so many small requests, like chase mode refreshes, can be in
+flight at once instead of each holding a network worker. Requests go
+through aiohttp if it's installed, otherwise the pooled requests session is
+run on a small thread pool from the loop.
+
+Results get back to Qt the same way as with the job executor, by emitting
+signals from the loop thread.
+
+Copyright: (c) jac241 2019-2021 <https://github.com/jac241>
+License: GNU AGPLv3 or later <https://www.gnu.org/licenses/agpl.html>
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, partialmethod
+import json
+import os
+from threading import Thread
+import traceback
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+if not (os.environ.get("KILLSTREAKS_ENV", "production") == "test"):
+    from aqt.qt import QObject, pyqtSignal
+else:
+    from PyQt5.Qt import QObject, pyqtSignal
+
+from ._vendor import attr
+from . import accounts
+from .networking import default_timeout, shared_headers
+
+
+def is_enabled(config):
+    return config.get("network_backend", "threads") == "asyncio"
+
+
+class EventLoopThread:
+    """Runs an asyncio event loop on a daemon thread"""
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = Thread(
+            target=self._run, name="killstreaks-event-loop", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def submit(self, coroutine):
+        """
+        Schedules coroutine on the loop from any thread. Returns a
+        concurrent.futures.Future; exceptions are logged as well, since
+        most callers don't wait on it.
+        """
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+        future.add_done_callback(_log_exception)
+        return future
+
+    def stop(self, timeout_s=None):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout_s)
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+        pending = asyncio.all_tasks(self._loop)
+        for task in pending:
+            task.cancel()
+        self._loop.run_until_complete(
+            asyncio.gather(*pending, return_exceptions=True)
+        )
+        self._loop.close()
+
+
+def _log_exception(future):
+    if not future.cancelled() and future.exception() is not None:
+        print("Exception encountered in killstreaks event loop:")
+        print(
+            "".join(
+                traceback.format_exception(
+                    type(future.exception()),
+                    future.exception(),
+                    future.exception().__traceback__,
+                )
+            )
+        )
+
+
+@attr.s(frozen=True)
+class HttpResponse:
+    """
+    The parts of a requests.Response the add-on uses, so code handling
+    responses doesn't care which transport made the request.
+    """
+
+    status_code = attr.ib()
+    headers = attr.ib(converter=CaseInsensitiveDict)
+    text = attr.ib()
+    url = attr.ib(default="")
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if 400 <= self.status_code < 600:
+            raise requests.HTTPError(
+                f"{self.status_code} error for url: {self.url}", response=self
+            )
+
+
+class RequestsTransport:
+    """Runs the blocking requests session on a thread pool"""
+
+    def __init__(self, session, pool_size):
+        self._session = session
+        self._pool = ThreadPoolExecutor(
+            max_workers=pool_size, thread_name_prefix="killstreaks-http"
+        )
+
+    async def request(self, method, url, **kwargs):
+        response = await asyncio.get_running_loop().run_in_executor(
+            self._pool, partial(self._session.request, method, url, **kwargs)
+        )
+        return HttpResponse(
+            status_code=response.status_code,
+            headers=response.headers,
+            text=response.text,
+            url=response.url,
+        )
+
+    async def close(self):
+        self._pool.shutdown(wait=False)
+
+
+class AiohttpTransport:
+    """Made on the event loop's thread, since aiohttp sessions belong to it"""
+
+    def __init__(self, pool_size):
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=pool_size)
+        )
+
+    async def request(self, method, url, timeout=default_timeout, **kwargs):
+        connect_timeout_s, read_timeout_s = timeout
+        try:
+            async with self._session.request(
+                method.upper(),
+                url,
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=connect_timeout_s, sock_read=read_timeout_s
+                ),
+                **kwargs,
+            ) as response:
+                return HttpResponse(
+                    status_code=response.status,
+                    headers=response.headers,
+                    text=await response.text(),
+                    url=str(response.url),
+                )
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            # callers only know about requests' exceptions
+            raise requests.exceptions.ConnectionError(e) from e
+
+    async def close(self):
+        await self._session.close()
+
+
+async def build_transport(http_session, http_settings):
+    """Must be awaited on the event loop"""
+    if aiohttp is not None:
+        return AiohttpTransport(pool_size=http_settings.pool_size)
+    else:
+        return RequestsTransport(http_session, pool_size=http_settings.pool_size)
+
+
+@attr.s
+class AsyncTokenAuthHttpClient:
+    _user_repo = attr.ib()
+    _transport = attr.ib()
+    _shared_headers = attr.ib(default=shared_headers)
+    _timeout = attr.ib(default=default_timeout)
+
+    async def _do_request(
+        self, method, skip_shared_headers=False, headers=None, **kwargs
+    ):
+        kwargs.setdefault("timeout", self._timeout)
+        url = kwargs.pop("url")
+        response = await self._transport.request(
+            method,
+            url,
+            **kwargs,
+            headers={
+                **self._headers_for_request(skip_shared_headers),
+                **(headers or {}),
+            },
+        )
+
+        if response.status_code != 401:
+            accounts.store_auth_headers(self._user_repo, response.headers)
+        else:
+            accounts.clear_auth_headers(self._user_repo)
+
+        return response
+
+    get = partialmethod(_do_request, 'get')
+    post = partialmethod(_do_request, 'post')
+    put = partialmethod(_do_request, 'put')
+    delete = partialmethod(_do_request, 'delete')
+
+    def _headers_for_request(self, skip_shared_headers):
+        headers = dict() if skip_shared_headers else self._shared_headers.copy()
+        headers.update(accounts.load_auth_headers(self._user_repo))
+        return headers
+
+
+class AsyncStatusListeningHttpClient(QObject):
+    status_occurred = pyqtSignal(object)
+
+    def __init__(self, http_client, status, on_status, parent=None):
+        super().__init__(parent)
+        self._http_client = http_client
+        self._status = status
+
+        self.status_occurred.connect(on_status)
+
+    async def _do_request(self, method, **kwargs):
+        response = await getattr(self._http_client, method)(**kwargs)
+
+        if response.status_code == self._status:
+            self.status_occurred.emit(response)
+
+        return response
+
+    get = partialmethod(_do_request, 'get')
+    post = partialmethod(_do_request, 'post')
+    put = partialmethod(_do_request, 'put')
+    delete = partialmethod(_do_request, 'delete')
@@ -0,0 +1,351 @@
+"""
+Anki Killstreaks add-on
+
+Rebuilds medals for reviews made before the add-on recorded any, for
+people who installed it late or lost anki_killstreaks.db, by replaying
+the collection's revlog through the current game's streaks. Rebuilt
+medals are marked as backfilled and stay on this computer, since the
+server may already have the originals.
+
+The revlog doesn't say which deck was being studied, so rebuilt medals
+get the card's home deck as it is now, not the deck from decks.current()
+that medals earned while reviewing record. Cards studied in a filtered
+deck count for the deck they came from, and reviews of deleted cards go
+to the Default deck.
+
+Copyright: (c) jac241 2019-2021 <https://github.com/jac241>
+License: GNU AGPLv3 or later <https://www.gnu.org/licenses/agpl.html>
+"""
+from datetime import datetime, timezone
+from functools import partial
+import os
+import threading
+from threading import Thread
+import time
+import traceback
+from uuid import uuid4
+
+if not (os.environ.get("KILLSTREAKS_ENV", "production") == "test"):
+    from aqt.qt import QObject, pyqtSignal
+    from aqt.utils import askUser
+else:
+    from PyQt5.Qt import QObject, pyqtSignal
+
+from . import tooltips
+from .config import local_conf
+from .persistence import BackfillStateRepository, sqlite_timestamp
+from .streaks import replay_reviews
+
+
+# Anki's Default deck, which can't be deleted
+_default_deck_id = 1
+
+
+class RevlogReader:
+    """
+    Reads the collection's revlog in the order cards were answered, a
+    batch at a time, so years of reviews are never in memory at once.
+    Rows are (revlog id, ms taken to answer, ease, deck id), the id being
+    when the card was answered. Works with Anki's col.db.
+    """
+
+    # ease 0 rows are reschedules made in the browser, not answers.
+    # Deleted cards keep their revlog rows, hence the left join.
+    _batch_sql = """
+        SELECT r.id, r.time, r.ease,
+            CASE
+                WHEN c.id IS NULL THEN ?
+                WHEN c.odid != 0 THEN c.odid
+                ELSE c.did
+            END
+        FROM revlog AS r
+        LEFT JOIN cards AS c ON c.id = r.cid
+        WHERE r.id > ? AND r.id < ? AND r.ease > 0
+        ORDER BY r.id
+        LIMIT ?
+    """
+
+    def __init__(self, col_db, batch_size=10_000):
+        self._col_db = col_db
+        self._batch_size = batch_size
+
+    def count(self, after_id, until_id):
+        return self._col_db.scalar(
+            "SELECT count() FROM revlog WHERE id > ? AND id < ? AND ease > 0",
+            after_id,
+            until_id,
+        )
+
+    def batches(self, after_id, until_id):
+        while True:
+            rows = self._col_db.all(
+                self._batch_sql,
+                _default_deck_id,
+                after_id,
+                until_id,
+                self._batch_size,
+            )
+            if len(rows) == 0:
+                return
+
+            yield rows
+            after_id = rows[-1][0]
+
+
+class RevlogBackfill:
+    """
+    Replays the revlog from before the first medal the add-on saved and
+    saves each batch's medals along with a checkpoint, so a backfill can
+    be stopped at any time and carried on from where it got to.
+    """
+
+    def __init__(
+        self, revlog_reader, backfill_state_repo, config, on_progress=None
+    ):
+        self._revlog_reader = revlog_reader
+        self._backfill_state_repo = backfill_state_repo
+        self._config = config
+        self._on_progress = on_progress or (lambda done, total: None)
+        self._cancelled = threading.Event()
+
+    def run(self, game_id, now_ms):
+        """
+        Medals created, or None if cancelled. A backfill left unfinished
+        is carried on, for the game it was started with.
+        """
+        backfill_state = self._backfill_state_repo.load_in_progress()
+        if backfill_state is None:
+            first_achievement_at_ms = (
+                self._backfill_state_repo.first_achievement_at_ms()
+            )
+            backfill_state = self._backfill_state_repo.start(
+                game_id,
+                until_revlog_id=min(
+                    now_ms, first_achievement_at_ms or now_ms
+                ),
+            )
+
+        total = self._revlog_reader.count(0, backfill_state.until_revlog_id)
+        done = total - self._revlog_reader.count(
+            backfill_state.last_revlog_id, backfill_state.until_revlog_id
+        )
+        self._on_progress(done, total)
+
+        for rows in self._revlog_reader.batches(
+            backfill_state.last_revlog_id, backfill_state.until_revlog_id
+        ):
+            if self._cancelled.is_set():
+                return None
+
+            backfill_state = self._save_batch(backfill_state, rows)
+            done += len(rows)
+            self._on_progress(done, total)
+
+        self._backfill_state_repo.finish()
+        return backfill_state.medals_created
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _save_batch(self, backfill_state, rows):
+        revlog_ids, taken_ms, eases, deck_ids = zip(*rows)
+        game_id = backfill_state.game_id
+
+        replayed = replay_reviews(
+            question_shown_at_ms=[
+                answered_at_ms - ms
+                for answered_at_ms, ms in zip(revlog_ids, taken_ms)
+            ],
+            answered_at_ms=revlog_ids,
+            eases=eases,
+            config=self._config,
+            game_ids=[game_id],
+            streak_indexes_by_game_id=(
+                {game_id: backfill_state.streak_indexes}
+                if backfill_state.streak_indexes
+                else None
+            ),
+        )[game_id]
+
+        return self._backfill_state_repo.save_progress(
+            backfill_state,
+            last_revlog_id=revlog_ids[-1],
+            streak_indexes=replayed.streak_indexes,
+            achievement_rows=[
+                (
+                    medal.id_,
+                    deck_ids[review_index],
+                    str(uuid4()),
+                    _created_at(revlog_ids[review_index]),
+                )
+                for review_index, medal in replayed
+            ],
+        )
+
+
+def _created_at(revlog_id):
+    return sqlite_timestamp(
+        datetime.fromtimestamp(revlog_id / 1000, timezone.utc)
+    )
+
+
+class BackfillWorker(QObject):
+    """
+    Runs a RevlogBackfill on its own thread, reporting back to the main
+    thread through signals. close_connection is called from that thread
+    once it's done, to close the database connection it opened.
+    """
+
+    progressed = pyqtSignal(int, int)
+    # medals created, or None if cancelled
+    finished = pyqtSignal(object)
+    failed = pyqtSignal()
+
+    def __init__(
+        self,
+        revlog_reader,
+        backfill_state_repo,
+        config,
+        close_connection=lambda: None,
+        parent=None,
+    ):
+        super().__init__(parent)
+        self._backfill = RevlogBackfill(
+            revlog_reader,
+            backfill_state_repo,
+            config,
+            on_progress=self.progressed.emit,
+        )
+        self._close_connection = close_connection
+        self._thread = None
+
+    def start(self, game_id, now_ms):
+        self._thread = Thread(
+            target=self._run,
+            args=(game_id, now_ms),
+            name="killstreaks-backfill",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def cancel(self):
+        self._backfill.cancel()
+
+    def wait(self, timeout_s=None):
+        """True once the thread has stopped"""
+        if self._thread is not None:
+            self._thread.join(timeout_s)
+            return not self._thread.is_alive()
+        return True
+
+    def _run(self, game_id, now_ms):
+        try:
+            self.finished.emit(self._backfill.run(game_id, now_ms))
+        except Exception:
+            print("Exception encountered while rebuilding medals:")
+            print(traceback.format_exc())
+            self.failed.emit()
+        finally:
+            self._close_connection()
+
+
+_running_worker = None
+
+
+def start_backfill(main_window, profile_controller, config=local_conf):
+    global _running_worker
+
+    if _running_worker is not None:
+        return
+
+    if not askUser(
+        "Rebuild medals for the reviews you made before Anki Killstreaks "
+        "started recording them? Medals are worked out for the game you "
+        "have selected and stay on this computer. This can take a few "
+        "minutes, and carries on where it left off if Anki is closed.",
+        parent=main_window,
+    ):
+        return
+
+    connection_manager = profile_controller.get_connection_manager()
+    worker = BackfillWorker(
+        RevlogReader(
+            main_window.col.db,
+            batch_size=config.get("backfill_batch_size", 10_000),
+        ),
+        BackfillStateRepository(connection_manager.connection),
+        config,
+        close_connection=connection_manager.close_current,
+        parent=main_window,
+    )
+    worker.progressed.connect(
+        lambda done, total: main_window.progress.update(
+            label=f"Rebuilding medals... {done:,} of {total:,} reviews",
+            value=done,
+            max=total,
+        )
+    )
+    worker.finished.connect(
+        lambda medals_created: _on_finished(
+            main_window, profile_controller, medals_created
+        )
+    )
+    worker.failed.connect(partial(_on_failed, main_window))
+
+    _running_worker = worker
+    main_window.progress.start(label="Rebuilding medals...", immediate=True)
+    worker.start(
+        game_id=profile_controller.get_current_game_id(),
+        now_ms=int(time.time() * 1000),
+    )
+
+
+def _on_finished(main_window, profile_controller, medals_created):
+    _stop_progress(main_window)
+
+    if medals_created is None:
+        return
+
+    if profile_controller.is_loaded:
+        # cached medal counts don't know about the new rows
+        profile_controller.get_achievements_repo().invalidate()
+
+    tooltips.showToolTip(
+        html=f"<td>Rebuilt {medals_created:,} medals from your reviews.</td>",
+        period=5000,
+    )
+
+
+def _on_failed(main_window):
+    _stop_progress(main_window)
+    tooltips.showToolTip(
+        html=(
+            "<td>Anki Killstreaks couldn't finish rebuilding medals. <br>"
+            "Start it again to carry on from where it stopped.</td>"
+        ),
+        period=10000,
+    )
+
+
+def _stop_progress(main_window):
+    global _running_worker
+    _running_worker = None
+    main_window.progress.finish()
+
+
+# a cancelled backfill stops after the batch it's on
+_cancel_timeout_s = 30
+
+
+def cancel_running_backfill(wait=False):
+    """
+    It carries on from its last checkpoint the next time it's started.
+    With wait, blocks until its thread has stopped using the collection
+    and the add-on's database.
+    """
+    if _running_worker is None:
+        return
+
+    _running_worker.cancel()
+    if wait and not _running_worker.wait(_cancel_timeout_s):
+        print("Backfill still running after being cancelled")
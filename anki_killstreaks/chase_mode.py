@@ -1,20 +1,23 @@
 from functools import partial
+import json
 from urllib.parse import urljoin
 import os
+import threading
 
 if not (os.environ.get("KILLSTREAKS_ENV", "production") == "test"):
-    from aqt.qt import QTimer
+    from aqt.qt import QObject, QTimer, pyqtSignal
 else:
-    from PyQt5.QtCore import QTimer
+    from PyQt5.QtCore import QObject, QTimer, pyqtSignal
 
 import requests
 
 from ._vendor import attr
 
-from . import accounts, tooltips
+from . import accounts, html_patch, tooltips
+from .async_networking import AsyncStatusListeningHttpClient
 from .networking import (
+    JobPriority,
     StatusListeningHttpClient,
-    TokenAuthHttpClient,
     sra_base_url,
     show_logged_out_tooltip,
     RequeuingJob,
@@ -36,12 +39,26 @@ class ChaseModeContext:
     def user_repo(self):
         return self._profile_controller.get_user_repo()
 
+    @property
+    def http_client(self):
+        return self._profile_controller.get_http_client(shared_headers={})
+
+    @property
+    def async_http_client(self):
+        return self._profile_controller.get_async_http_client(
+            shared_headers={}
+        )
+
+    @property
+    def event_loop(self):
+        return self._profile_controller.event_loop
+
     @property
     def job_queue(self):
         return self._profile_controller.job_queue
 
     def start_job(self, job):
-        self.job_queue.put(job)
+        self.job_queue.put(job, priority=JobPriority.INTERACTIVE)
 
     @property
     def should_show_chase_mode(self):
@@ -80,7 +97,18 @@ def setup_hooks(main_window, gui_hooks, Reviewer, profile_controller):
             # not reviewer, pass on message
             return handled
 
-        if message == "chaseModeLoaded":
+        if message == "chaseModePatchFailed":
+            # the page didn't match what was last rendered, start over
+            _renderer.forget()
+            _render_cached_rivalry(
+                ChaseModeContext(
+                    profile_controller,
+                    webview=context.web,
+                    main_window=main_window,
+                )
+            )
+            return (True, None)
+        elif message == "chaseModeLoaded":
             chase_mode_context = ChaseModeContext(
                 profile_controller,
                 webview=context.web,
@@ -123,18 +151,50 @@ def _initialize_if_appropriate(chase_mode_context):
 
 
 def _initialize(chase_mode_context):
-    http_client = StatusListeningHttpClient(
-        http_client=TokenAuthHttpClient(
-            chase_mode_context.user_repo, shared_headers={}
-        ),
-        status=401,
-        on_status=partial(
-            _inform_user_they_are_not_logged_in,
-            chase_mode_context.webview,
-        ),
+    # the reviewer may have reloaded chase mode's html since the last render
+    _renderer.forget()
+    _render_cached_rivalry(chase_mode_context)
+
+    on_logged_out = partial(
+        _inform_user_they_are_not_logged_in,
+        chase_mode_context.webview,
+    )
+
+    if chase_mode_context.event_loop is not None:
+        http_client = AsyncStatusListeningHttpClient(
+            http_client=chase_mode_context.async_http_client,
+            status=401,
+            on_status=on_logged_out,
+        )
+        fetch = partial(
+            _submit_async_fetch,
+            http_client,
+            chase_mode_context,
+            AsyncRivalryDisplay(),
+        )
+        fetch()
+    else:
+        http_client = StatusListeningHttpClient(
+            http_client=chase_mode_context.http_client,
+            status=401,
+            on_status=on_logged_out,
+        )
+        _show_chase_mode(http_client, chase_mode_context)
+        fetch = partial(
+            chase_mode_context.start_job,
+            partial(
+                _fetch_and_display_chase_mode,
+                http_client,
+                chase_mode_context,
+                reraise=False,
+            ),
+        )
+
+    _refresh_scheduler.start(
+        fetch,
+        is_reviewing=lambda: chase_mode_context.reviewer_is_being_show,
+        parent=chase_mode_context.main_window,
     )
-    _show_chase_mode(http_client, chase_mode_context)
-    _start_chase_mode_timer(http_client, chase_mode_context)
 
 
 def reinitialize_after_game_changed(profile_controller, main_window):
@@ -148,6 +208,7 @@ def reinitialize_after_game_changed(profile_controller, main_window):
 
 
 def _inform_user_they_are_not_logged_in(webview):
+    _rivalry_cache.clear()
     show_logged_out_tooltip()
     _render_not_logged_in(webview)
     _stop_timer_if_it_exists()
@@ -158,9 +219,7 @@ def _render_not_logged_in(webview):
 
 
 def _stop_timer_if_it_exists():
-    if _chase_mode_timer:
-        print("Stopping chase mode timer")
-        _chase_mode_timer.stop()
+    _refresh_scheduler.stop()
 
 
 def _show_chase_mode(http_client, chase_mode_context):
@@ -173,56 +232,209 @@ def _show_chase_mode(http_client, chase_mode_context):
             reraise=True,
         ),
         job_queue=chase_mode_context.job_queue,
+        priority=JobPriority.INTERACTIVE,
     )
     chase_mode_context.start_job(job)
 
 
-_chase_mode_timer = None
 _CHASE_MODE_INTERVAL_MS = 600 * 1000
+_ACTIVE_INTERVAL_MS = 2 * 60 * 1000
+_AFTER_MEDALS_DELAY_MS = 5 * 1000
+
+
+def _build_single_shot_timer(parent, on_timeout):
+    timer = QTimer(parent)
+    timer.setSingleShot(True)
+    timer.timeout.connect(on_timeout)
+    return timer
+
+
+class ChaseModeRefreshScheduler:
+    """
+    Decides when chase mode fetches the rivalry again. A fetch is made
+    after_medals_delay_ms after medals are earned, every active_interval_ms
+    while answering cards, and the interval doubles up to idle_interval_ms
+    while nothing is answered. Refreshing stops as soon as the reviewer
+    isn't showing, until chase mode is initialised again.
+
+    Owns the one timer chase mode uses, so starting again never leaves an
+    old timer running.
+    """
+
+    def __init__(
+        self,
+        active_interval_ms=_ACTIVE_INTERVAL_MS,
+        idle_interval_ms=_CHASE_MODE_INTERVAL_MS,
+        after_medals_delay_ms=_AFTER_MEDALS_DELAY_MS,
+        build_timer=_build_single_shot_timer,
+    ):
+        self._active_interval_ms = active_interval_ms
+        self._idle_interval_ms = idle_interval_ms
+        self._after_medals_delay_ms = after_medals_delay_ms
+        self._build_timer = build_timer
+        self._timer = None
+        self._fetch = None
+        self._is_reviewing = None
+        self._interval_ms = active_interval_ms
+        self.polls_issued = 0
+        self.polls_skipped = 0
+
+    def start(self, fetch, is_reviewing, parent):
+        if self._timer is None:
+            self._timer = self._build_timer(parent, self._on_timeout)
+
+        self._fetch = fetch
+        self._is_reviewing = is_reviewing
+        self._interval_ms = self._active_interval_ms
+        self._timer.start(self._interval_ms)
+
+    def stop(self):
+        if self._timer is not None and self._timer.isActive():
+            print("Stopping chase mode timer")
+            self._timer.stop()
+        self._fetch = None
 
+    @property
+    def is_running(self):
+        return self._fetch is not None
+
+    def on_answer(self, earned_medal_count):
+        if not self.is_running:
+            return
+
+        self._interval_ms = self._active_interval_ms
+        delay_ms = (
+            self._after_medals_delay_ms
+            if earned_medal_count > 0
+            else self._active_interval_ms
+        )
+        # only ever bring the next fetch forward
+        if not self._timer.isActive() or self._timer.remainingTime() > delay_ms:
+            self._timer.start(delay_ms)
 
-def _start_chase_mode_timer(http_client, chase_mode_context):
-    global _chase_mode_timer
-    _chase_mode_timer = QTimer(chase_mode_context.main_window)
+    def _on_timeout(self):
+        if not self.is_running:
+            return
 
-    job = partial(
-        _fetch_and_display_chase_mode,
-        http_client,
-        chase_mode_context,
-        reraise=False,
-    )
-    enqueue_job = partial(chase_mode_context.start_job, job)
+        if not self._is_reviewing():
+            self.polls_skipped += 1
+            self.stop()
+            return
 
-    _chase_mode_timer.timeout.connect(enqueue_job)
-    _chase_mode_timer.start(_CHASE_MODE_INTERVAL_MS)
+        self.polls_issued += 1
+        self._fetch()
+        self._interval_ms = min(self._interval_ms * 2, self._idle_interval_ms)
+        self._timer.start(self._interval_ms)
+
+
+_refresh_scheduler = ChaseModeRefreshScheduler()
+
+
+def on_answer(earned_medals):
+    _refresh_scheduler.on_answer(len(earned_medals))
 
 
 _connection_error_message_shown = False
 
 
 def _fetch_and_display_chase_mode(http_client, chase_mode_context, reraise):
-    global _connection_error_message_shown
+    slug = _game_slug(chase_mode_context.current_game_id)
     try:
         response = http_client.get(
-            url=_rivalry_url_for(chase_mode_context.current_game_id)
+            url=_rivalry_url_for(slug),
+            headers=_rivalry_cache.validators_for(slug),
         )
-        response.raise_for_status()
-        _connection_error_message_shown = False
-        render(chase_mode_context.webview, response.text)
+        _display_rivalry(chase_mode_context.webview, slug, response)
     except requests.exceptions.ConnectionError as e:
-        print("Connection error while updating chase mode")
-        render(chase_mode_context.webview, text="")
-        _show_conn_err_tooltip_if_first_time()
+        _on_connection_error(chase_mode_context.webview)
         if reraise:
             raise e
 
 
-def _rivalry_url_for(current_game_id):
-    return urljoin(
-        sra_base_url, f"api/v2/rivalries/{_game_slug(current_game_id)}"
+def _submit_async_fetch(http_client, chase_mode_context, display):
+    chase_mode_context.event_loop.submit(
+        _fetch_and_display_chase_mode_async(
+            http_client,
+            chase_mode_context.webview,
+            slug=_game_slug(chase_mode_context.current_game_id),
+            display=display,
+        )
     )
 
 
+class AsyncRivalryDisplay(QObject):
+    """
+    Fetches on the event loop finish on its thread, so their results are
+    sent to the thread this was made on, the main thread, to be rendered.
+    """
+
+    rivalry_fetched = pyqtSignal(object, str)
+    connection_failed = pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rivalry_fetched.connect(self._on_rivalry_fetched)
+        self.connection_failed.connect(self._on_connection_failed)
+
+    def _on_rivalry_fetched(self, webview, slug):
+        _render_rivalry(webview, slug)
+
+    def _on_connection_failed(self, webview):
+        _on_connection_error(webview)
+
+
+async def _fetch_and_display_chase_mode_async(http_client, webview, slug, display):
+    try:
+        response = await http_client.get(
+            url=_rivalry_url_for(slug),
+            headers=_rivalry_cache.validators_for(slug),
+        )
+        _cache_rivalry(slug, response)
+        display.rivalry_fetched.emit(webview, slug)
+    except requests.exceptions.ConnectionError:
+        display.connection_failed.emit(webview)
+
+
+def _display_rivalry(webview, slug, response):
+    _cache_rivalry(slug, response)
+    _render_rivalry(webview, slug)
+
+
+def _cache_rivalry(slug, response):
+    global _connection_error_message_shown
+
+    if response.status_code == 304:
+        _rivalry_cache.not_modified(slug)
+    else:
+        response.raise_for_status()
+        _rivalry_cache.store(slug, response)
+
+    _connection_error_message_shown = False
+
+
+def _render_cached_rivalry(chase_mode_context):
+    _render_rivalry(
+        chase_mode_context.webview,
+        _game_slug(chase_mode_context.current_game_id),
+    )
+
+
+def _render_rivalry(webview, slug):
+    html = _rivalry_cache.html_for(slug)
+    if html is not None:
+        render(webview, html)
+
+
+def _on_connection_error(webview):
+    print("Connection error while updating chase mode")
+    render(webview, text="")
+    _show_conn_err_tooltip_if_first_time()
+
+
+def _rivalry_url_for(slug):
+    return urljoin(sra_base_url, f"api/v2/rivalries/{slug}")
+
+
 _slugs_by_id = {
     "halo_3": "halo-3",
     "halo_5": "halo-5",
@@ -238,7 +450,140 @@ def _game_slug(current_game_id):
 
 
 def render(webview, text):
-    webview.eval(fr"setChaseModeHTML(String.raw`{text}`)")
+    _renderer.render(webview, text)
+
+
+class ChaseModeRenderer:
+    """
+    Puts html in the chase mode panel. Remembers what was rendered last so
+    a refresh only sends the elements that changed to
+    patchChaseModeHTML, rather than the whole panel to setChaseModeHTML,
+    and html that is already showing isn't sent at all. Counts the bytes
+    passed to webview.eval to show what each refresh costs.
+    """
+
+    def __init__(self):
+        self._rendered = None
+        self._lock = threading.Lock()
+        self.full_renders = 0
+        self.patches = 0
+        self.renders_skipped = 0
+        self.eval_bytes = 0
+
+    def render(self, webview, html):
+        # fetches finish on the network threads, renders start on the main
+        # thread, and patches must be evaluated in the order they're made
+        with self._lock:
+            js = self._js_for(html)
+            if js is None:
+                self.renders_skipped += 1
+                return
+
+            self._rendered = html
+            js_bytes = len(js.encode("utf-8"))
+            self.eval_bytes += js_bytes
+            print(f"Chase mode render: {js_bytes} bytes evaluated")
+            webview.eval(js)
+
+    def forget(self):
+        """Call when the webview may no longer show the last render"""
+        with self._lock:
+            self._rendered = None
+
+    def _js_for(self, html):
+        full_js = f"setChaseModeHTML({_js_string(html)})"
+        if self._rendered is None:
+            self.full_renders += 1
+            return full_js
+
+        patch = html_patch.diff(self._rendered, html)
+        if patch == []:
+            return None
+
+        if patch is not None:
+            patch_js = (
+                f"patchChaseModeHTML({json.dumps(patch, ensure_ascii=False)})"
+            )
+            if len(patch_js) < len(full_js):
+                self.patches += 1
+                return patch_js
+
+        self.full_renders += 1
+        return full_js
+
+
+def _js_string(text):
+    return json.dumps(text, ensure_ascii=False)
+
+
+_renderer = ChaseModeRenderer()
+
+
+@attr.s(frozen=True)
+class CachedRivalry:
+    html = attr.ib()
+    etag = attr.ib(default=None)
+    last_modified = attr.ib(default=None)
+
+    @property
+    def validators(self):
+        headers = dict()
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class RivalryCache:
+    """
+    Last rivalry html fetched for each game slug, with the validators to
+    make the next fetch conditional, so an unchanged rivalry costs a 304.
+    Fetches finish on the network threads while renders start on the main
+    thread, hence the lock.
+    """
+
+    def __init__(self):
+        self._rivalries_by_slug = dict()
+        self._lock = threading.Lock()
+        self.not_modified_count = 0
+        self.modified_count = 0
+
+    def validators_for(self, slug):
+        with self._lock:
+            rivalry = self._rivalries_by_slug.get(slug)
+            return rivalry.validators if rivalry else dict()
+
+    def store(self, slug, response):
+        with self._lock:
+            self.modified_count += 1
+            self._rivalries_by_slug[slug] = CachedRivalry(
+                html=response.text,
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+            )
+
+    def not_modified(self, slug):
+        with self._lock:
+            self.not_modified_count += 1
+
+    def html_for(self, slug):
+        with self._lock:
+            rivalry = self._rivalries_by_slug.get(slug)
+            return rivalry.html if rivalry else None
+
+    def clear(self):
+        with self._lock:
+            self._rivalries_by_slug.clear()
+
+
+_rivalry_cache = RivalryCache()
+
+
+def clear_rivalry_cache():
+    """Rivalries belong to the signed in user, so aren't kept across profiles"""
+    _rivalry_cache.clear()
+    _renderer.forget()
 
 
 def _show_conn_err_tooltip_if_first_time():
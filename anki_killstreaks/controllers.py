@@ -10,22 +10,33 @@ This pattern has worked alright so far for this simple application.
 """
 from functools import wraps, partial
 
-from . import leaderboards, chase_mode
+from . import accounts, async_networking, backfill, leaderboards, chase_mode
 from ._vendor import attr
-from .accounts import UserRepository
+from .accounts import CachingUserRepository, UserRepository
 from .game import set_current_game_id
-from .leaderboards import RemoteAchievementsRepository
+from .leaderboards import (
+    AchievementOutbox,
+    RemoteAchievementsRepository,
+    UploadSettings,
+)
 from .networking import (
+    HttpSettings,
     TokenAuthHttpClient,
     StatusListeningHttpClient,
+    build_http_session,
+    shared_headers,
     show_logged_out_tooltip,
 )
 from .persistence import (
     migrate_database,
     DbSettings,
-    get_db_connection,
+    DbTuning,
+    ConnectionManager,
     AchievementsRepository,
+    CachingAchievementsRepository,
     SettingsRepository,
+    SyncStateRepository,
+    AchievementOutboxRepository,
 )
 from .streaks import (
     did_card_pass,
@@ -34,6 +45,35 @@ from .streaks import (
 )
 
 
+def _finish_network_jobs(
+    outbox,
+    connection_manager,
+    job_queue,
+    http_session,
+    deliver_achievements,
+    event_loop=None,
+    async_transport=None,
+):
+    """
+    Run when a profile unloads. Medals from the last few answers shouldn't
+    wait for the coalescing window when Anki is closing. Retires the
+    profile's connections once they're delivered, so jobs still waiting
+    to be retried can't open new ones.
+    """
+    try:
+        if deliver_achievements:
+            outbox.deliver_now()
+    finally:
+        connection_manager.retire()
+        # idle workers close the connections they kept
+        job_queue.wake_idle_workers()
+        http_session.close()
+        if async_transport is not None:
+            event_loop.submit(
+                _finish_async_networking(async_transport, connection_manager)
+            )
+
+
 # Hack that we need because profileLoaded hook called after DeckBrowser shown
 def ensure_loaded(f):
     @wraps(f)
@@ -70,31 +110,65 @@ class ProfileController:
     _stores_by_game_id = attr.ib()
     job_queue = attr.ib()
     _main_window = attr.ib()
+    # only set when the asyncio network backend is turned on
+    event_loop = attr.ib(default=None)
 
     # Attributes modified in load_profile
     is_loaded = attr.ib(default=False)
     _db_settings = attr.ib(default=None)
+    _connection_manager = attr.ib(default=None)
+    _http_settings = attr.ib(default=None)
+    _http_session = attr.ib(default=None)
+    _async_transport = attr.ib(default=None)
+    _user_repo = attr.ib(default=None)
+    _outbox = attr.ib(default=None)
     _achievements_repo = attr.ib(default=None)
     _reviewing_controller = attr.ib(default=None)
 
     def load_profile(self):
         self._db_settings = DbSettings.from_profile_folder_path(
-            profile_folder_path=self._get_profile_folder_path()
+            profile_folder_path=self._get_profile_folder_path(),
+            tuning=DbTuning.from_config(self._local_conf),
         )
         migrate_database(settings=self._db_settings)
-        get_db_for_profile = partial(get_db_connection, self._db_settings)
+        self._connection_manager = ConnectionManager(self._db_settings)
+        get_db_for_profile = self._connection_manager.connection
+        # workers close their own connections once the profile unloads
+        self.job_queue.call_after_each_job(
+            self._connection_manager.close_current_if_retired
+        )
 
-        user_repo = UserRepository(get_db_for_profile)
+        self._http_settings = HttpSettings.from_config(self._local_conf)
+        self._http_session = build_http_session(self._http_settings)
+        if self.event_loop:
+            self._async_transport = self.event_loop.submit(
+                async_networking.build_transport(
+                    self._http_session, self._http_settings
+                )
+            ).result()
+
+        self._user_repo = user_repo = CachingUserRepository(
+            UserRepository(get_db_for_profile)
+        )
         http_client = StatusListeningHttpClient(
-            http_client=TokenAuthHttpClient(user_repo),
+            http_client=self._build_http_client(user_repo),
             status=401,
             on_status=show_logged_out_tooltip,
         )
-        self._achievements_repo = RemoteAchievementsRepository(
-            local_repo=AchievementsRepository(get_db_for_profile),
+        self._outbox = AchievementOutbox(
+            outbox_repo=AchievementOutboxRepository(get_db_for_profile),
             user_repo=user_repo,
-            job_queue=self.job_queue,
             http_client=http_client,
+            job_queue=self.job_queue,
+            sync_state_repo=SyncStateRepository(get_db_for_profile),
+            upload_settings=UploadSettings.from_config(self._local_conf),
+        )
+        self._achievements_repo = RemoteAchievementsRepository(
+            local_repo=CachingAchievementsRepository(
+                AchievementsRepository(get_db_for_profile)
+            ),
+            user_repo=user_repo,
+            outbox=self._outbox,
         )
 
         settings_repo = SettingsRepository(get_db_for_profile)
@@ -106,18 +180,25 @@ class ProfileController:
 
         leaderboards.ensure_client_uuid_exists(self.get_user_repo())
 
+        # also delivers what was left in the outbox when Anki last closed,
+        # once the sync has uploaded what it covers
         leaderboards.sync_if_logged_in(
             self.get_user_repo(),
             self._achievements_repo,
+            self.get_sync_state_repo(),
             self.job_queue,
             http_client,
+            self._outbox,
         )
 
     def _build_reviewing_controller(self, game_id, should_auto_switch_game):
-        new_controller = ReviewingController(
-            store=self._stores_by_game_id[game_id],
-            achievements_repo=self._achievements_repo,
-            show_achievements=self._show_achievements,
+        new_controller = AnswerListeningController(
+            controller=ReviewingController(
+                store=self._stores_by_game_id[game_id],
+                achievements_repo=self._achievements_repo,
+                show_achievements=self._show_achievements,
+            ),
+            on_answered=chase_mode.on_answer,
         )
 
         if should_auto_switch_game:
@@ -135,6 +216,43 @@ class ProfileController:
             return new_controller
 
     def unload_profile(self):
+        # the backfill writes through the connection manager and reads the
+        # collection, so it has to stop before either is closed
+        backfill.cancel_running_backfill(wait=True)
+
+        if self._achievements_repo:
+            self._achievements_repo.invalidate()
+
+        if self._connection_manager:
+            is_logged_in = accounts.check_user_logged_in(self._user_repo)
+            self._connection_manager.close_current()
+            # network jobs can run on any worker, so deliver what's left and
+            # retire the connections in one job instead of relying on queue
+            # order
+            self.job_queue.put(
+                partial(
+                    _finish_network_jobs,
+                    outbox=self._outbox,
+                    connection_manager=self._connection_manager,
+                    job_queue=self.job_queue,
+                    http_session=self._http_session,
+                    deliver_achievements=is_logged_in,
+                    event_loop=self.event_loop,
+                    async_transport=self._async_transport,
+                )
+            )
+
+        if self._user_repo:
+            self._user_repo.invalidate()
+
+        chase_mode.clear_rivalry_cache()
+
+        self._connection_manager = None
+        self._http_settings = None
+        self._http_session = None
+        self._async_transport = None
+        self._user_repo = None
+        self._outbox = None
         self._db_settings = None
         self._reviewing_controller = None
         self._achievements_repo = None
@@ -177,13 +295,16 @@ class ProfileController:
     def get_achievements_repo(self):
         return self._achievements_repo
 
+    @ensure_loaded
+    def get_connection_manager(self):
+        return self._connection_manager
+
     def get_db_connection(self):
-        return get_db_connection(self._db_settings)
+        return self._connection_manager.connection()
 
     @ensure_loaded
     def get_current_game_id(self):
-        get_db_for_profile = partial(get_db_connection, self._db_settings)
-        return SettingsRepository(get_db_for_profile).current_game_id
+        return self.get_settings_repo().current_game_id
 
     @ensure_loaded
     def get_reviewing_controller(self):
@@ -191,13 +312,46 @@ class ProfileController:
 
     @ensure_loaded
     def get_settings_repo(self):
-        get_db_for_profile = partial(get_db_connection, self._db_settings)
-        return SettingsRepository(get_db_for_profile)
+        return SettingsRepository(self._connection_manager.connection)
 
     @ensure_loaded
     def get_user_repo(self):
-        get_db_for_profile = partial(get_db_connection, self._db_settings)
-        return UserRepository(get_db_for_profile)
+        return self._user_repo
+
+    @ensure_loaded
+    def get_http_client(self, shared_headers=shared_headers):
+        return self._build_http_client(
+            self.get_user_repo(), shared_headers=shared_headers
+        )
+
+    def _build_http_client(self, user_repo, shared_headers=shared_headers):
+        return TokenAuthHttpClient(
+            user_repo,
+            shared_headers=shared_headers,
+            session=self._http_session,
+            timeout=self._http_settings.timeout,
+        )
+
+    @ensure_loaded
+    def get_async_http_client(self, shared_headers=shared_headers):
+        """None unless the asyncio network backend is turned on"""
+        if self._async_transport is None:
+            return None
+
+        return async_networking.AsyncTokenAuthHttpClient(
+            self.get_user_repo(),
+            self._async_transport,
+            shared_headers=shared_headers,
+            timeout=self._http_settings.timeout,
+        )
+
+    @ensure_loaded
+    def get_outbox(self):
+        return self._outbox
+
+    @ensure_loaded
+    def get_sync_state_repo(self):
+        return SyncStateRepository(self._connection_manager.connection)
 
 
 def call_method_on_object_from_factory_function(
@@ -278,3 +432,17 @@ class AllMedalsAchievedNotifier:
 
     def __getattr__(self, attr):
         return getattr(self.controller, attr)
+
+
+@attr.s
+class AnswerListeningController:
+    controller = attr.ib()
+    _on_answered = attr.ib()
+
+    def on_answer(self, *args, **kwargs):
+        earned_medals = self.controller.on_answer(*args, **kwargs)
+        self._on_answered(earned_medals)
+        return earned_medals
+
+    def __getattr__(self, attr):
+        return getattr(self.controller, attr)
@@ -0,0 +1,186 @@
+"""
+Anki Killstreaks add-on
+
+Works out which parts of an html fragment changed between two renders, so
+chase mode can patch just those elements in the webview instead of
+replacing the whole panel.
+
+A patch is a list of [path, tag, kind, html] where path is the list of
+element child indices from the container down to the element, tag is that
+element's tag name, and kind is "outer" to replace the element or "inner"
+to replace its contents. An empty path with kind "inner" is the whole
+container. web/chase_mode.js applies them.
+
+Copyright: (c) jac241 2019-2021 <https://github.com/jac241>
+License: GNU AGPLv3 or later <https://www.gnu.org/licenses/agpl.html>
+"""
+from html.parser import HTMLParser
+
+
+_void_tags = frozenset(
+    "area base br col embed hr img input link meta param source track wbr".split()
+)
+
+# browsers close an open <p> before these, so the tree would differ from ours
+_block_tags = frozenset(
+    "address article aside blockquote div dl fieldset footer form h1 h2 h3 "
+    "h4 h5 h6 header hr main nav ol p pre section table ul".split()
+)
+
+
+class Unpatchable(Exception):
+    """The html isn't regular enough to be sure the browser's tree matches"""
+
+
+class _Element:
+    def __init__(self, tag, attrs, start, inner_start):
+        self.tag = tag
+        self.attrs = attrs
+        self.start = start
+        self.inner_start = inner_start
+        self.inner_end = inner_start
+        self.end = inner_start
+        self.children = []
+
+
+class _TreeBuilder(HTMLParser):
+    def __init__(self, html):
+        super().__init__(convert_charrefs=True)
+        self._html = html
+        # getpos() only counts "\n" as a line break, unlike splitlines()
+        self._line_offsets = [0]
+        for line in html.split("\n"):
+            self._line_offsets.append(self._line_offsets[-1] + len(line) + 1)
+
+        self.root = _Element(tag=None, attrs=(), start=0, inner_start=0)
+        self.root.inner_end = self.root.end = len(html)
+        self._open = [self.root]
+
+    def handle_starttag(self, tag, attrs):
+        parent = self._open[-1]
+        if parent.tag == "p" and tag in _block_tags:
+            raise Unpatchable(f"<{tag}> inside <p>")
+
+        start = self._offset()
+        element = _Element(
+            tag, tuple(attrs), start, start + len(self.get_starttag_text())
+        )
+        parent.children.append(element)
+
+        if tag not in _void_tags:
+            self._open.append(element)
+
+    def handle_startendtag(self, tag, attrs):
+        start = self._offset()
+        self._open[-1].children.append(
+            _Element(
+                tag, tuple(attrs), start, start + len(self.get_starttag_text())
+            )
+        )
+
+    def handle_endtag(self, tag):
+        if tag in _void_tags:
+            return
+
+        element = self._open.pop()
+        if element.tag != tag:
+            raise Unpatchable(f"</{tag}> closes <{element.tag}>")
+
+        element.inner_end = self._offset()
+        element.end = self._html.index(">", element.inner_end) + 1
+
+    def close(self):
+        super().close()
+        if len(self._open) > 1:
+            raise Unpatchable(f"<{self._open[-1].tag}> is never closed")
+
+    def _offset(self):
+        line, column = self.getpos()
+        return self._line_offsets[line - 1] + column
+
+
+def _parse(html):
+    builder = _TreeBuilder(html)
+    builder.feed(html)
+    builder.close()
+    return builder.root
+
+
+def diff(old_html, new_html):
+    """
+    Patch turning old_html into new_html, an empty list if they're the
+    same, or None if they can't be patched reliably and should be
+    rendered in full.
+    """
+    if old_html == new_html:
+        return []
+
+    try:
+        old_root, new_root = _parse(old_html), _parse(new_html)
+    except Unpatchable as e:
+        print("Rendering chase mode in full:", e)
+        return None
+
+    patch = []
+    _diff_element(old_root, old_html, new_root, new_html, [], patch)
+    return patch
+
+
+def _diff_element(old, old_html, new, new_html, path, patch):
+    if _inner(old, old_html) == _inner(new, new_html):
+        return
+
+    if not _same_shape(old, old_html, new, new_html):
+        patch.append([path, new.tag, "inner", _inner(new, new_html)])
+        return
+
+    for i, (old_child, new_child) in enumerate(zip(old.children, new.children)):
+        if _outer(old_child, old_html) == _outer(new_child, new_html):
+            continue
+
+        if (
+            old_child.tag != new_child.tag
+            or old_child.attrs != new_child.attrs
+            or new_child.tag in _void_tags
+        ):
+            patch.append(
+                [path + [i], new_child.tag, "outer", _outer(new_child, new_html)]
+            )
+        else:
+            _diff_element(
+                old_child, old_html, new_child, new_html, path + [i], patch
+            )
+
+
+def _same_shape(old, old_html, new, new_html):
+    """Whether the children line up one to one with the same text between"""
+    if len(old.children) != len(new.children):
+        return False
+
+    # browsers wrap rows written straight into a table in a <tbody>
+    if new.tag == "table" and any(c.tag == "tr" for c in new.children):
+        return False
+
+    return _text_between_children(old, old_html) == _text_between_children(
+        new, new_html
+    )
+
+
+def _text_between_children(element, html):
+    boundaries = (
+        [element.inner_start]
+        + [offset for c in element.children for offset in (c.start, c.end)]
+        + [element.inner_end]
+    )
+    return [
+        html[start:end]
+        for start, end in zip(boundaries[::2], boundaries[1::2])
+    ]
+
+
+def _inner(element, html):
+    return html[element.inner_start:element.inner_end]
+
+
+def _outer(element, html):
+    return html[element.start:element.end]
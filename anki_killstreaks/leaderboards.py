@@ -1,14 +1,16 @@
-import codecs
 from datetime import datetime, timedelta
 from functools import partial
 import json
 import requests
+import tempfile
+import threading
 from urllib.parse import urljoin
 import uuid
+import zlib
 
 from . import accounts
 from ._vendor import attr
-from .networking import sra_base_url, RequeuingJob
+from .networking import sra_base_url, JobPriority, RequeuingJob
 from .persistence import PersistedAchievement, min_datetime
 
 
@@ -19,31 +21,95 @@ def ensure_client_uuid_exists(user_repo):
         user_repo.set_client_uuid(str(uuid.uuid4()))
 
 
-def sync_if_logged_in(user_repo, achievements_repo, network_thread, http_client):
+def sync_if_logged_in(
+    user_repo,
+    achievements_repo,
+    sync_state_repo,
+    network_thread,
+    http_client,
+    outbox,
+):
     if accounts.check_user_logged_in(user_repo):
         sync_job = RequeuingJob(
             partial(
-                _sync_achievements,
-                user_repo,
-                achievements_repo,
-                http_client,
+                outbox.deliver_after_sync,
+                partial(
+                    _sync_achievements,
+                    user_repo,
+                    achievements_repo,
+                    sync_state_repo,
+                    http_client,
+                ),
             ),
             job_queue=network_thread,
-            exception_to_retry_on=requests.exceptions.ConnectionError,
+            exception_to_retry_on=(
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ),
+            priority=JobPriority.BULK,
         )
         network_thread.put(sync_job)
 
 
-def _sync_achievements(user_repo, achievements_repo, http_client):
+# keeps each request well inside the HTTP read timeout
+_sync_chunk_size = 5000
+
+
+def _sync_achievements(
+    user_repo,
+    achievements_repo,
+    sync_state_repo,
+    http_client,
+    chunk_size=None,
+):
+    """
+    Uploads achievements earned since the server's last sync in chunks
+    ordered by local id. Every acknowledged chunk is checkpointed in
+    sync_state, so when a retry runs after a failure it picks up after
+    the last acknowledged chunk instead of starting over.
+    """
+    chunk_size = chunk_size or _sync_chunk_size
+
     try:
-        since_datetime = _get_latest_sync_date(user_repo, http_client)
-        achievements_attrs = _load_achievements_attrs_since(achievements_repo, since_datetime)
-        compressed_attrs = _compress_achievements_attrs(achievements_attrs)
+        sync_state = sync_state_repo.load_in_progress()
+        if sync_state is None:
+            sync_state = sync_state_repo.start(
+                _get_latest_sync_date(user_repo, http_client)
+            )
 
-        response = _post_compressed_achievements(user_repo, http_client, compressed_attrs)
-        accounts.store_auth_headers(user_repo, response.headers)
+        while True:
+            chunk = achievements_repo.page_since(
+                since_datetime=sync_state.since_datetime,
+                after_id=sync_state.last_acknowledged_id,
+                limit=chunk_size,
+            )
+            if len(chunk) == 0:
+                sync_state_repo.finish(
+                    last_synced_id=sync_state.last_acknowledged_id
+                )
+                break
+
+            achievements_attrs = _iter_achievements_attrs(
+                a for a in chunk if a.medal is not None
+            )
+
+            with _compress_achievements_attrs(
+                achievements_attrs
+            ) as compressed_attrs:
+                response = _post_compressed_achievements(
+                    user_repo, http_client, compressed_attrs
+                )
 
-        response.raise_for_status()
+            accounts.store_auth_headers(user_repo, response.headers)
+            response.raise_for_status()
+
+            if len(chunk) < chunk_size:
+                sync_state_repo.finish(last_synced_id=chunk[-1].id_)
+                break
+
+            sync_state = sync_state_repo.acknowledge(
+                sync_state, last_acknowledged_id=chunk[-1].id_
+            )
     except requests.HTTPError as e:
         print(e)
         raise e
@@ -64,18 +130,44 @@ def _get_latest_sync_date(user_repo, http_client):
         return datetime.now() - timedelta(days=32)
 
 
-def _load_achievements_attrs_since(achievements_repo, since_datetime):
-    return [
-        attr.asdict(a, filter=attr.filters.exclude(attr.fields(PersistedAchievement).medal))
-        for a in achievements_repo.all(since_datetime)
-    ]
+def _iter_achievements_attrs(achievements):
+    exclude_medal = attr.filters.exclude(attr.fields(PersistedAchievement).medal)
+    return (attr.asdict(a, filter=exclude_medal) for a in achievements)
+
+
+# compressed payloads bigger than this are spooled to a temp file
+_max_in_memory_payload_bytes = 1024 * 1024
+_json_flush_threshold_bytes = 64 * 1024
 
 
 def _compress_achievements_attrs(attrs):
-    return codecs.encode(
-        bytes(json.dumps(attrs), "utf-8"),
-        "zlib",
+    """
+    Encodes attrs as a JSON array and zlib compresses it as it goes, so
+    neither the list of attrs nor the full JSON string is ever held in
+    memory. Returns the compressed payload as a file object positioned at
+    the start.
+    """
+    payload = tempfile.SpooledTemporaryFile(
+        max_size=_max_in_memory_payload_bytes
     )
+    compressor = zlib.compressobj()
+    pending_json = bytearray(b"[")
+
+    for i, achievement_attrs in enumerate(attrs):
+        if i > 0:
+            pending_json += b", "
+        pending_json += json.dumps(achievement_attrs).encode("utf-8")
+
+        if len(pending_json) >= _json_flush_threshold_bytes:
+            payload.write(compressor.compress(pending_json))
+            pending_json.clear()
+
+    pending_json += b"]"
+    payload.write(compressor.compress(pending_json))
+    payload.write(compressor.flush())
+    payload.seek(0)
+
+    return payload
 
 
 def _post_compressed_achievements(user_repo, http_client, compressed_attrs):
@@ -93,7 +185,6 @@ def _post_compressed_achievements(user_repo, http_client, compressed_attrs):
                 "application/zlib",
             )
         },
-        timeout=5,
         skip_shared_headers=True
     )
 
@@ -106,41 +197,255 @@ def _post_compressed_achievements(user_repo, http_client, compressed_attrs):
 class RemoteAchievementsRepository:
     _local_repo = attr.ib()
     _user_repo = attr.ib()
-    _job_queue = attr.ib()
-    _http_client = attr.ib()
-
-    def create_all(self, *args, **kwargs):
-        persisted_achievements = self._local_repo.create_all(*args, **kwargs)
-        if accounts.check_user_logged_in(self._user_repo):
-            for achievement in persisted_achievements:
-                job = RequeuingJob(
-                    partial(
-                        _post_achievement,
-                        user=self._user_repo.load(),
-                        achievement=achievement,
-                        http_client=self._http_client,
-                    ),
-                    job_queue=self._job_queue,
-                    exception_to_retry_on=requests.exceptions.ConnectionError,
-                )
-                self._job_queue.put(job)
+    _outbox = attr.ib()
+
+    def create_all(self, new_achievements):
+        is_logged_in = accounts.check_user_logged_in(self._user_repo)
+        persisted_achievements = self._local_repo.create_all(
+            new_achievements, queue_for_upload=is_logged_in
+        )
+
+        if len(persisted_achievements) > 0 and is_logged_in:
+            self._outbox.deliver_pending(
+                new_achievement_count=len(persisted_achievements)
+            )
+
+        return persisted_achievements
 
     def __getattr__(self, attr):
         return getattr(self._local_repo, attr)
 
 
+@attr.s(frozen=True)
+class UploadSettings:
+    window_s = attr.ib(default=0.5)
+    batch_size = attr.ib(default=50)
+
+    @classmethod
+    def from_config(cls, config):
+        defaults = cls()
+        return cls(
+            window_s=config.get(
+                "achievement_upload_window_ms", defaults.window_s * 1000
+            )
+            / 1000,
+            batch_size=config.get(
+                "achievement_upload_batch_size", defaults.batch_size
+            ),
+        )
+
+
+class AchievementOutbox:
+    """
+    Delivers achievements queued in the achievement_outbox table from the
+    network thread. Medals saved within upload_settings.window_s of each
+    other are coalesced into one batched request; the window is cut short
+    once batch_size achievements are waiting or when flush() is called.
+    Only one delivery job is queued at a time, and it keeps posting until
+    nothing is left, so achievements saved while it runs are picked up too.
+
+    Nothing is delivered while a leaderboard sync is in progress, even one
+    waiting to be retried, since the sync uploads the same achievements.
+    """
+
+    def __init__(
+        self,
+        outbox_repo,
+        user_repo,
+        http_client,
+        job_queue,
+        sync_state_repo,
+        upload_settings=UploadSettings(),
+        start_timer=None,
+    ):
+        self._outbox_repo = outbox_repo
+        self._user_repo = user_repo
+        self._sync_state_repo = sync_state_repo
+        self._http_client = http_client
+        self._job_queue = job_queue
+        self._upload_settings = upload_settings
+        self._start_timer = start_timer or job_queue.call_later
+        self._delivery_queued = False
+        self._window_id = None
+        self._achievements_in_window = 0
+        self._supports_batches = True
+        self._lock = threading.Lock()
+        self._delivery_lock = threading.Lock()
+        self.requests_sent = 0
+        self.achievements_delivered = 0
+
+    def deliver_pending(self, new_achievement_count=0):
+        with self._lock:
+            self._achievements_in_window += new_achievement_count
+
+            if (
+                self._upload_settings.window_s <= 0
+                or self._achievements_in_window
+                >= self._upload_settings.batch_size
+            ):
+                self._queue_delivery()
+            elif self._window_id is None:
+                self._window_id = object()
+                self._start_timer(
+                    self._upload_settings.window_s,
+                    partial(self._close_window, self._window_id),
+                )
+
+    def flush(self):
+        with self._lock:
+            self._queue_delivery()
+
+    def deliver_after_sync(self, sync_achievements):
+        """
+        Runs sync_achievements with deliveries held off, then delivers
+        what the sync didn't cover. A finished sync marks what it uploaded
+        as delivered.
+        """
+        with self._delivery_lock:
+            sync_achievements()
+
+        self.flush()
+
+    @property
+    def pending_count(self):
+        return self._outbox_repo.pending_count()
+
+    @property
+    def upload_stats(self):
+        return dict(
+            requests=self.requests_sent,
+            achievements=self.achievements_delivered,
+            requests_per_achievement=(
+                self.requests_sent / self.achievements_delivered
+                if self.achievements_delivered
+                else 0.0
+            ),
+        )
+
+    def _close_window(self, window_id):
+        with self._lock:
+            # a flush may have already closed it
+            if window_id is self._window_id:
+                self._queue_delivery()
+
+    def _queue_delivery(self):
+        self._window_id = None
+        self._achievements_in_window = 0
+
+        if self._delivery_queued:
+            return
+        self._delivery_queued = True
+
+        self._job_queue.put(
+            RequeuingJob(
+                self.deliver_now,
+                job_queue=self._job_queue,
+                exception_to_retry_on=(
+                    requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout,
+                ),
+            )
+        )
+
+    def deliver_now(self):
+        with self._delivery_lock:
+            with self._lock:
+                self._delivery_queued = False
+
+            if self._sync_state_repo.load_in_progress() is not None:
+                print("Leaderboard sync in progress, delivering after it")
+                return
+
+            user = self._user_repo.load()
+
+            while True:
+                batch = self._outbox_repo.pending(
+                    limit=self._upload_settings.batch_size
+                )
+                if len(batch) == 0:
+                    break
+
+                if self._supports_batches:
+                    self._deliver_batch(user, batch)
+                else:
+                    for achievement in batch:
+                        self._deliver_one(user, achievement)
+
+    def _deliver_batch(self, user, achievements):
+        try:
+            self.requests_sent += 1
+            _post_achievements(user, self._http_client, achievements)
+        except requests.HTTPError as e:
+            if _endpoint_missing(e.response):
+                # older server, fall back to one request per achievement
+                self._supports_batches = False
+                for achievement in achievements:
+                    self._deliver_one(user, achievement)
+                return
+            self._raise_unless_rejected(e, achievements)
+
+        self._mark_delivered(achievements)
+
+    def _deliver_one(self, user, achievement):
+        try:
+            self.requests_sent += 1
+            _post_achievement(user, self._http_client, achievement)
+        except requests.HTTPError as e:
+            self._raise_unless_rejected(e, [achievement])
+
+        self._mark_delivered([achievement])
+
+    def _raise_unless_rejected(self, error, achievements):
+        if not _server_rejected(error.response):
+            raise error
+        # retrying won't help, the bulk sync still covers them
+        print(
+            "Server rejected achievements", [a.id_ for a in achievements], error
+        )
+
+    def _mark_delivered(self, achievements):
+        self._outbox_repo.mark_delivered([a.id_ for a in achievements])
+        self.achievements_delivered += len(achievements)
+
+
+def _endpoint_missing(response):
+    return response.status_code in (404, 405)
+
+
+def _server_rejected(response):
+    return 400 <= response.status_code < 500 and response.status_code not in (
+        401,
+        408,
+        429,
+    )
+
+
+def _achievement_attrs(user, achievement):
+    return dict(
+        client_db_id=achievement.id_,
+        client_db_uuid=achievement.uuid,
+        client_medal_id=achievement.medal_id,
+        client_deck_id=achievement.deck_id,
+        client_earned_at=achievement.created_at,
+        client_uuid=user.client_uuid,
+    )
+
+
 def _post_achievement(user, http_client, achievement):
     response = http_client.post(
         url=urljoin(sra_base_url, "/api/v1/achievements"),
+        json=_achievement_attrs(user, achievement),
+    )
+
+    response.raise_for_status()
+
+
+def _post_achievements(user, http_client, achievements):
+    response = http_client.post(
+        url=urljoin(sra_base_url, "/api/v1/achievements/batch"),
         json=dict(
-            client_db_id=achievement.id_,
-            client_db_uuid=achievement.uuid,
-            client_medal_id=achievement.medal_id,
-            client_deck_id=achievement.deck_id,
-            client_earned_at=achievement.created_at,
-            client_uuid=user.client_uuid,
+            achievements=[_achievement_attrs(user, a) for a in achievements]
         ),
     )
 
     response.raise_for_status()
-
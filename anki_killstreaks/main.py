@@ -17,9 +17,7 @@ from datetime import datetime, timedelta
 from functools import partial, wraps
 import os
 from pathlib import Path
-from queue import Queue
 import random
-from threading import Thread
 from urllib.parse import urljoin
 
 from aqt import mw, gui_hooks
@@ -30,7 +28,7 @@ from aqt.overview import Overview
 from anki.hooks import addHook, wrap
 from anki.stats import CollectionStats
 
-from . import chase_mode
+from . import async_networking, chase_mode
 from .config import local_conf
 from .controllers import (
     ProfileController,
@@ -39,7 +37,11 @@ from .controllers import (
     call_method_on_object_from_factory_function,
 )
 from .menu import connect_menu
-from .networking import process_queue, stop_thread_on_app_close
+from .networking import (
+    ExecutorSettings,
+    JobExecutor,
+    stop_executor_on_app_close,
+)
 from .persistence import day_start_time, min_datetime
 from .streaks import get_stores_by_game_id
 from .views import (
@@ -64,9 +66,20 @@ def _get_profile_folder_path(profile_manager=mw.pm):
 
 _stores_by_game_id = get_stores_by_game_id(config=local_conf)
 
-job_queue = Queue()
-_network_thread = Thread(target=process_queue, args=(job_queue,), daemon=True)
-stop_thread_on_app_close(app=QApplication.instance(), queue=job_queue)
+_executor_settings = ExecutorSettings.from_config(local_conf)
+job_queue = JobExecutor(_executor_settings)
+stop_executor_on_app_close(
+    app=QApplication.instance(),
+    executor=job_queue,
+    timeout_s=_executor_settings.drain_timeout_s,
+)
+
+_event_loop = None
+if async_networking.is_enabled(local_conf):
+    _event_loop = async_networking.EventLoopThread()
+    QApplication.instance().aboutToQuit.connect(
+        partial(_event_loop.stop, timeout_s=_executor_settings.drain_timeout_s)
+    )
 
 
 _profile_controller = ProfileController(
@@ -76,6 +89,7 @@ _profile_controller = ProfileController(
     stores_by_game_id=_stores_by_game_id,
     job_queue=job_queue,
     main_window=mw,
+    event_loop=_event_loop,
 )
 
 # for debugging
@@ -85,7 +99,9 @@ mw.killstreaks_profile_controller = _profile_controller
 def main():
     _wrap_anki_objects(_profile_controller)
     connect_menu(main_window=mw, profile_controller=_profile_controller, network_thread=job_queue)
-    _network_thread.start()
+    job_queue.start()
+    if _event_loop:
+        _event_loop.start()
 
 
 def _wrap_anki_objects(profile_controller):
@@ -8,7 +8,7 @@ from .game import (
     toggle_auto_switch_game,
     load_auto_switch_game_status,
 )
-from . import profile_settings, networking, chase_mode
+from . import backfill, profile_settings, networking, chase_mode
 
 
 def connect_menu(main_window, profile_controller, network_thread):
@@ -144,9 +144,17 @@ def connect_menu(main_window, profile_controller, network_thread):
             network_thread,
             profile_controller.get_user_repo(),
             profile_controller.get_achievements_repo(),
+            profile_controller.get_sync_state_repo(),
+            profile_controller.get_outbox(),
+            profile_controller.get_http_client(),
         )
     )
 
+    backfill_action = top_menu.addAction("&Rebuild medals from review history...")
+    backfill_action.triggered.connect(
+        lambda: backfill.start_backfill(main_window, profile_controller)
+    )
+
     chase_mode_action = top_menu.addAction("&Chase mode")
     chase_mode_action.setCheckable(True)
     chase_mode_action.triggered.connect(
@@ -0,0 +1,38 @@
+CREATE TABLE daily_medal_counts
+(
+    day      TEXT    NOT NULL,
+    deck_id  INTEGER NOT NULL,
+    medal_id TEXT    NOT NULL,
+    count    INTEGER DEFAULT 0 NOT NULL,
+    PRIMARY KEY (day, deck_id, medal_id)
+) WITHOUT ROWID;
+
+-- day is the date prefix of created_at (UTC), so it orders the same way as
+-- the created_at comparisons the repository makes against raw rows
+CREATE TRIGGER daily_medal_counts_after_achievement_insert
+AFTER INSERT ON achievements
+BEGIN
+    INSERT OR IGNORE INTO daily_medal_counts(day, deck_id, medal_id)
+    VALUES (substr(NEW.created_at, 1, 10), NEW.deck_id, NEW.medal_id);
+
+    UPDATE daily_medal_counts
+    SET count = count + 1
+    WHERE day = substr(NEW.created_at, 1, 10)
+        AND deck_id = NEW.deck_id
+        AND medal_id = NEW.medal_id;
+END;
+
+CREATE TRIGGER daily_medal_counts_after_achievement_delete
+AFTER DELETE ON achievements
+BEGIN
+    UPDATE daily_medal_counts
+    SET count = count - 1
+    WHERE day = substr(OLD.created_at, 1, 10)
+        AND deck_id = OLD.deck_id
+        AND medal_id = OLD.medal_id;
+END;
+
+INSERT INTO daily_medal_counts(day, deck_id, medal_id, count)
+SELECT substr(created_at, 1, 10), deck_id, medal_id, count(*)
+FROM achievements
+GROUP BY substr(created_at, 1, 10), deck_id, medal_id
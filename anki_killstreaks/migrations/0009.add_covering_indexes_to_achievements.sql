@@ -0,0 +1,8 @@
+-- covering indexes for the medal count queries, the single column indexes
+-- from 0001 are prefixes of these so they only slow down inserts now
+CREATE INDEX IF NOT EXISTS achievements_deck_id_created_at_medal_id
+    ON achievements(deck_id, created_at, medal_id);
+CREATE INDEX IF NOT EXISTS achievements_created_at_medal_id
+    ON achievements(created_at, medal_id);
+DROP INDEX IF EXISTS achievements_created_at;
+DROP INDEX IF EXISTS achievements_deck_id
@@ -0,0 +1,8 @@
+CREATE TABLE sync_state (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  since_datetime TEXT,
+  last_acknowledged_id INTEGER DEFAULT 0 NOT NULL,
+  updated_at DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL
+);
+
+INSERT INTO sync_state(since_datetime) VALUES (NULL)
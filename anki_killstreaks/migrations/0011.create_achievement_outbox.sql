@@ -0,0 +1,9 @@
+CREATE TABLE achievement_outbox (
+  achievement_id INTEGER PRIMARY KEY REFERENCES achievements(id),
+  created_at DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+  delivered_at DATETIME
+);
+
+CREATE INDEX IF NOT EXISTS achievement_outbox_pending
+    ON achievement_outbox(achievement_id)
+    WHERE delivered_at IS NULL
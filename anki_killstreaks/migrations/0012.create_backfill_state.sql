@@ -0,0 +1,15 @@
+CREATE TABLE backfill_state (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  game_id TEXT,
+  until_revlog_id INTEGER,
+  last_revlog_id INTEGER DEFAULT 0 NOT NULL,
+  streak_indexes TEXT,
+  medals_created INTEGER DEFAULT 0 NOT NULL,
+  updated_at DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL
+);
+
+INSERT INTO backfill_state(game_id) VALUES (NULL);
+
+-- rebuilt medals stay on this computer, syncs skip them
+ALTER TABLE achievements
+ADD COLUMN backfilled BOOLEAN DEFAULT 0 NOT NULL
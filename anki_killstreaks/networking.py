@@ -1,9 +1,15 @@
+from collections import deque
+import enum
+import heapq
+import itertools
 import os
 from functools import partialmethod, partial
 import random
+import threading
 from threading import Thread
 import time
 import requests
+from requests.adapters import HTTPAdapter
 import traceback
 
 if not (os.environ.get("KILLSTREAKS_ENV", "production") == "test"):
@@ -29,45 +35,388 @@ shared_headers = {
 }
 
 
-stop_sentinel = "__stop!__"
+class JobPriority(enum.IntEnum):
+    """Lower runs first"""
 
+    INTERACTIVE = 0  # chase mode, login, the profile settings dialog
+    LIVE = 1  # achievements earned while reviewing
+    BULK = 2  # leaderboard syncs
 
-def process_queue(queue):
-    while True:
-        job = queue.get()
 
-        if job == stop_sentinel:
-            print("network thread stopped! :-)")
-            break
+@attr.s(frozen=True)
+class RetryPolicy:
+    max_backoff_s = attr.ib(default=300)
+    max_attempts = attr.ib(default=8)
+
+    @classmethod
+    def from_config(cls, config):
+        defaults = cls()
+        return cls(
+            max_backoff_s=config.get(
+                "network_max_backoff_s", defaults.max_backoff_s
+            ),
+            max_attempts=config.get(
+                "network_max_attempts", defaults.max_attempts
+            ),
+        )
+
+    def delay_s(self, attempt, rng=random):
+        """
+        Seconds to wait before running a job again after its attempt-th
+        try failed, or None once it has had max_attempts tries.
+        """
+        if attempt >= self.max_attempts:
+            return None
+
+        jitter_s = rng.uniform(0, 1)
+        return min(2 ** attempt, self.max_backoff_s) + jitter_s
+
+
+@attr.s(frozen=True)
+class ExecutorSettings:
+    worker_count = attr.ib(default=3)
+    interactive_limit = attr.ib(default=3)
+    live_limit = attr.ib(default=1)
+    bulk_limit = attr.ib(default=1)
+    drain_timeout_s = attr.ib(default=5)
+    retry_policy = attr.ib(factory=RetryPolicy)
+    failures_to_open_circuit = attr.ib(default=3)
+    circuit_open_s = attr.ib(default=30)
+
+    @classmethod
+    def from_config(cls, config):
+        defaults = cls()
+        return cls(
+            worker_count=config.get(
+                "network_worker_count", defaults.worker_count
+            ),
+            interactive_limit=config.get(
+                "network_interactive_limit", defaults.interactive_limit
+            ),
+            live_limit=config.get("network_live_limit", defaults.live_limit),
+            bulk_limit=config.get("network_bulk_limit", defaults.bulk_limit),
+            drain_timeout_s=config.get(
+                "network_drain_timeout_s", defaults.drain_timeout_s
+            ),
+            retry_policy=RetryPolicy.from_config(config),
+            failures_to_open_circuit=config.get(
+                "network_failures_to_open_circuit",
+                defaults.failures_to_open_circuit,
+            ),
+            circuit_open_s=config.get(
+                "network_circuit_open_s", defaults.circuit_open_s
+            ),
+        )
+
+    def limit_for(self, priority):
+        return {
+            JobPriority.INTERACTIVE: self.interactive_limit,
+            JobPriority.LIVE: self.live_limit,
+            JobPriority.BULK: self.bulk_limit,
+        }[priority]
+
+
+class JobExecutor:
+    """
+    Runs network jobs on a small pool of worker threads, so a long sync
+    doesn't hold chase mode refreshes and achievement uploads up behind it.
+    Workers always take the highest priority job whose class is under its
+    concurrency limit. Has the same put(job) as the Queue it replaced; jobs
+    with a priority attribute, like RequeuingJob, are queued at that
+    priority and everything else at LIVE.
+    """
+
+    def __init__(self, settings=ExecutorSettings(), clock=time.monotonic):
+        self._settings = settings
+        self._clock = clock
+        self._scheduler = DelayedJobScheduler(clock=clock)
+        self._circuit_breaker = CircuitBreaker(
+            failures_to_open=settings.failures_to_open_circuit,
+            open_s=settings.circuit_open_s,
+            clock=clock,
+        )
+        self._jobs_by_priority = {p: deque() for p in JobPriority}
+        self._running_by_priority = {p: 0 for p in JobPriority}
+        self._stats_by_priority = {p: _JobStats() for p in JobPriority}
+        self._condition = threading.Condition()
+        self._workers = []
+        self._accepting_jobs = True
+        self._after_job_callbacks = []
+
+    def put(self, job, priority=None):
+        if priority is None:
+            priority = getattr(job, "priority", JobPriority.LIVE)
+
+        with self._condition:
+            if not self._accepting_jobs:
+                print("Network executor shut down, dropping -", job)
+                return
+
+            self._jobs_by_priority[priority].append((self._clock(), job))
+            self._condition.notify()
+
+    def call_later(self, delay_s, function):
+        self._scheduler.call_later(delay_s, function)
+
+    def call_after_each_job(self, callback):
+        """
+        Calls callback on each worker after every job it runs, whenever
+        it's woken up with nothing to run, and as it stops. Lets a worker
+        close things its jobs left open on its thread, like database
+        connections.
+        """
+        with self._condition:
+            self._after_job_callbacks.append(callback)
+
+    def wake_idle_workers(self):
+        """Has workers with nothing to run call the after job callbacks"""
+        with self._condition:
+            self._condition.notify_all()
+
+    def retry_later(self, job, attempt):
+        """
+        Queues job again once the retry policy's backoff for its attempt-th
+        failure has passed. Returns False if it has run out of attempts.
+        """
+        delay_s = self._settings.retry_policy.delay_s(attempt)
+        if delay_s is None:
+            return False
+
+        print("Will requeue job after", delay_s, "seconds")
+        self.call_later(delay_s, partial(self.put, job))
+        return True
+
+    def report_unreachable(self):
+        with self._condition:
+            self._circuit_breaker.record_failure()
+
+    def report_reachable(self):
+        with self._condition:
+            self._circuit_breaker.record_success()
+            self._condition.notify_all()
 
+    def start(self):
+        self._scheduler.start()
+
+        for i in range(self._settings.worker_count):
+            worker = Thread(
+                target=self._work, name=f"killstreaks-network-{i}", daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def shutdown(self, timeout_s=None):
+        """
+        Stops taking new jobs and lets the workers finish the queued ones.
+        Returns whether they all finished within timeout_s.
+        """
+        self._scheduler.stop()
+
+        with self._condition:
+            self._accepting_jobs = False
+            self._condition.notify_all()
+
+        deadline = None if timeout_s is None else self._clock() + timeout_s
+        for worker in self._workers:
+            worker.join(
+                None if deadline is None else max(0, deadline - self._clock())
+            )
+
+        print("Network executor stopped:", self.metrics)
+        return not any(worker.is_alive() for worker in self._workers)
+
+    @property
+    def queue_depth(self):
+        with self._condition:
+            return self._queued_count()
+
+    @property
+    def metrics(self):
+        with self._condition:
+            metrics = {
+                priority.name.lower(): dict(
+                    queued=len(self._jobs_by_priority[priority]),
+                    running=self._running_by_priority[priority],
+                    **self._stats_by_priority[priority].as_dict(),
+                )
+                for priority in JobPriority
+            }
+            metrics["scheduled_retries"] = self._scheduler.pending_count
+            metrics["circuit_open"] = self._circuit_breaker.is_open()
+            return metrics
+
+    def _work(self):
         try:
-            print("Executing -", job)
-            job()
-            print("Finished.")
-        except Exception as e:
-            print("Exception encountered in killstreaks job thread:")
-            print(traceback.format_exc())
+            self._take_and_run_jobs()
         finally:
-            queue.task_done()
-    return
+            self._run_after_job_callbacks()
+
+    def _take_and_run_jobs(self):
+        while True:
+            with self._condition:
+                next_job = self._take_next_job()
+                if next_job is None:
+                    if not self._accepting_jobs and self._queued_count() == 0:
+                        return
+                    # while the circuit is open nothing is taken, so wake up
+                    # again when it's time to try the server
+                    self._condition.wait(
+                        self._circuit_breaker.remaining_open_s() or None
+                    )
+                    next_job = self._take_next_job()
+
+                if next_job is not None:
+                    priority, enqueued_at, job = next_job
+                    self._running_by_priority[priority] += 1
+
+            if next_job is None:
+                self._run_after_job_callbacks()
+                continue
+
+            started_at = self._clock()
+            failed = False
+            try:
+                print("Executing -", job)
+                job()
+                print("Finished.")
+            except Exception:
+                failed = True
+                print("Exception encountered in killstreaks job thread:")
+                print(traceback.format_exc())
+            finally:
+                with self._condition:
+                    self._running_by_priority[priority] -= 1
+                    self._stats_by_priority[priority].record(
+                        wait_s=started_at - enqueued_at,
+                        run_s=self._clock() - started_at,
+                        failed=failed,
+                    )
+                    self._condition.notify_all()
+
+            self._run_after_job_callbacks()
+
+    def _run_after_job_callbacks(self):
+        with self._condition:
+            callbacks = list(self._after_job_callbacks)
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                print("Exception encountered in killstreaks after job callback:")
+                print(traceback.format_exc())
+
+    def _queued_count(self):
+        return sum(len(jobs) for jobs in self._jobs_by_priority.values())
+
+    def _take_next_job(self):
+        if self._circuit_breaker.is_open():
+            return None
+
+        for priority in JobPriority:
+            jobs = self._jobs_by_priority[priority]
+            if jobs and (
+                self._running_by_priority[priority]
+                < self._settings.limit_for(priority)
+            ):
+                enqueued_at, job = jobs.popleft()
+                return priority, enqueued_at, job
+
+        return None
+
+
+class _JobStats:
+    def __init__(self):
+        self.completed = 0
+        self.failed = 0
+        self.total_wait_s = 0.0
+        self.max_wait_s = 0.0
+        self.total_run_s = 0.0
+
+    def record(self, wait_s, run_s, failed):
+        self.completed += 1
+        self.failed += int(failed)
+        self.total_wait_s += wait_s
+        self.max_wait_s = max(self.max_wait_s, wait_s)
+        self.total_run_s += run_s
+
+    def as_dict(self):
+        return dict(
+            completed=self.completed,
+            failed=self.failed,
+            mean_wait_ms=self._mean_ms(self.total_wait_s),
+            max_wait_ms=self.max_wait_s * 1000,
+            mean_run_ms=self._mean_ms(self.total_run_s),
+        )
+
+    def _mean_ms(self, total_s):
+        return total_s / self.completed * 1000 if self.completed else 0.0
 
 
-def stop_thread_on_app_close(app, queue):
+def stop_executor_on_app_close(app, executor, timeout_s):
     def stop():
-        queue.put(stop_sentinel)
+        executor.shutdown(timeout_s=timeout_s)
 
     app.aboutToQuit.connect(stop)
 
 
+@attr.s(frozen=True)
+class HttpSettings:
+    pool_size = attr.ib(default=4)
+    connect_timeout_s = attr.ib(default=5)
+    read_timeout_s = attr.ib(default=30)
+
+    @classmethod
+    def from_config(cls, config):
+        defaults = cls()
+        return cls(
+            pool_size=config.get("http_pool_size", defaults.pool_size),
+            connect_timeout_s=config.get(
+                "http_connect_timeout_s", defaults.connect_timeout_s
+            ),
+            read_timeout_s=config.get(
+                "http_read_timeout_s", defaults.read_timeout_s
+            ),
+        )
+
+    @property
+    def timeout(self):
+        return (self.connect_timeout_s, self.read_timeout_s)
+
+
+default_timeout = HttpSettings().timeout
+
+
+def build_http_session(settings=HttpSettings()):
+    """
+    Keeps connections to the server alive between requests, so chase mode
+    polls and achievement uploads don't each pay for a new TCP and TLS
+    handshake. Owned by the ProfileController and closed on profile unload.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
 @attr.s
 class TokenAuthHttpClient:
     _user_repo = attr.ib()
     _shared_headers = attr.ib(default=shared_headers)
-
-    def _do_request(self, method, skip_shared_headers=False, **kwargs):
-        response = getattr(requests, method)(
+    _session = attr.ib(default=requests)
+    _timeout = attr.ib(default=default_timeout)
+
+    def _do_request(
+        self, method, skip_shared_headers=False, headers=None, **kwargs
+    ):
+        kwargs.setdefault("timeout", self._timeout)
+        response = getattr(self._session, method)(
             **kwargs,
-            headers=self._headers_for_request(skip_shared_headers)
+            headers={
+                **self._headers_for_request(skip_shared_headers),
+                **(headers or {}),
+            },
         )
 
         if response.status_code != 401:
@@ -120,54 +469,159 @@ class StatusListeningHttpClient(QObject):
     delete = partialmethod(_do_request, 'delete')
 
 
-class DaemonTimer:
-    def __init__(self, function, interval):
-        self._function = function
-        self._interval = interval
+class DelayedJobScheduler:
+    """
+    One thread that calls functions once their delay has passed, kept in a
+    heap ordered by due time, instead of a sleeping thread per retry. Tests
+    can skip start() and call run_due() with a fake clock instead.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._due_calls = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def call_later(self, delay_s, function):
+        with self._condition:
+            heapq.heappush(
+                self._due_calls,
+                (self._clock() + delay_s, next(self._sequence), function),
+            )
+            self._condition.notify()
+
+    @property
+    def pending_count(self):
+        with self._condition:
+            return len(self._due_calls)
+
+    def run_due(self):
+        """Calls everything that is due, returning how many were called"""
+        called = 0
+        for function in self._pop_due():
+            self._call(function)
+            called += 1
+        return called
 
     def start(self):
-        thread = Thread(target=self._wait_then_call_func, daemon=True)
-        thread.start()
-        return thread
+        self._thread = Thread(
+            target=self._run, name="killstreaks-scheduler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped and not self._has_due_calls():
+                    self._condition.wait(self._seconds_until_next_call())
+                if self._stopped:
+                    return
+
+            self.run_due()
+
+    def _pop_due(self):
+        with self._condition:
+            due = []
+            while self._has_due_calls():
+                due.append(heapq.heappop(self._due_calls)[2])
+            return due
+
+    def _has_due_calls(self):
+        return bool(self._due_calls) and self._due_calls[0][0] <= self._clock()
+
+    def _seconds_until_next_call(self):
+        if not self._due_calls:
+            return None
+        return max(0, self._due_calls[0][0] - self._clock())
+
+    def _call(self, function):
+        try:
+            function()
+        except Exception:
+            print("Exception encountered in killstreaks scheduled call:")
+            print(traceback.format_exc())
+
 
-    def _wait_then_call_func(self):
-        time.sleep(self._interval)
-        self._function()
+class CircuitBreaker:
+    """
+    Opens after failures_to_open connection failures in a row and stays
+    open for open_s, during which the executor sends nothing to the server.
+    After that requests go out again; one more failure reopens it, and any
+    success closes it.
+    """
+
+    def __init__(self, failures_to_open=3, open_s=30, clock=time.monotonic):
+        self._failures_to_open = failures_to_open
+        self._open_s = open_s
+        self._clock = clock
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self.times_opened = 0
+
+    def record_failure(self):
+        self._consecutive_failures += 1
+
+        if self._consecutive_failures >= self._failures_to_open:
+            if not self.is_open():
+                print(
+                    "Server unreachable, pausing requests for",
+                    self._open_s,
+                    "seconds",
+                )
+                self.times_opened += 1
+            self._opened_at = self._clock()
+
+    def record_success(self):
+        self._consecutive_failures = 0
+        self._opened_at = None
+
+    def is_open(self):
+        return self.remaining_open_s() > 0
+
+    def remaining_open_s(self):
+        if self._opened_at is None:
+            return 0
+        return max(0, self._opened_at + self._open_s - self._clock())
 
 
 @attr.s(frozen=True)
 class RequeuingJob:
+    """
+    Runs job, and if it fails with exception_to_retry_on hands a copy back
+    to the job queue's retry scheduler, until its retry policy gives up.
+    Results are reported to the job queue's circuit breaker.
+    """
+
     _job = attr.ib()
     _exception_to_retry_on = attr.ib()
     _job_queue = attr.ib()
-    _backoff_n = attr.ib(default=1)
+    _attempt = attr.ib(default=1)
+    priority = attr.ib(default=JobPriority.LIVE)
 
     def __call__(self):
         try:
             self._job()
         except self._exception_to_retry_on as e:
-            self._requeue_after_backoff()
+            self._job_queue.report_unreachable()
+            self._retry_later()
+        else:
+            self._job_queue.report_reachable()
 
-    def _requeue_after_backoff(self):
-        print("Will requeue job after", self._backoff, "seconds")
-        new_instance = attr.evolve(
-            self,
-            backoff_n=self._backoff_n + 1,
-        )
-        requeue_job = partial(
-            self._job_queue.put,
-            new_instance
+    def _retry_later(self):
+        will_retry = self._job_queue.retry_later(
+            attr.evolve(self, attempt=self._attempt + 1),
+            attempt=self._attempt,
         )
-        timer = DaemonTimer(
-            interval=self._backoff,
-            function=requeue_job,
-        )
-        timer.start()
 
-    @property
-    def _backoff(self):
-        jitter_s = random.uniform(0, 1)
-        return (2 ** self._backoff_n) + jitter_s
+        if not will_retry:
+            print("Giving up after", self._attempt, "attempts -", self._job)
 
 
 def show_logged_out_tooltip():
@@ -1,5 +1,9 @@
+from contextlib import contextmanager
 import sqlite3
+import threading
 from datetime import datetime, timedelta, timezone, time
+import json
+from collections import OrderedDict
 from uuid import uuid4
 
 from ._vendor import attr
@@ -7,26 +11,82 @@ from ._vendor.yoyo import get_backend
 from ._vendor.yoyo import read_migrations
 from ._vendor.yoyo.exceptions import LockTimeout
 from .addons import THIS_ADDON_PATH
-from .streaks import get_all_displayable_medals
-from .toolz import join
+from .streaks import medal_registry
 
 min_datetime = datetime(
     year=2019, month=12, day=25
 )  # day I started making the addon :-)
 
 
+@attr.s(frozen=True)
+class DbTuning:
+    """
+    Pragmas applied to the add-on's database when a profile loads. The
+    journal mode is stored in the database file, so it only needs to be set
+    once after migrating; the rest only last as long as a connection.
+    """
+
+    journal_mode = attr.ib(
+        default="WAL",
+        validator=attr.validators.in_(
+            ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL")
+        ),
+    )
+    synchronous = attr.ib(
+        default="NORMAL",
+        validator=attr.validators.in_(("OFF", "NORMAL", "FULL", "EXTRA")),
+    )
+    cache_size_kib = attr.ib(default=8192, converter=int)
+    temp_store = attr.ib(
+        default="MEMORY",
+        validator=attr.validators.in_(("DEFAULT", "FILE", "MEMORY")),
+    )
+    mmap_size_bytes = attr.ib(default=64 * 1024 * 1024, converter=int)
+
+    @classmethod
+    def from_config(cls, config):
+        defaults = cls()
+        return cls(
+            journal_mode=config.get(
+                "db_journal_mode", defaults.journal_mode
+            ).upper(),
+            synchronous=config.get(
+                "db_synchronous", defaults.synchronous
+            ).upper(),
+            cache_size_kib=config.get(
+                "db_cache_size_kib", defaults.cache_size_kib
+            ),
+            temp_store=config.get("db_temp_store", defaults.temp_store).upper(),
+            mmap_size_bytes=config.get(
+                "db_mmap_size_bytes", defaults.mmap_size_bytes
+            ),
+        )
+
+    def apply_journal_mode(self, conn):
+        conn.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+
+    def apply_connection_pragmas(self, conn):
+        conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        # negative cache_size is in KiB instead of pages
+        conn.execute(f"PRAGMA cache_size = {-self.cache_size_kib}")
+        conn.execute(f"PRAGMA temp_store = {self.temp_store}")
+        conn.execute(f"PRAGMA mmap_size = {self.mmap_size_bytes}")
+
+
 @attr.s(frozen=True)
 class DbSettings:
     db_path = attr.ib()
     migration_dir_path = attr.ib()
+    tuning = attr.ib(default=None)
 
     @classmethod
     def from_profile_folder_path(
-        cls, profile_folder_path, addon_path=THIS_ADDON_PATH
+        cls, profile_folder_path, addon_path=THIS_ADDON_PATH, tuning=None
     ):
         return cls(
             db_path=profile_folder_path / "anki_killstreaks.db",
             migration_dir_path=addon_path / "migrations",
+            tuning=tuning,
         )
 
     @property
@@ -44,85 +104,295 @@ def migrate_database(settings):
     except LockTimeout as e:
         backend.break_lock()
 
+    if settings.tuning:
+        conn = sqlite3.connect(str(settings.db_path), isolation_level=None)
+        try:
+            settings.tuning.apply_journal_mode(conn)
+        finally:
+            conn.close()
+
     return settings
 
 
-def get_db_connection(db_settings):
-    return sqlite3.connect(str(db_settings.db_path), isolation_level=None)
+def get_db_connection(db_settings, check_same_thread=True):
+    conn = sqlite3.connect(
+        str(db_settings.db_path),
+        isolation_level=None,
+        check_same_thread=check_same_thread,
+    )
 
+    if db_settings.tuning:
+        db_settings.tuning.apply_connection_pragmas(conn)
 
-class AchievementsRepository:
-    def __init__(self, get_db_connection):
-        self.get_db_connection = get_db_connection
+    return conn
 
-    def create_all(self, new_achievements):
-        with self.get_db_connection() as conn:
-            row_ids = []
 
-            for new_a in new_achievements:
-                cursor = conn.execute(
-                    "INSERT INTO achievements(medal_id, deck_id, uuid) VALUES (?, ?, ?)",
-                    (new_a.medal_id, new_a.deck_id, str(uuid4())),
+class ConnectionManager:
+    """
+    Keeps one long-lived connection to the profile's database per thread, so
+    the GUI thread and the network thread each reuse their own connection
+    instead of opening a new one for every query. Owned by the
+    ProfileController and retired when the profile is unloaded.
+
+    Each thread closes its own connection, so none is closed while another
+    thread is in the middle of a query on it. Once retired, no thread can
+    open a new one.
+    """
+
+    def __init__(self, db_settings, connect=get_db_connection):
+        self._db_settings = db_settings
+        self._connect = connect
+        self._connections_by_thread_id = dict()
+        self._lock = threading.Lock()
+        self._is_retired = False
+        self.connections_opened = 0
+        self.connections_closed = 0
+
+    def connection(self):
+        thread_id = threading.get_ident()
+
+        with self._lock:
+            if self._is_retired:
+                raise sqlite3.ProgrammingError(
+                    "The profile's database connections have been retired"
                 )
-                row_ids.append(cursor.lastrowid)
 
-            in_placeholders = ",".join(["?"] * len(row_ids))
-            select_cursor = conn.execute(
-                f"""
-                SELECT *
-                FROM achievements
-                WHERE id in ({in_placeholders})
-                """,
-                tuple(row_ids)
+            conn = self._connections_by_thread_id.get(thread_id)
+
+            if conn is None:
+                conn = self._connect(self._db_settings)
+                self._connections_by_thread_id[thread_id] = conn
+                self.connections_opened += 1
+
+            return conn
+
+    def close_current(self):
+        """Closes the calling thread's connection, if it has one"""
+        with self._lock:
+            conn = self._connections_by_thread_id.pop(
+                threading.get_ident(), None
             )
+            if conn is not None:
+                conn.close()
+                self.connections_closed += 1
+
+    def retire(self):
+        """
+        Stops any thread opening a connection and closes the calling
+        thread's. Other threads close theirs with close_current_if_retired.
+        """
+        with self._lock:
+            self._is_retired = True
+
+        self.close_current()
+
+    def close_current_if_retired(self):
+        """
+        For threads that keep their connection between jobs to call after
+        each one, and whenever they're idle
+        """
+        if self._is_retired:
+            self.close_current()
+
+    def close_all(self):
+        """
+        Only for when no other thread can be using a connection, like at
+        the end of a test
+        """
+        with self._lock:
+            for conn in self._connections_by_thread_id.values():
+                conn.close()
+                self.connections_closed += 1
+
+            self._connections_by_thread_id.clear()
 
-            return [PersistedAchievement(*row, medal=None) for row in select_cursor]
+    @property
+    def open_connection_count(self):
+        return len(self._connections_by_thread_id)
 
-    # only used by tests, should eliminate
-    def all(self, since_datetime=min_datetime):
-        with self.get_db_connection() as conn:
-            cursor = conn.execute(
-                """
-                SELECT * FROM achievements
-                WHERE created_at > ?
+
+@contextmanager
+def transaction(conn):
+    """
+    Connections run in autocommit mode, so group writes explicitly to pay
+    for a single commit instead of one per statement.
+    """
+    conn.execute("BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
+
+
+def sqlite_timestamp(utc_datetime):
+    """Same format SQLite uses for CURRENT_TIMESTAMP"""
+    return utc_datetime.strftime("%Y-%m-%d %H:%M:%S")
+
+
+# RETURNING was added in SQLite 3.35, older Anki builds ship older versions
+_sqlite_supports_returning = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# stay under SQLITE_MAX_VARIABLE_NUMBER (999 before 3.32)
+_max_rows_per_insert = 200
+
+
+def _insert_achievement_rows(conn, rows, backfilled=False):
+    """
+    backfilled marks medals rebuilt from the revlog, which are never
+    uploaded by a sync
+    """
+    # a literal, so each row still only takes four variables
+    backfilled_value = 1 if backfilled else 0
+
+    if not _sqlite_supports_returning:
+        return [
+            conn.execute(
+                f"""
+                INSERT INTO achievements(
+                    medal_id, deck_id, uuid, created_at, backfilled
+                )
+                VALUES (?, ?, ?, ?, {backfilled_value})
                 """,
-                (since_datetime, )
-            )
+                row,
+            ).lastrowid
+            for row in rows
+        ]
 
-            loaded_achievements = [
-                PersistedAchievement(*row, medal=None) for row in cursor
-            ]
+    ids_by_uuid = dict()
 
-        # will probably become a performance issue, move to
-        # spot where we need this join.
-        matches = join(
-            leftseq=get_all_displayable_medals(),
-            rightseq=loaded_achievements,
-            leftkey=lambda dm: dm.id_,
-            rightkey=lambda la: la.medal_id,
+    for start in range(0, len(rows), _max_rows_per_insert):
+        chunk = rows[start:start + _max_rows_per_insert]
+        values_placeholders = ",".join(
+            [f"(?, ?, ?, ?, {backfilled_value})"] * len(chunk)
         )
+        cursor = conn.execute(
+            f"""
+            INSERT INTO achievements(
+                medal_id, deck_id, uuid, created_at, backfilled
+            )
+            VALUES {values_placeholders}
+            RETURNING id, uuid
+            """,
+            tuple(value for row in chunk for value in row),
+        )
+        # RETURNING order isn't guaranteed, match the ids back up by uuid
+        ids_by_uuid.update((uuid, row_id) for row_id, uuid in cursor)
+
+    return [ids_by_uuid[uuid] for _, _, uuid, _ in rows]
+
+
+class AchievementsRepository:
+    def __init__(self, get_db_connection):
+        self.get_db_connection = get_db_connection
+
+    def create_all(self, new_achievements, queue_for_upload=False):
+        """
+        queue_for_upload adds the achievements to the outbox, for when
+        someone is logged in to deliver them. Achievements earned while
+        logged out are uploaded by the sync after logging in instead.
+        """
+        if len(new_achievements) == 0:
+            return []
+
+        created_at = sqlite_timestamp(datetime.now(timezone.utc))
+        rows = [
+            (new_a.medal_id, new_a.deck_id, str(uuid4()), created_at)
+            for new_a in new_achievements
+        ]
+
+        conn = self.get_db_connection()
+        with transaction(conn):
+            row_ids = _insert_achievement_rows(conn, rows)
+            # queued for upload in the same transaction, so a medal can't
+            # be saved without also being queued
+            if queue_for_upload:
+                conn.executemany(
+                    """
+                    INSERT INTO achievement_outbox(achievement_id)
+                    VALUES (?)
+                    """,
+                    [(row_id,) for row_id in row_ids],
+                )
 
         return [
-            persisted_achievement.with_medal(medal)
-            for medal, persisted_achievement in matches
+            PersistedAchievement(
+                id_=row_id,
+                medal_id=medal_id,
+                created_at=created_at,
+                deck_id=deck_id,
+                uuid=uuid,
+                medal=None,
+            )
+            for row_id, (medal_id, deck_id, uuid, created_at)
+            in zip(row_ids, rows)
         ]
 
-    def todays_achievements(self, day_start_time):
-        return self.count_by_medal_id(created_at_gt=day_start_time)
+    def all(self, since_datetime=min_datetime):
+        return list(self.iter_since(since_datetime))
+
+    def iter_since(self, since_datetime=min_datetime, batch_size=1000):
+        """
+        Streams achievements created after since_datetime, with their medal,
+        fetching batch_size rows at a time so large histories don't have
+        to fit in memory. Achievements for medals that can't be displayed
+        are skipped.
+        """
+        medals_by_id = medal_registry.by_id
+
+        cursor = self.get_db_connection().execute(
+            """
+            SELECT id, medal_id, created_at, deck_id, uuid
+            FROM achievements
+            WHERE created_at > ?
+            ORDER BY created_at
+            """,
+            (since_datetime, )
+        )
+
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+
+            for row in rows:
+                medal = medals_by_id.get(row[1])
+                if medal is not None:
+                    yield PersistedAchievement(*row, medal=medal)
+
+    def page_since(self, since_datetime, after_id, limit):
+        """
+        Up to limit achievements created after since_datetime with an id
+        greater than after_id, ordered by id so syncs can resume from the
+        last id the server acknowledged. Backfilled achievements are left
+        out, they're never uploaded.
+        """
+        medals_by_id = medal_registry.by_id
 
-    def count_by_medal_id(self, created_at_gt=min_datetime):
         with self.get_db_connection() as conn:
             cursor = conn.execute(
                 """
-                SELECT medal_id, count(*)
+                SELECT id, medal_id, created_at, deck_id, uuid
                 FROM achievements
-                WHERE created_at > ?
-                GROUP BY medal_id
+                WHERE created_at > ? AND id > ? AND NOT backfilled
+                ORDER BY id
+                LIMIT ?
                 """,
-                (created_at_gt.astimezone(timezone.utc),),
+                (since_datetime, after_id, limit),
             )
 
-            return dict(row for row in cursor)
+            return [
+                PersistedAchievement(*row, medal=medals_by_id.get(row[1]))
+                for row in cursor
+            ]
+
+    def todays_achievements(self, day_start_time):
+        return self.count_by_medal_id(created_at_gt=day_start_time)
+
+    def count_by_medal_id(self, created_at_gt=min_datetime):
+        return self._count_by_medal_id_since(since_datetime=created_at_gt)
 
     def todays_achievements_for_deck_ids(self, day_start_time, deck_ids):
         return self.achievements_for_deck_ids_since(
@@ -130,33 +400,190 @@ class AchievementsRepository:
         )
 
     def achievements_for_deck_ids_since(self, deck_ids, since_datetime):
+        return self._count_by_medal_id_since(
+            since_datetime=since_datetime, deck_ids=deck_ids
+        )
+
+    def achievements_for_whole_collection_since(self, since_datetime):
+        return self._count_by_medal_id_since(since_datetime=since_datetime)
+
+    def _count_by_medal_id_since(self, since_datetime, deck_ids=None):
+        """
+        Whole days after since_datetime are counted from the
+        daily_medal_counts rollup (kept up to date by triggers on
+        achievements), only the rest of the day since_datetime falls in is
+        counted from the raw rows.
+        """
+        since_utc = since_datetime.astimezone(timezone.utc)
+        since_day = since_utc.date()
+        next_day = since_day + timedelta(days=1)
+
+        if deck_ids is None:
+            deck_filter = ""
+            deck_params = ()
+        else:
+            deck_filter = (
+                f"AND deck_id in ({','.join('?' for i in deck_ids)})"
+            )
+            deck_params = tuple(deck_ids)
+
         with self.get_db_connection() as conn:
             cursor = conn.execute(
                 f"""
-                SELECT medal_id, count(*)
-                FROM achievements
-                WHERE created_at > ? AND
-                    deck_id in ({','.join('?' for i in deck_ids)})
+                SELECT medal_id, sum(medal_count)
+                FROM (
+                    SELECT medal_id, count AS medal_count
+                    FROM daily_medal_counts
+                    WHERE day > ? {deck_filter}
+                    UNION ALL
+                    SELECT medal_id, 1 AS medal_count
+                    FROM achievements
+                    WHERE created_at > ? AND created_at < ? {deck_filter}
+                )
                 GROUP BY medal_id
+                HAVING sum(medal_count) > 0
                 """,
-                (since_datetime.astimezone(timezone.utc), *deck_ids),
+                (
+                    since_day.isoformat(),
+                    *deck_params,
+                    since_utc,
+                    next_day.isoformat(),
+                    *deck_params,
+                ),
             )
 
             return dict(row for row in cursor)
 
+
+class CachingAchievementsRepository:
+    """
+    Read-through cache for the medal count queries, which get rerun every
+    time the deck browser, overview or stats are rendered even though the
+    counts only change when create_all is called.
+
+    Entries are keyed on (scope, deck ids, since_datetime truncated to the
+    minute). Each scope keeps its entries_per_scope most recently used
+    entries, so switching the stats between month, year and lifetime keeps
+    hitting, while counts for an old day or a stats period that has moved
+    on are evicted. create_all clears everything; a new instance is made
+    for every profile.
+    """
+
+    def __init__(self, repo, entries_per_scope=4):
+        self._repo = repo
+        self._entries_per_scope = entries_per_scope
+        self._counts_by_key = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def create_all(self, new_achievements, queue_for_upload=False):
+        persisted_achievements = self._repo.create_all(
+            new_achievements, queue_for_upload=queue_for_upload
+        )
+
+        if len(persisted_achievements) > 0:
+            self.invalidate()
+
+        return persisted_achievements
+
+    def todays_achievements(self, day_start_time):
+        return self._cached(
+            "todays_achievements",
+            deck_ids=None,
+            since_datetime=day_start_time,
+            load=lambda since: self._repo.todays_achievements(since),
+        )
+
+    def count_by_medal_id(self, created_at_gt=min_datetime):
+        return self._cached(
+            "count_by_medal_id",
+            deck_ids=None,
+            since_datetime=created_at_gt,
+            load=lambda since: self._repo.count_by_medal_id(since),
+        )
+
+    def todays_achievements_for_deck_ids(self, day_start_time, deck_ids):
+        return self._cached(
+            "todays_achievements_for_deck_ids",
+            deck_ids=deck_ids,
+            since_datetime=day_start_time,
+            load=lambda since: self._repo.todays_achievements_for_deck_ids(
+                day_start_time=since, deck_ids=deck_ids
+            ),
+        )
+
+    def achievements_for_deck_ids_since(self, deck_ids, since_datetime):
+        return self._cached(
+            "achievements_for_deck_ids_since",
+            deck_ids=deck_ids,
+            since_datetime=since_datetime,
+            load=lambda since: self._repo.achievements_for_deck_ids_since(
+                deck_ids=deck_ids, since_datetime=since
+            ),
+        )
+
     def achievements_for_whole_collection_since(self, since_datetime):
-        with self.get_db_connection() as conn:
-            cursor = conn.execute(
-                f"""
-                SELECT medal_id, count(*)
-                FROM achievements
-                WHERE created_at > ?
-                GROUP BY medal_id
-                """,
-                (since_datetime.astimezone(timezone.utc),),
-            )
+        return self._cached(
+            "achievements_for_whole_collection_since",
+            deck_ids=None,
+            since_datetime=since_datetime,
+            load=(
+                lambda since:
+                self._repo.achievements_for_whole_collection_since(since)
+            ),
+        )
 
-            return dict(row for row in cursor)
+    def _cached(self, scope, deck_ids, since_datetime, load):
+        # stats periods are relative to now, bucket them so re-renders hit.
+        # Load with the bucketed value so cached counts match their key.
+        since_bucket = since_datetime.replace(second=0, microsecond=0)
+        key = (
+            scope,
+            None if deck_ids is None else tuple(sorted(deck_ids)),
+            since_bucket,
+        )
+
+        with self._lock:
+            if key in self._counts_by_key:
+                self.hits += 1
+                self._counts_by_key.move_to_end(key)
+                return dict(self._counts_by_key[key])
+
+            self.misses += 1
+
+        counts = load(since_bucket)
+
+        with self._lock:
+            self._counts_by_key[key] = counts
+            self._counts_by_key.move_to_end(key)
+            self._evict_least_recently_used(scope)
+
+        return dict(counts)
+
+    def _evict_least_recently_used(self, scope):
+        # oldest first, so the first ones past the limit are the stale ones
+        scope_keys = [key for key in self._counts_by_key if key[0] == scope]
+        for key in scope_keys[:-self._entries_per_scope]:
+            del self._counts_by_key[key]
+
+    def invalidate(self):
+        with self._lock:
+            self._counts_by_key.clear()
+            self.invalidations += 1
+
+    @property
+    def cache_stats(self):
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            invalidations=self.invalidations,
+            entries=len(self._counts_by_key),
+        )
+
+    def __getattr__(self, attr):
+        return getattr(self._repo, attr)
 
 
 @attr.s
@@ -231,3 +658,279 @@ class SettingsRepository:
             )
             return cursor.fetchone()[0]
 
+
+@attr.s(frozen=True)
+class SyncState:
+    since_datetime = attr.ib()
+    last_acknowledged_id = attr.ib()
+
+
+class SyncStateRepository:
+    """
+    Checkpoints for the chunked leaderboard sync. A sync in progress has a
+    since_datetime; last_acknowledged_id is the highest achievement id the
+    server has acknowledged for it.
+    """
+
+    def __init__(self, get_db_connection):
+        self.get_db_connection = get_db_connection
+
+    def load_in_progress(self):
+        with self.get_db_connection() as conn:
+            cursor = conn.execute(
+                "SELECT since_datetime, last_acknowledged_id FROM sync_state"
+            )
+            since_datetime, last_acknowledged_id = cursor.fetchone()
+
+        if since_datetime is None:
+            return None
+
+        return SyncState(
+            since_datetime=datetime.fromisoformat(since_datetime),
+            last_acknowledged_id=last_acknowledged_id,
+        )
+
+    def start(self, since_datetime):
+        with self.get_db_connection() as conn:
+            conn.execute(
+                """
+                UPDATE sync_state
+                SET since_datetime = ?,
+                    last_acknowledged_id = 0,
+                    updated_at = CURRENT_TIMESTAMP
+                """,
+                (since_datetime,),
+            )
+
+        return SyncState(
+            since_datetime=since_datetime, last_acknowledged_id=0
+        )
+
+    def acknowledge(self, sync_state, last_acknowledged_id):
+        with self.get_db_connection() as conn:
+            conn.execute(
+                """
+                UPDATE sync_state
+                SET last_acknowledged_id = ?,
+                    updated_at = CURRENT_TIMESTAMP
+                """,
+                (last_acknowledged_id,),
+            )
+
+        return attr.evolve(
+            sync_state, last_acknowledged_id=last_acknowledged_id
+        )
+
+    def finish(self, last_synced_id):
+        """
+        Everything up to last_synced_id is on the server after a finished
+        sync, so it no longer needs to be delivered from the outbox.
+        """
+        conn = self.get_db_connection()
+        with transaction(conn):
+            conn.execute(
+                """
+                UPDATE sync_state
+                SET since_datetime = NULL,
+                    last_acknowledged_id = 0,
+                    updated_at = CURRENT_TIMESTAMP
+                """
+            )
+            conn.execute(
+                """
+                UPDATE achievement_outbox
+                SET delivered_at = CURRENT_TIMESTAMP
+                WHERE delivered_at IS NULL AND achievement_id <= ?
+                """,
+                (last_synced_id,),
+            )
+
+
+class AchievementOutboxRepository:
+    """
+    Achievements waiting to be posted to the server. Rows are written by
+    AchievementsRepository.create_all and marked delivered once the server
+    has them, so they survive Anki quitting before they're sent.
+    """
+
+    def __init__(self, get_db_connection):
+        self.get_db_connection = get_db_connection
+
+    def pending(self, limit):
+        medals_by_id = medal_registry.by_id
+
+        with self.get_db_connection() as conn:
+            cursor = conn.execute(
+                """
+                SELECT
+                    achievements.id,
+                    achievements.medal_id,
+                    achievements.created_at,
+                    achievements.deck_id,
+                    achievements.uuid
+                FROM achievement_outbox
+                JOIN achievements
+                    ON achievements.id = achievement_outbox.achievement_id
+                WHERE achievement_outbox.delivered_at IS NULL
+                ORDER BY achievement_outbox.achievement_id
+                LIMIT ?
+                """,
+                (limit,),
+            )
+
+            return [
+                PersistedAchievement(*row, medal=medals_by_id.get(row[1]))
+                for row in cursor
+            ]
+
+    def pending_count(self):
+        with self.get_db_connection() as conn:
+            cursor = conn.execute(
+                """
+                SELECT count(*)
+                FROM achievement_outbox
+                WHERE delivered_at IS NULL
+                """
+            )
+            return cursor.fetchone()[0]
+
+    def mark_delivered(self, achievement_ids):
+        if len(achievement_ids) == 0:
+            return
+
+        with self.get_db_connection() as conn:
+            conn.execute(
+                f"""
+                UPDATE achievement_outbox
+                SET delivered_at = CURRENT_TIMESTAMP
+                WHERE achievement_id in ({','.join('?' for i in achievement_ids)})
+                """,
+                tuple(achievement_ids),
+            )
+
+
+@attr.s(frozen=True)
+class BackfillState:
+    game_id = attr.ib()
+    until_revlog_id = attr.ib()
+    last_revlog_id = attr.ib()
+    streak_indexes = attr.ib()
+    medals_created = attr.ib()
+
+
+class BackfillStateRepository:
+    """
+    Checkpoint for rebuilding medals from Anki's revlog. A backfill in
+    progress has a game_id; revlog rows up to last_revlog_id have been
+    replayed and their medals saved, leaving the game's streaks at
+    streak_indexes. Medals and the checkpoint are saved in one
+    transaction, so a backfill stopped at any point carries on from the
+    last checkpoint without saving any medal twice.
+    """
+
+    def __init__(self, get_db_connection):
+        self.get_db_connection = get_db_connection
+
+    def load_in_progress(self):
+        with self.get_db_connection() as conn:
+            cursor = conn.execute(
+                """
+                SELECT game_id, until_revlog_id, last_revlog_id,
+                    streak_indexes, medals_created
+                FROM backfill_state
+                """
+            )
+            game_id, until_revlog_id, last_revlog_id, streak_indexes, \
+                medals_created = cursor.fetchone()
+
+        if game_id is None:
+            return None
+
+        return BackfillState(
+            game_id=game_id,
+            until_revlog_id=until_revlog_id,
+            last_revlog_id=last_revlog_id,
+            streak_indexes=(
+                json.loads(streak_indexes) if streak_indexes else None
+            ),
+            medals_created=medals_created,
+        )
+
+    def first_achievement_at_ms(self):
+        """When the earliest medal was earned, None if there aren't any"""
+        with self.get_db_connection() as conn:
+            cursor = conn.execute("SELECT min(created_at) FROM achievements")
+            created_at = cursor.fetchone()[0]
+
+        if created_at is None:
+            return None
+
+        earned_at = datetime.fromisoformat(created_at).replace(
+            tzinfo=timezone.utc
+        )
+        return int(earned_at.timestamp() * 1000)
+
+    def start(self, game_id, until_revlog_id):
+        with self.get_db_connection() as conn:
+            conn.execute(
+                """
+                UPDATE backfill_state
+                SET game_id = ?,
+                    until_revlog_id = ?,
+                    last_revlog_id = 0,
+                    streak_indexes = NULL,
+                    medals_created = 0,
+                    updated_at = CURRENT_TIMESTAMP
+                """,
+                (game_id, until_revlog_id),
+            )
+
+        return BackfillState(
+            game_id=game_id,
+            until_revlog_id=until_revlog_id,
+            last_revlog_id=0,
+            streak_indexes=None,
+            medals_created=0,
+        )
+
+    def save_progress(
+        self, backfill_state, last_revlog_id, streak_indexes, achievement_rows
+    ):
+        """achievement_rows are (medal_id, deck_id, uuid, created_at)"""
+        conn = self.get_db_connection()
+        with transaction(conn):
+            # not queued in the outbox, rebuilt medals stay off the
+            # leaderboards
+            _insert_achievement_rows(conn, achievement_rows, backfilled=True)
+            conn.execute(
+                """
+                UPDATE backfill_state
+                SET last_revlog_id = ?,
+                    streak_indexes = ?,
+                    medals_created = medals_created + ?,
+                    updated_at = CURRENT_TIMESTAMP
+                """,
+                (
+                    last_revlog_id,
+                    json.dumps(streak_indexes),
+                    len(achievement_rows),
+                ),
+            )
+
+        return attr.evolve(
+            backfill_state,
+            last_revlog_id=last_revlog_id,
+            streak_indexes=streak_indexes,
+            medals_created=backfill_state.medals_created
+            + len(achievement_rows),
+        )
+
+    def finish(self):
+        with self.get_db_connection() as conn:
+            conn.execute(
+                """
+                UPDATE backfill_state
+                SET game_id = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+                """
+            )
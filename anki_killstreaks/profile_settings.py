@@ -9,17 +9,28 @@ import webbrowser
 from ._vendor import attr
 
 from . import accounts, leaderboards
-from .networking import sra_base_url, TokenAuthHttpClient
+from .networking import JobPriority, sra_base_url
 from .ui.forms.profile_settings_dialog import Ui_ProfileSettingsDialog
 
 
-def show_dialog(parent, network_thread, user_repo, achievements_repo):
+def show_dialog(
+    parent,
+    network_thread,
+    user_repo,
+    achievements_repo,
+    sync_state_repo,
+    outbox,
+    http_client,
+):
     ProfileSettingsDialog(
         parent,
         network_thread,
         user_repo,
         user_is_logged_in=accounts.check_user_logged_in(user_repo),
         achievements_repo=achievements_repo,
+        sync_state_repo=sync_state_repo,
+        outbox=outbox,
+        http_client=http_client,
     ).exec_()
 
 
@@ -37,7 +48,7 @@ class ProfileSettingsDialog(QDialog):
 
     connection_error = pyqtSignal()
 
-    def __init__(self, parent, network_thread, user_repo, user_is_logged_in, achievements_repo):
+    def __init__(self, parent, network_thread, user_repo, user_is_logged_in, achievements_repo, sync_state_repo, outbox, http_client):
         super().__init__(parent)
         self.ui = Ui_ProfileSettingsDialog()
         self.ui.setupUi(self)
@@ -45,6 +56,9 @@ class ProfileSettingsDialog(QDialog):
         self._network_thread = network_thread
         self._user_repo = user_repo
         self._achievements_repo = achievements_repo
+        self._sync_state_repo = sync_state_repo
+        self._outbox = outbox
+        self._http_client = http_client
 
         self._connect_login_signals()
         self._connect_logout_signals()
@@ -57,6 +71,7 @@ class ProfileSettingsDialog(QDialog):
 
         self._show_correct_auth_form(user_is_logged_in)
         self._validate_token_if_logged_in(user_is_logged_in)
+        self._show_pending_uploads()
 
     def keyPressEvent(self, event) -> None:
         key = event.key()
@@ -94,7 +109,7 @@ class ProfileSettingsDialog(QDialog):
             listener=self,
             user_repo=self._user_repo,
         )
-        self._network_thread.put(login_job)
+        self._network_thread.put(login_job, priority=JobPriority.INTERACTIVE)
 
     def on_successful_login(self, user_attrs):
         self._switchToLogoutPage(user_attrs)
@@ -108,12 +123,27 @@ class ProfileSettingsDialog(QDialog):
         email = self.ui.emailLineEdit.setText("")
         password = self.ui.passwordLineEdit.setText("")
 
+    def _show_pending_uploads(self):
+        pending_count = self._outbox.pending_count
+        upload_stats = self._outbox.upload_stats
+        lines = []
+        if pending_count > 0:
+            lines.append(f"{pending_count} medal(s) waiting to be uploaded")
+        if upload_stats["achievements"] > 0:
+            lines.append(
+                f"{upload_stats['achievements']} medal(s) uploaded in "
+                f"{upload_stats['requests']} request(s) this session"
+            )
+        self.ui.pendingUploadsLabel.setText("\n".join(lines))
+
     def _start_sync_job(self):
         leaderboards.sync_if_logged_in(
             user_repo=self._user_repo,
             achievements_repo=self._achievements_repo,
+            sync_state_repo=self._sync_state_repo,
             network_thread=self._network_thread,
-            http_client=TokenAuthHttpClient(self._user_repo),
+            http_client=self._http_client,
+            outbox=self._outbox,
         )
 
     def on_unauthorized(self, response):
@@ -131,7 +161,7 @@ class ProfileSettingsDialog(QDialog):
             self._user_repo,
              listener=self
         )
-        self._network_thread.put(logout_job)
+        self._network_thread.put(logout_job, priority=JobPriority.INTERACTIVE)
 
     def on_logout(self):
         self.ui.statusLabel.setText("User logged out successfully.")
@@ -162,7 +192,7 @@ class ProfileSettingsDialog(QDialog):
                 self._user_repo,
                 listener=self,
             )
-            self._network_thread.put(job)
+            self._network_thread.put(job, priority=JobPriority.INTERACTIVE)
 
     def on_token_invalidated(self, response):
         self.ui.statusLabel.setText(response["errors"][0])
@@ -6,9 +6,14 @@ License: GNU AGPLv3 or later <https://www.gnu.org/licenses/agpl.html>
 """
 
 from datetime import datetime, timedelta
-from functools import lru_cache
 import itertools
 from os.path import join, dirname
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 from . import addons
 from ._vendor import attr
@@ -32,6 +37,10 @@ class MultikillMixin:
             < timedelta(seconds=interval_s)
         )
 
+    def interval_bounds_ms(self, interval_s, min_interval_s=0):
+        """Milliseconds in which requirements_met, from and up to but excluding"""
+        return _to_ms(min_interval_s), _to_ms(interval_s)
+
 
 class KillingSpreeMixin:
     def requirements_met(
@@ -44,6 +53,17 @@ class KillingSpreeMixin:
         delta = question_answered_at - question_shown_at
         return delta >= timedelta(seconds=min_interval_s)
 
+    def interval_bounds_ms(self, interval_s, min_interval_s=0):
+        """Milliseconds in which requirements_met, from and up to but excluding"""
+        return _to_ms(min_interval_s), _UNBOUNDED_MS
+
+
+_UNBOUNDED_MS = sys.maxsize
+
+
+def _to_ms(seconds):
+    return round(seconds * 1000)
+
 
 # first just needs to be after minimum time
 class MultikillStartingState(KillingSpreeMixin):
@@ -164,6 +184,10 @@ class InitialStreakState:
 
         return answer_state.on_answer(card_did_pass)
 
+    @property
+    def interval_s(self):
+        return self._interval_s
+
     @property
     def current_medal_state(self):
         return self.states[self._current_streak_index]
@@ -211,14 +235,246 @@ class Store:
             if m.current_medal_state.is_displayable_medal
         ]
 
+    @property
+    def current_medal_states(self):
+        return [m.current_medal_state for m in self.state_machines]
+
     @property
     def all_displayable_medals(self):
-        all_medals = itertools.chain.from_iterable(
-            m.states for m in self.state_machines
+        return frozenset().union(
+            *(
+                medal_registry.displayable_medals_in(m.states)
+                for m in self.state_machines
+            )
         )
 
-        return frozenset(
-            medal for medal in all_medals if medal.is_displayable_medal
+
+@attr.s(frozen=True)
+class TransitionTable:
+    """
+    One state machine's list of states compiled into flat tuples indexed
+    by streak index, so answering is a lookup rather than calls through
+    the state objects. Intervals are in whole milliseconds.
+    """
+
+    states = attr.ib()
+    min_interval_ms = attr.ib()
+    max_interval_ms = attr.ib()
+    next_indexes = attr.ib()
+    is_earnable_medal = attr.ib()
+    is_displayable_medal = attr.ib()
+    displayable_medals = attr.ib()
+
+    @classmethod
+    def compile(cls, states, interval_s):
+        bounds_ms = [s.interval_bounds_ms(interval_s) for s in states]
+        return cls(
+            states=tuple(states),
+            min_interval_ms=tuple(min_ms for min_ms, _max_ms in bounds_ms),
+            max_interval_ms=tuple(max_ms for _min_ms, max_ms in bounds_ms),
+            next_indexes=tuple(
+                s.next_streak_index(i) for i, s in enumerate(states)
+            ),
+            is_earnable_medal=tuple(s.is_earnable_medal for s in states),
+            is_displayable_medal=tuple(s.is_displayable_medal for s in states),
+            displayable_medals=medal_registry.displayable_medals_in(states),
+        )
+
+    def next_streak_index(self, index, card_did_pass, elapsed_ms):
+        if not card_did_pass:
+            return 0
+        elif (
+            self.min_interval_ms[index]
+            <= elapsed_ms
+            < self.max_interval_ms[index]
+        ):
+            return self.next_indexes[index]
+        else:
+            # want this one to count for first kill in new streak
+            return 1
+
+
+_INITIAL, _QUESTION_SHOWN, _ANSWER_SHOWN = range(3)
+_EPOCH = datetime(1970, 1, 1)
+_ONE_US = timedelta(microseconds=1)
+_US_PER_MS = 1000
+
+
+def _timestamp_us(moment):
+    # datetimes are exact to the microsecond, so differences of these are
+    # the same as differences of the naive datetimes the states use
+    return (moment - _EPOCH) // _ONE_US
+
+
+class CompactStore:
+    """
+    Behaves like a Store of InitialStreakState, QuestionShownState and
+    AnswerShownState machines, but keeps each machine's phase, streak index
+    and timestamps, in microseconds, in flat lists updated in place, and
+    reads the clock once per event, instead of building a new Store and a
+    new state for every machine on every event. Each machine's states are
+    compiled into a TransitionTable when the store is made.
+
+    Events return the store, as Store's do. A store that hasn't seen an
+    event yet copies itself on the first one, so the stores from
+    get_stores_by_game_id stay fresh for the next reviewing controller.
+    """
+
+    __slots__ = (
+        "_tables",
+        "_phases",
+        "_indexes",
+        "_question_shown_at",
+        "_answer_shown_at",
+        "_clock",
+        "_addon_is_installed_and_enabled",
+        "_is_running",
+    )
+
+    def __init__(
+        self,
+        machines,
+        clock=datetime.now,
+        addon_is_installed_and_enabled=addons.is_installed_and_enabled,
+    ):
+        """machines is a list of (states, interval_s)"""
+        # If you switch games while reviewing, need to have a time to start with
+        initialized_at = _timestamp_us(clock())
+        self._tables = [
+            TransitionTable.compile(states, interval_s)
+            for states, interval_s in machines
+        ]
+        self._phases = [_INITIAL] * len(machines)
+        self._indexes = [0] * len(machines)
+        self._question_shown_at = [initialized_at] * len(machines)
+        self._answer_shown_at = [None] * len(machines)
+        self._clock = clock
+        self._addon_is_installed_and_enabled = addon_is_installed_and_enabled
+        self._is_running = False
+
+    @classmethod
+    def from_state_machines(cls, state_machines, **kwargs):
+        store = cls(
+            [(m.states, m.interval_s) for m in state_machines], **kwargs
+        )
+
+        for i, machine in enumerate(state_machines):
+            store._indexes[i] = machine._current_streak_index
+            if isinstance(machine, InitialStreakState):
+                store._question_shown_at[i] = _timestamp_us(
+                    machine._initialized_at
+                )
+            elif isinstance(machine, QuestionShownState):
+                store._phases[i] = _QUESTION_SHOWN
+                store._question_shown_at[i] = _timestamp_us(
+                    machine._question_shown_at
+                )
+            else:
+                store._phases[i] = _ANSWER_SHOWN
+                store._question_shown_at[i] = _timestamp_us(
+                    machine._question_shown_at
+                )
+                store._answer_shown_at[i] = _timestamp_us(
+                    machine._answer_shown_at
+                )
+
+        return store
+
+    def on_show_question(self):
+        store = self._running()
+        now = _timestamp_us(store._clock())
+
+        for i in range(len(store._phases)):
+            store._phases[i] = _QUESTION_SHOWN
+            store._question_shown_at[i] = now
+
+        return store
+
+    def on_show_answer(self):
+        store = self._running()
+        now = _timestamp_us(store._clock())
+
+        for i, phase in enumerate(store._phases):
+            # showing the answer again, e.g. after editing, changes nothing
+            if phase != _ANSWER_SHOWN:
+                store._phases[i] = _ANSWER_SHOWN
+                store._answer_shown_at[i] = now
+
+        return store
+
+    def on_answer(self, card_did_pass):
+        store = self._running()
+        now = _timestamp_us(store._clock())
+        answers_from_question = None
+
+        for i, phase in enumerate(store._phases):
+            if phase == _QUESTION_SHOWN:
+                if answers_from_question is None:
+                    answers_from_question = store._addon_is_installed_and_enabled(
+                        "Right Hand Reviews jkl"
+                    )
+                if not answers_from_question:
+                    continue
+
+            answered_at = (
+                store._answer_shown_at[i] if phase == _ANSWER_SHOWN else now
+            )
+            store._indexes[i] = store._tables[i].next_streak_index(
+                store._indexes[i],
+                card_did_pass,
+                # flooring the exact difference keeps the comparison with
+                # whole millisecond bounds the same as comparing timedeltas
+                (answered_at - store._question_shown_at[i]) // _US_PER_MS,
+            )
+            store._phases[i] = _QUESTION_SHOWN
+            store._question_shown_at[i] = now
+
+        return store
+
+    def _running(self):
+        if self._is_running:
+            return self
+
+        store = object.__new__(self.__class__)
+        store._tables = self._tables
+        store._phases = list(self._phases)
+        store._indexes = list(self._indexes)
+        store._question_shown_at = list(self._question_shown_at)
+        store._answer_shown_at = list(self._answer_shown_at)
+        store._clock = self._clock
+        store._addon_is_installed_and_enabled = (
+            self._addon_is_installed_and_enabled
+        )
+        store._is_running = True
+        return store
+
+    @property
+    def current_medal_states(self):
+        return [
+            table.states[index]
+            for table, index in zip(self._tables, self._indexes)
+        ]
+
+    @property
+    def current_earnable_medals(self):
+        return [
+            table.states[index]
+            for table, index in zip(self._tables, self._indexes)
+            if table.is_earnable_medal[index]
+        ]
+
+    @property
+    def current_displayable_medals(self):
+        return [
+            table.states[index]
+            for table, index in zip(self._tables, self._indexes)
+            if table.is_displayable_medal[index]
+        ]
+
+    @property
+    def all_displayable_medals(self):
+        return frozenset().union(
+            *(table.displayable_medals for table in self._tables)
         )
 
 
@@ -263,6 +519,10 @@ class QuestionShownState:
         else:
             return self
 
+    @property
+    def interval_s(self):
+        return self._interval_s
+
     @property
     def current_medal_state(self):
         return self.states[self._current_streak_index]
@@ -335,6 +595,10 @@ class AnswerShownState:
             current_streak_index=new_index,
         )
 
+    @property
+    def interval_s(self):
+        return self._interval_s
+
     @property
     def current_medal_state(self):
         return self.states[self._current_streak_index]
@@ -1414,9 +1678,44 @@ MWR_KILLSTREAK_STATES = [
 ]
 
 
-@lru_cache
-def get_all_displayable_medals():
-    all_medals = itertools.chain(
+class MedalRegistry:
+    """
+    Every displayable medal, indexed once so resolving medals doesn't mean
+    filtering every game's states again: by id, by game id sorted by rank
+    the way the medals overview shows them, and by the state list they're
+    earned in.
+    """
+
+    def __init__(self, state_lists):
+        # kept so the ids of the state lists aren't reused
+        self._state_lists = state_lists
+        self._displayable_medals_by_states_id = {
+            id(states): frozenset(s for s in states if s.is_displayable_medal)
+            for states in state_lists
+        }
+
+        self.medals = [
+            s
+            for s in itertools.chain.from_iterable(state_lists)
+            if s.is_displayable_medal
+        ]
+        self.by_id = {medal.id_: medal for medal in self.medals}
+
+        self.by_game_id = dict()
+        for medal in self.medals:
+            self.by_game_id.setdefault(medal.game_id, []).append(medal)
+        for medals in self.by_game_id.values():
+            medals.sort(key=lambda medal: medal.rank)
+
+    def displayable_medals_in(self, states):
+        medals = self._displayable_medals_by_states_id.get(id(states))
+        if medals is None:
+            medals = frozenset(s for s in states if s.is_displayable_medal)
+        return medals
+
+
+medal_registry = MedalRegistry(
+    [
         HALO_MULTIKILL_STATES,
         HALO_KILLING_SPREE_STATES,
         MW2_KILLSTREAK_STATES,
@@ -1430,11 +1729,27 @@ def get_all_displayable_medals():
         MWR_MULTIKILL_STATES,
         MWR_KILLING_SPREE_STATES,
         MWR_KILLSTREAK_STATES,
-    )
-    return list(filter(lambda m: m.is_displayable_medal, all_medals))
+    ]
+)
+
+
+def get_all_displayable_medals():
+    return medal_registry.medals
 
 
 def get_stores_by_game_id(config):
+    stores_by_game_id = _build_stores_by_game_id(config)
+
+    if config.get("streak_engine", "objects") == "compact":
+        return {
+            game_id: CompactStore.from_state_machines(store.state_machines)
+            for game_id, store in stores_by_game_id.items()
+        }
+    else:
+        return stores_by_game_id
+
+
+def _build_stores_by_game_id(config):
     return dict(
         halo_3=Store(
             state_machines=[
@@ -1515,6 +1830,304 @@ def get_stores_by_game_id(config):
     )
 
 
+@attr.s(frozen=True)
+class ReplayedMedals:
+    """
+    Medals earned in a replay, in the order they were earned, with the
+    index of the review that earned each one. streak_indexes is where each
+    of the store's machines was left, to carry on from in a later replay.
+    """
+
+    review_indexes = attr.ib()
+    medals = attr.ib()
+    streak_indexes = attr.ib()
+
+    def __len__(self):
+        return len(self.medals)
+
+    def __iter__(self):
+        return zip(self.review_indexes, self.medals)
+
+
+def replay_reviews(
+    question_shown_at_ms,
+    answered_at_ms,
+    eases,
+    config,
+    game_ids=None,
+    streak_indexes_by_game_id=None,
+):
+    """
+    Medals every game, or just those in game_ids, would have awarded for a
+    history of reviews, e.g. from Anki's revlog, as ReplayedMedals by game
+    id. Reviews are given as equal length sequences of millisecond
+    timestamps and eases, in the order they were answered, and are
+    replayed as if each card was shown, flipped and answered with nothing
+    in between. Stores start fresh unless streak_indexes_by_game_id has
+    the streak_indexes of an earlier replay.
+
+    Uses NumPy if it's installed, otherwise steps through the transition
+    tables one review at a time.
+    """
+    if np is not None:
+        elapsed_ms = np.asarray(answered_at_ms, dtype=np.int64) - np.asarray(
+            question_shown_at_ms, dtype=np.int64
+        )
+        card_did_pass = np.asarray(eases) > 1
+        replay_store = _replay_store_vectorized
+    else:
+        elapsed_ms = [
+            answered - shown
+            for shown, answered in zip(question_shown_at_ms, answered_at_ms)
+        ]
+        card_did_pass = [did_card_pass(ease) for ease in eases]
+        replay_store = _replay_store
+
+    streak_indexes_by_game_id = streak_indexes_by_game_id or dict()
+
+    return {
+        game_id: replay_store(
+            [
+                TransitionTable.compile(m.states, m.interval_s)
+                for m in store.state_machines
+            ],
+            streak_indexes_by_game_id.get(
+                game_id, [0] * len(store.state_machines)
+            ),
+            elapsed_ms,
+            card_did_pass,
+        )
+        for game_id, store in _build_stores_by_game_id(config).items()
+        if game_ids is None or game_id in game_ids
+    }
+
+
+def _replay_store(tables, start_indexes, elapsed_ms, card_did_pass):
+    earned = []
+    streak_indexes = []
+    for machine_index, (table, start_index) in enumerate(
+        zip(tables, start_indexes)
+    ):
+        review_indexes, state_indexes, streak_index = _replay_table(
+            table, start_index, elapsed_ms, card_did_pass
+        )
+        earned.extend(
+            (review_index, machine_index, table.states[state_index])
+            for review_index, state_index in zip(review_indexes, state_indexes)
+        )
+        streak_indexes.append(streak_index)
+
+    # medals from one answer in the order the store lists them
+    earned.sort(key=lambda e: e[:2])
+    return ReplayedMedals(
+        review_indexes=[review_index for review_index, _, _ in earned],
+        medals=[medal for _, _, medal in earned],
+        streak_indexes=streak_indexes,
+    )
+
+
+def _replay_store_vectorized(tables, start_indexes, elapsed_ms, card_did_pass):
+    review_indexes, medals, streak_indexes = [], [], []
+    for table, start_index in zip(tables, start_indexes):
+        earned_at, state_indexes, streak_index = _replay_table_vectorized(
+            table, start_index, elapsed_ms, card_did_pass
+        )
+        review_indexes.append(earned_at)
+        medals.append(_object_array(table.states)[state_indexes])
+        streak_indexes.append(streak_index)
+
+    review_indexes = np.concatenate(review_indexes)
+    # a stable sort keeps medals from one answer in the store's order
+    order = np.argsort(review_indexes, kind="stable")
+    return ReplayedMedals(
+        review_indexes=review_indexes[order].tolist(),
+        medals=np.concatenate(medals)[order].tolist(),
+        streak_indexes=streak_indexes,
+    )
+
+
+def _object_array(values):
+    array = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        array[i] = value
+    return array
+
+
+def _replay_table(table, start_index, elapsed_ms, card_did_pass):
+    """
+    Review and state indexes of each earnable state reached, and the
+    state index left at
+    """
+    review_indexes, state_indexes = [], []
+    index = start_index
+
+    for review_index, (elapsed, passed) in enumerate(
+        zip(elapsed_ms, card_did_pass)
+    ):
+        index = table.next_streak_index(index, passed, elapsed)
+        if table.is_earnable_medal[index]:
+            review_indexes.append(review_index)
+            state_indexes.append(index)
+
+    return review_indexes, state_indexes, index
+
+
+def _replay_table_vectorized(table, start_index, elapsed_ms, card_did_pass):
+    """
+    Same as _replay_table with NumPy arrays. Following next_indexes from
+    index 0 visits a fixed chain of states, so between two resets a streak
+    is just a run of answers along it. Failed answers reset to index 0, and
+    passes too slow for every state past the first reset to index 1; the
+    chain position after each answer then comes from the run lengths
+    since the last reset. Passes that are only too slow for some states
+    (e.g. a killing spree's EndState) are checked against the state
+    they're answered at in one pass beforehand, and turned into resets.
+    """
+    chain = _StreakChain(table)
+    if (
+        table.next_indexes[0] != 1
+        or not chain.visits(start_index)
+        or len(elapsed_ms) == 0
+    ):
+        # a reset to 1 wouldn't be a position on the chain
+        review_indexes, state_indexes, streak_index = _replay_table(
+            table, start_index, elapsed_ms.tolist(), card_did_pass.tolist()
+        )
+        return (
+            np.array(review_indexes, dtype=np.int64),
+            np.array(state_indexes, dtype=np.int64),
+            streak_index,
+        )
+
+    start_position = chain.position_of(start_index)
+    min_ms = np.array(table.min_interval_ms, dtype=np.int64)
+    max_ms = np.array(table.max_interval_ms, dtype=np.int64)
+
+    could_advance = np.zeros(len(elapsed_ms), dtype=bool)
+    for bounds_ms in set(zip(min_ms[1:].tolist(), max_ms[1:].tolist())):
+        could_advance |= (bounds_ms[0] <= elapsed_ms) & (
+            elapsed_ms < bounds_ms[1]
+        )
+
+    resets_to = np.full(len(elapsed_ms), -1, dtype=np.int64)
+    resets_to[~card_did_pass] = 0
+    resets_to[card_did_pass & ~could_advance] = 1
+
+    always_advances = np.ones(len(elapsed_ms), dtype=bool)
+    for bounds_ms in set(zip(min_ms.tolist(), max_ms.tolist())):
+        always_advances &= (bounds_ms[0] <= elapsed_ms) & (
+            elapsed_ms < bounds_ms[1]
+        )
+    _reset_where_too_slow(
+        chain,
+        table,
+        resets_to,
+        start_position,
+        elapsed_ms,
+        maybe_too_slow=(resets_to < 0) & ~always_advances,
+    )
+
+    position_after = _chain_positions(resets_to, start_position)
+    state_after = chain.state_indexes(position_after)
+    is_earnable_medal = np.array(table.is_earnable_medal, dtype=bool)
+    earned_at = np.flatnonzero(is_earnable_medal[state_after])
+    return earned_at, state_after[earned_at], int(state_after[-1])
+
+
+def _reset_where_too_slow(
+    chain, table, resets_to, start_position, elapsed_ms, maybe_too_slow
+):
+    """
+    Turns the passes in maybe_too_slow that are too slow for the state
+    they're answered at into resets to index 1. Each one moves every
+    position after it, so they're checked in order, in one pass, with
+    the position worked out from the last reset before each.
+    """
+    review_indexes = np.flatnonzero(maybe_too_slow)
+    if len(review_indexes) == 0:
+        return
+
+    last_fixed_reset = np.maximum.accumulate(
+        np.where(resets_to >= 0, np.arange(len(resets_to)), -1)
+    )
+    last_reset, position_at_last_reset = -1, start_position
+
+    for review_index, fixed_reset, elapsed in zip(
+        review_indexes.tolist(),
+        last_fixed_reset[review_indexes].tolist(),
+        elapsed_ms[review_indexes].tolist(),
+    ):
+        if fixed_reset > last_reset:
+            last_reset = fixed_reset
+            position_at_last_reset = int(resets_to[fixed_reset])
+
+        state_index = chain.state_index(
+            position_at_last_reset + (review_index - 1 - last_reset)
+        )
+        if not (
+            table.min_interval_ms[state_index]
+            <= elapsed
+            < table.max_interval_ms[state_index]
+        ):
+            resets_to[review_index] = 1
+            last_reset, position_at_last_reset = review_index, 1
+
+
+def _chain_positions(resets_to, start_position):
+    """Chain position after each answer, given where resets send it"""
+    review_indexes = np.arange(len(resets_to))
+    last_reset = np.maximum.accumulate(
+        np.where(resets_to >= 0, review_indexes, -1)
+    )
+    # before the first reset, answers count on from the starting state
+    position_at_reset = np.where(
+        last_reset >= 0, resets_to[last_reset], start_position
+    )
+    return position_at_reset + (review_indexes - last_reset)
+
+
+class _StreakChain:
+    """
+    State indexes visited following next_indexes from 0: a run of states
+    then a cycle that repeats forever once the last medal is earned
+    """
+
+    def __init__(self, table):
+        visited = [0]
+        while table.next_indexes[visited[-1]] not in visited:
+            visited.append(table.next_indexes[visited[-1]])
+
+        cycle_start = visited.index(table.next_indexes[visited[-1]])
+        self._visited = visited
+        self._prefix = np.array(visited[:cycle_start], dtype=np.int64)
+        self._cycle = np.array(visited[cycle_start:], dtype=np.int64)
+
+    def visits(self, state_index):
+        return state_index in self._visited
+
+    def position_of(self, state_index):
+        return self._visited.index(state_index)
+
+    def state_index(self, position):
+        if position < len(self._prefix):
+            return self._visited[position]
+        return self._visited[
+            len(self._prefix)
+            + (position - len(self._prefix)) % len(self._cycle)
+        ]
+
+    def state_indexes(self, positions):
+        prefix, cycle = self._prefix, self._cycle
+        in_cycle = cycle[(positions - len(prefix)) % len(cycle)]
+        if len(prefix) == 0:
+            return in_cycle
+        return np.where(
+            positions < len(prefix),
+            prefix[np.minimum(positions, len(prefix) - 1)],
+            in_cycle,
+        )
+
+
 def get_next_game_id(current_game_id):
     next_index = (all_game_ids.index(current_game_id) + 1) % len(all_game_ids)
     return all_game_ids[next_index]
@@ -17,13 +17,17 @@ class Ui_ProfileSettingsDialog(object):
         ProfileSettingsDialog.setMinimumSize(QtCore.QSize(380, 0))
         self.gridLayout_2 = QtWidgets.QGridLayout(ProfileSettingsDialog)
         self.gridLayout_2.setObjectName("gridLayout_2")
+        self.pendingUploadsLabel = QtWidgets.QLabel(ProfileSettingsDialog)
+        self.pendingUploadsLabel.setText("")
+        self.pendingUploadsLabel.setObjectName("pendingUploadsLabel")
+        self.gridLayout_2.addWidget(self.pendingUploadsLabel, 1, 0, 1, 1)
         self.buttonBox = QtWidgets.QDialogButtonBox(ProfileSettingsDialog)
         self.buttonBox.setEnabled(True)
         self.buttonBox.setOrientation(QtCore.Qt.Horizontal)
         self.buttonBox.setStandardButtons(QtWidgets.QDialogButtonBox.Close)
         self.buttonBox.setCenterButtons(False)
         self.buttonBox.setObjectName("buttonBox")
-        self.gridLayout_2.addWidget(self.buttonBox, 1, 0, 1, 1)
+        self.gridLayout_2.addWidget(self.buttonBox, 2, 0, 1, 1)
         self.stackedWidget = QtWidgets.QStackedWidget(ProfileSettingsDialog)
         self.stackedWidget.setObjectName("stackedWidget")
         self.loginPage = QtWidgets.QWidget()
@@ -5,8 +5,8 @@ import attr
 import base64
 
 from ._vendor.jinja2 import Template
-from .toolz import unique, join, groupby
-from .streaks import get_all_displayable_medals, all_game_ids
+from .toolz import unique, groupby
+from .streaks import medal_registry, all_game_ids
 
 
 def MedalsOverviewHTML(achievements, header_text, current_game_id):
@@ -59,26 +59,16 @@ def medal_types_by_game_id(medal_types, game_ids):
 
 
 def medal_types(achievement_count_by_medal_id: dict):
-    medal_count_pairs = join(
-        leftseq=get_all_displayable_medals(),
-        rightseq=achievement_count_by_medal_id.items(),
-        leftkey=lambda dm: dm.id_,
-        rightkey=lambda ac: ac[0],
-    )
-
-    sorted_medals_with_counts = sorted(
-        medal_count_pairs,
-        key=lambda medal_count_pairs: medal_count_pairs[0].rank,
-    )
-
     return [
         MedalType(
             medal=medal,
             name=medal.name,
             img_src=medal.medal_image,
-            count=count,
+            count=achievement_count_by_medal_id[medal.id_],
         )
-        for medal, (medal_id, count) in sorted_medals_with_counts
+        for medals in medal_registry.by_game_id.values()
+        for medal in medals
+        if medal.id_ in achievement_count_by_medal_id
     ]
 
 
@@ -24,6 +24,32 @@ const setChaseModeHTML = (html) => {
   $("#chase_mode").html(html)
 }
 
+// patches come from html_patch.py: [path, tag, kind, html] where path is
+// the element child indices from #chase_mode down to the element to change
+const patchChaseModeHTML = (patches) => {
+  const root = document.getElementById("chase_mode")
+
+  for (const [path, tag, kind, html] of patches) {
+    let element = root
+    for (const index of path) {
+      element = element && element.children[index]
+    }
+
+    if (!element || (path.length > 0 && element.tagName.toLowerCase() !== tag)) {
+      console.log("Chase mode patch doesn't match the page", path, tag)
+      pycmd("chaseModePatchFailed")
+      return
+    }
+
+    if (kind === "outer") {
+      element.outerHTML = html
+    }
+    else {
+      element.innerHTML = html
+    }
+  }
+}
+
 $(() => {
   waitForPycmd()
 })
@@ -0,0 +1,14 @@
+"""
+Anki Killstreaks add-on
+
+Benchmarks for the add-on. Run them from the repository root, e.g.
+python -m benchmarks.answer_hook_insert
+
+Copyright: (c) jac241 2019-2021 <https://github.com/jac241>
+License: GNU AGPLv3 or later <https://www.gnu.org/licenses/agpl.html>
+"""
+import os
+
+# same as tests/conftest.py, lets the add-on be imported outside of Anki
+os.environ["IN_TEST_SUITE"] = "true"
+os.environ["KILLSTREAKS_ENV"] = "test"
@@ -0,0 +1,76 @@
+"""
+Insert latency of the answer hook with and without the database tuning.
+
+Every answered card that earns a medal goes through
+AchievementsRepository.create_all on the GUI thread. This times that call,
+queuing for upload as when logged in, against the default rollback journal (what profiles used before DbTuning)
+and against the tuned settings from config.json, optionally with a second
+thread reading counts the way the deck browser and network thread do.
+
+    python -m benchmarks.answer_hook_insert --answers 500 --with-reader
+"""
+import argparse
+from threading import Event, Thread
+
+from anki_killstreaks.persistence import (
+    AchievementsRepository,
+    DbTuning,
+    min_datetime,
+)
+from anki_killstreaks.streaks import HALO_MULTIKILL_STATES, NewAchievement
+
+from .support import format_summary, summarize, temporary_database, time_calls
+
+
+def _reader(connection_manager, stop):
+    repo = AchievementsRepository(connection_manager.connection)
+    try:
+        while not stop.is_set():
+            repo.count_by_medal_id(created_at_gt=min_datetime)
+    finally:
+        connection_manager.close_current()
+
+
+def run(tuning, answers, with_reader):
+    new_achievements = [
+        NewAchievement(medal=HALO_MULTIKILL_STATES[2], deck_id=1)
+    ]
+
+    with temporary_database(tuning=tuning) as connection_manager:
+        repo = AchievementsRepository(connection_manager.connection)
+        stop = Event()
+        reader = Thread(target=_reader, args=(connection_manager, stop))
+
+        if with_reader:
+            reader.start()
+        try:
+            return time_calls(
+                lambda: repo.create_all(
+                    new_achievements, queue_for_upload=True
+                ),
+                answers,
+            )
+        finally:
+            stop.set()
+            if with_reader:
+                reader.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--answers", type=int, default=500)
+    parser.add_argument("--with-reader", action="store_true")
+    args = parser.parse_args()
+
+    configurations = [
+        ("rollback journal (untuned)", None),
+        ("tuned (config.json defaults)", DbTuning()),
+    ]
+
+    for name, tuning in configurations:
+        durations = run(tuning, args.answers, args.with_reader)
+        print(format_summary(name, summarize(durations)))
+
+
+if __name__ == "__main__":
+    main()
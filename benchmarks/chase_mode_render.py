@@ -0,0 +1,73 @@
+"""
+Bytes passed to webview.eval per chase mode refresh.
+
+Renders a synthetic rivalry leaderboard, then refreshes it a number of
+times with one rival's medal count changing each time, as happens while
+reviewing. Compares sending the whole panel every refresh against
+ChaseModeRenderer's patches.
+
+    python -m benchmarks.chase_mode_render --rivals 25 --refreshes 50
+"""
+import argparse
+import json
+import random
+
+from anki_killstreaks.chase_mode import ChaseModeRenderer
+
+
+class _CountingWebview:
+    def __init__(self):
+        self.evals = 0
+
+    def eval(self, js):
+        self.evals += 1
+
+
+def _rivalry_html(medal_counts):
+    rows = "\n".join(
+        f'    <tr class="rival"><td class="name">Rival {i}</td>'
+        f'<td class="medals">{count}</td></tr>'
+        for i, count in enumerate(medal_counts)
+    )
+    return (
+        '<div class="chase-mode">\n'
+        '  <h3>Chase mode</h3>\n'
+        f"  <table>\n  <tbody>\n{rows}\n  </tbody>\n  </table>\n"
+        "</div>"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rivals", type=int, default=25)
+    parser.add_argument("--refreshes", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    medal_counts = [rng.randrange(100, 1000) for _ in range(args.rivals)]
+    renders = [_rivalry_html(medal_counts)]
+    for _ in range(args.refreshes):
+        medal_counts[rng.randrange(args.rivals)] += 1
+        renders.append(_rivalry_html(medal_counts))
+
+    full_bytes = sum(
+        len(f"setChaseModeHTML({json.dumps(html)})".encode("utf-8"))
+        for html in renders[1:]
+    )
+
+    renderer, webview = ChaseModeRenderer(), _CountingWebview()
+    renderer.render(webview, renders[0])
+    first_render_bytes = renderer.eval_bytes
+    for html in renders[1:]:
+        renderer.render(webview, html)
+    patched_bytes = renderer.eval_bytes - first_render_bytes
+
+    print(f"full html per refresh: {full_bytes / args.refreshes:.0f} bytes")
+    print(
+        f"patched per refresh:   {patched_bytes / args.refreshes:.0f} bytes",
+        f"(patches={renderer.patches} full_renders={renderer.full_renders - 1})",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Latency of requests to the leaderboards server with and without a pooled
+session.
+
+Starts a local HTTPS server with a throwaway self-signed certificate (made
+with the openssl command line tool) and times TokenAuthHttpClient GETs
+going through the module-level requests functions, which open a new TCP
+connection and TLS handshake every time, against a session built by
+networking.build_http_session, which keeps the connection alive.
+
+    python -m benchmarks.http_session --requests 200
+"""
+import argparse
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import shutil
+import ssl
+import subprocess
+import tempfile
+import threading
+
+from anki_killstreaks.accounts import UserRepository
+from anki_killstreaks.networking import (
+    HttpSettings,
+    TokenAuthHttpClient,
+    build_http_session,
+)
+
+from .support import format_summary, summarize, temporary_database, time_calls
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, don't let delayed ACKs
+    # dominate the timings
+    disable_nagle_algorithm = True
+    handshakes = 0
+
+    def setup(self):
+        super().setup()
+        # one handler per accepted connection
+        type(self).handshakes += 1
+
+    def do_GET(self):
+        body = b"{}"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _self_signed_certificate(folder):
+    cert_path, key_path = folder / "cert.pem", folder / "key.pem"
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+            "-days", "1", "-subj", "/CN=localhost",
+            "-addext", "subjectAltName=DNS:localhost",
+            "-keyout", str(key_path), "-out", str(cert_path),
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return cert_path, key_path
+
+
+@contextmanager
+def https_stub_server():
+    """Yields (base_url, cert_path) for a local HTTPS server"""
+    folder = Path(tempfile.mkdtemp(prefix="killstreaks_bench_tls_"))
+    cert_path, key_path = _self_signed_certificate(folder)
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_path, key_path)
+
+    server = ThreadingHTTPServer(("localhost", 0), _Handler)
+    server.daemon_threads = True
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        yield f"https://localhost:{server.server_address[1]}", cert_path
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    with temporary_database() as connection_manager, https_stub_server() as (
+        base_url,
+        cert_path,
+    ):
+        user_repo = UserRepository(connection_manager.connection)
+        url = f"{base_url}/api/v2/rivalries/halo-3"
+        session = build_http_session(HttpSettings())
+
+        for name, http_client in [
+            ("new connection per request", TokenAuthHttpClient(user_repo)),
+            (
+                "pooled keep-alive session",
+                TokenAuthHttpClient(user_repo, session=session),
+            ),
+        ]:
+            _Handler.handshakes = 0
+            durations_ms = time_calls(
+                lambda: http_client.get(url=url, verify=str(cert_path)),
+                repetitions=args.requests,
+            )
+            print(
+                format_summary(name, summarize(durations_ms)),
+                f"handshakes={_Handler.handshakes}",
+            )
+
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
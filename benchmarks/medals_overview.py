@@ -0,0 +1,72 @@
+"""
+Time to resolve medals for the medals overview.
+
+Times views.medal_types, which the deck browser and overview screens call
+with the medal counts they show, against the toolz join over every
+displayable medal it used before the medal registry, then the whole
+MedalsOverviewHTML render for context.
+
+    python -m benchmarks.medals_overview --repetitions 2000
+"""
+import argparse
+import random
+
+from anki_killstreaks import views
+from anki_killstreaks.streaks import get_all_displayable_medals
+from anki_killstreaks.toolz import join
+
+from .support import format_summary, summarize, time_calls
+
+
+def medal_types_with_join(achievement_count_by_medal_id):
+    medal_count_pairs = join(
+        leftseq=get_all_displayable_medals(),
+        rightseq=achievement_count_by_medal_id.items(),
+        leftkey=lambda dm: dm.id_,
+        rightkey=lambda ac: ac[0],
+    )
+
+    return [
+        views.MedalType(
+            medal=medal, name=medal.name, img_src=medal.medal_image, count=count
+        )
+        for medal, (medal_id, count) in sorted(
+            medal_count_pairs, key=lambda pair: pair[0].rank
+        )
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repetitions", type=int, default=2_000)
+    parser.add_argument("--medals-earned", type=int, default=30)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    medal_ids = [m.id_ for m in get_all_displayable_medals()]
+    counts = {
+        medal_id: rng.randint(1, 500)
+        for medal_id in rng.sample(medal_ids, args.medals_earned)
+    }
+
+    timings = [
+        ("medal_types, toolz join", lambda: medal_types_with_join(counts)),
+        ("medal_types, registry", lambda: views.medal_types(counts)),
+        (
+            "MedalsOverviewHTML",
+            lambda: views.MedalsOverviewHTML(
+                counts, header_text="Medals", current_game_id="halo_3"
+            ),
+        ),
+    ]
+
+    for name, f in timings:
+        repetitions = (
+            args.repetitions // 10 if name == "MedalsOverviewHTML"
+            else args.repetitions
+        )
+        print(format_summary(name, summarize(time_calls(f, repetitions))))
+
+
+if __name__ == "__main__":
+    main()
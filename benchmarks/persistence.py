@@ -0,0 +1,211 @@
+"""
+Persistence layer benchmarks against synthetic multi-year medal histories.
+
+For each history size this generates a database with that many
+achievements spread over several years, hundreds of decks and the medals of
+every game in streaks.py, then times the repository calls the add-on makes
+while reviewing, rendering the deck browser/stats and syncing. Results are
+printed and written to a JSON file so runs can be diffed between versions.
+
+    python -m benchmarks.persistence --sizes 1000,100000,1000000 \\
+        --output bench_persistence.json
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+import json
+from pathlib import Path
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+
+from anki_killstreaks.addons import THIS_ADDON_PATH
+from anki_killstreaks.persistence import (
+    AchievementsRepository,
+    ConnectionManager,
+    DbSettings,
+    DbTuning,
+    day_start_time,
+    migrate_database,
+)
+from anki_killstreaks.streaks import NewAchievement
+
+from .support import (
+    format_summary,
+    generate_history,
+    summarize,
+    time_calls,
+    weighted_medals,
+)
+
+# Schema the synthetic history is written against, later migrations are
+# applied (and timed) on top of it like they would be for an existing user
+_history_schema_version = "0007"
+
+
+def _migration_dir_up_to(version, into):
+    into.mkdir()
+    for migration in (THIS_ADDON_PATH / "migrations").glob("*.sql"):
+        if migration.name.split(".")[0] <= version:
+            shutil.copy(migration, into)
+    return into
+
+
+def run_size(size, args, rng):
+    folder = Path(tempfile.mkdtemp(prefix="killstreaks_bench_"))
+    results = dict()
+
+    try:
+        history_settings = DbSettings(
+            db_path=folder / "anki_killstreaks.db",
+            migration_dir_path=_migration_dir_up_to(
+                _history_schema_version, folder / "migrations"
+            ),
+        )
+        migrate_database(history_settings)
+
+        conn = sqlite3.connect(
+            str(history_settings.db_path), isolation_level=None
+        )
+        generate_start = time.perf_counter()
+        deck_ids = generate_history(
+            conn, size, args.decks, args.years, rng
+        )
+        conn.close()
+        print(
+            f"generated {size} achievements in "
+            f"{time.perf_counter() - generate_start:.1f}s"
+        )
+
+        settings = DbSettings(
+            db_path=history_settings.db_path,
+            migration_dir_path=THIS_ADDON_PATH / "migrations",
+            tuning=None if args.untuned else DbTuning(),
+        )
+
+        # only runs once per database, everything after is a no-op
+        results["migrate_database (pending migrations)"] = summarize(
+            time_calls(lambda: migrate_database(settings), 1)
+        )
+        results["migrate_database (up to date)"] = summarize(
+            time_calls(lambda: migrate_database(settings), args.repetitions)
+        )
+
+        connection_manager = ConnectionManager(settings)
+        repo = AchievementsRepository(connection_manager.connection)
+        medals, _ = weighted_medals()
+        now = datetime.now()
+
+        try:
+            results["create_all (1 medal)"] = summarize(
+                time_calls(
+                    lambda: repo.create_all(
+                        [
+                            NewAchievement(
+                                medal=rng.choice(medals),
+                                deck_id=rng.choice(deck_ids),
+                            )
+                        ]
+                    ),
+                    args.repetitions,
+                )
+            )
+            results["todays_achievements"] = summarize(
+                time_calls(
+                    lambda: repo.todays_achievements(
+                        day_start_time(rollover_hour=4, current_time=now)
+                    ),
+                    args.repetitions,
+                )
+            )
+            results["count_by_medal_id (lifetime)"] = summarize(
+                time_calls(repo.count_by_medal_id, args.repetitions)
+            )
+            results["achievements_for_deck_ids_since (30 days)"] = summarize(
+                time_calls(
+                    lambda: repo.achievements_for_deck_ids_since(
+                        deck_ids=rng.sample(deck_ids, 10),
+                        since_datetime=now - timedelta(days=30),
+                    ),
+                    args.repetitions,
+                )
+            )
+            results["achievements_for_whole_collection_since (1 year)"] = (
+                summarize(
+                    time_calls(
+                        lambda: repo.achievements_for_whole_collection_since(
+                            since_datetime=now - timedelta(days=365)
+                        ),
+                        args.repetitions,
+                    )
+                )
+            )
+            # default window the leaderboard sync uses without a server sync
+            results["all (since 32 days)"] = summarize(
+                time_calls(
+                    lambda: repo.all(now - timedelta(days=32)),
+                    max(1, args.repetitions // 10),
+                )
+            )
+        finally:
+            connection_manager.close_all()
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    return results
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="1000,100000,1000000")
+    parser.add_argument("--decks", type=int, default=300)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--repetitions", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=241)
+    parser.add_argument("--untuned", action="store_true")
+    parser.add_argument("--output", default="bench_persistence.json")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    report = dict(
+        meta=dict(
+            git_revision=_git_revision(),
+            python=platform.python_version(),
+            sqlite=sqlite3.sqlite_version,
+            platform=platform.platform(),
+            created_at=datetime.now(timezone.utc).isoformat(),
+            args=vars(args),
+        ),
+        results=dict(),
+    )
+
+    for size in (int(s) for s in args.sizes.split(",")):
+        results = run_size(size, args, rng)
+        report["results"][str(size)] = results
+
+        print(f"--- {size} achievements")
+        for name, summary in results.items():
+            print(format_summary(name, summary))
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("wrote", args.output)
+
+
+if __name__ == "__main__":
+    main()
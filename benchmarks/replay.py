@@ -0,0 +1,94 @@
+"""
+Time to replay a review history through every game's medals.
+
+Generates a history shaped roughly like Anki's revlog (answer times capped
+at a minute, around one review in ten failed) and times
+streaks.replay_reviews with NumPy and with the plain Python loop. Then
+does the same for a history with no fails and answers taking 3s or 70s,
+where killing sprees reach their end states and slow answers reset them.
+
+    python -m benchmarks.replay --reviews 1000000
+"""
+import argparse
+import json
+import random
+import time
+
+from anki_killstreaks import streaks
+from anki_killstreaks.addons import THIS_ADDON_PATH
+
+
+def review_history(size, rng):
+    """Shaped roughly like Anki's revlog"""
+    question_shown_at_ms, answered_at_ms, eases = [], [], []
+    now_ms = 1_500_000_000_000
+
+    for _ in range(size):
+        # mostly back to back, with the odd break between sessions
+        now_ms += 500 if rng.random() < 0.99 else rng.randrange(3_600_000)
+        question_shown_at_ms.append(now_ms)
+        now_ms += min(int(rng.expovariate(1 / 6000)), 60_000)
+        answered_at_ms.append(now_ms)
+        eases.append(1 if rng.random() < 0.1 else rng.choice([2, 3, 3, 4]))
+
+    return question_shown_at_ms, answered_at_ms, eases
+
+
+def unbroken_history(size, rng):
+    """Never failed, with answers either quick or too slow for an EndState"""
+    question_shown_at_ms, answered_at_ms, eases = [], [], []
+    now_ms = 1_500_000_000_000
+
+    for _ in range(size):
+        now_ms += 500
+        question_shown_at_ms.append(now_ms)
+        now_ms += rng.choice([3_000, 70_000])
+        answered_at_ms.append(now_ms)
+        eases.append(rng.choice([2, 3, 3, 4]))
+
+    return question_shown_at_ms, answered_at_ms, eases
+
+
+def time_replays(name, history, config):
+    print(name)
+    numpy = streaks.np
+    review_count = len(history[0])
+
+    for backend, np in [("numpy", numpy), ("python", None)]:
+        if backend == "numpy" and np is None:
+            print("numpy isn't installed")
+            continue
+
+        streaks.np = np
+        start = time.perf_counter()
+        medals_by_game_id = streaks.replay_reviews(*history, config)
+        elapsed_s = time.perf_counter() - start
+        medal_count = sum(len(medals) for medals in medals_by_game_id.values())
+        print(
+            f"{backend:<8} {elapsed_s:8.2f}s "
+            f"{review_count / elapsed_s:12,.0f} reviews/s medals={medal_count}"
+        )
+
+    streaks.np = numpy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--reviews", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    config = json.loads((THIS_ADDON_PATH / "config.json").read_text())
+    time_replays(
+        "revlog-like history",
+        review_history(args.reviews, random.Random(0)),
+        config,
+    )
+    time_replays(
+        "no fails, 3s or 70s answers",
+        unbroken_history(args.reviews, random.Random(0)),
+        config,
+    )
+
+
+if __name__ == "__main__":
+    main()
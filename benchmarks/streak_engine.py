@@ -0,0 +1,54 @@
+"""
+Review events per second through each streak engine.
+
+Drives the stores from get_stores_by_game_id with the events a review
+makes (question shown, answer shown, answered) for every game, once with
+the immutable state objects and once with CompactStore, reading the
+medals the reviewing controller reads after each answer.
+
+    python -m benchmarks.streak_engine --reviews 20000
+"""
+import argparse
+import json
+import random
+import time
+
+from anki_killstreaks.addons import THIS_ADDON_PATH
+from anki_killstreaks.streaks import get_stores_by_game_id
+
+
+def run(stores_by_game_id, answers):
+    events = 0
+    start = time.perf_counter()
+
+    for store in stores_by_game_id.values():
+        for card_did_pass in answers:
+            store = store.on_show_question()
+            store = store.on_show_answer()
+            store = store.on_answer(card_did_pass)
+            store.current_earnable_medals
+            store.current_displayable_medals
+            events += 3
+
+    return events / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--reviews", type=int, default=20_000)
+    args = parser.parse_args()
+
+    config = json.loads((THIS_ADDON_PATH / "config.json").read_text())
+    rng = random.Random(0)
+    answers = [rng.random() < 0.85 for _ in range(args.reviews)]
+
+    for engine in ["objects", "compact"]:
+        stores_by_game_id = get_stores_by_game_id(
+            dict(config, streak_engine=engine)
+        )
+        events_per_s = run(stores_by_game_id, answers)
+        print(f"{engine:<10} {events_per_s:12,.0f} events/s")
+
+
+if __name__ == "__main__":
+    main()
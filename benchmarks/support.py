@@ -0,0 +1,119 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+import shutil
+import statistics
+import tempfile
+import time
+import uuid
+
+from anki_killstreaks.addons import THIS_ADDON_PATH
+from anki_killstreaks.persistence import (
+    ConnectionManager,
+    DbSettings,
+    migrate_database,
+    sqlite_timestamp,
+)
+from anki_killstreaks.streaks import get_all_displayable_medals
+
+
+@contextmanager
+def temporary_database(tuning=None):
+    """Yields a connection manager for a freshly migrated database"""
+    folder = Path(tempfile.mkdtemp(prefix="killstreaks_bench_"))
+    settings = DbSettings(
+        db_path=folder / "anki_killstreaks.db",
+        migration_dir_path=THIS_ADDON_PATH / "migrations",
+        tuning=tuning,
+    )
+    migrate_database(settings)
+    manager = ConnectionManager(settings)
+
+    try:
+        yield manager
+    finally:
+        manager.close_all()
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def weighted_medals():
+    medals = get_all_displayable_medals()
+    # higher ranked medals are rarer, like they are when reviewing
+    weights = [1 / (medal.rank ** 1.5) for medal in medals]
+    return medals, weights
+
+
+def generate_history(conn, size, deck_count, years, rng):
+    medals, weights = weighted_medals()
+    medal_ids = [m.id_ for m in medals]
+    deck_ids = [1_500_000_000_000 + i for i in range(deck_count)]
+    # a few decks get most of the reviews
+    deck_weights = [1 / (i + 1) for i in range(deck_count)]
+
+    end = datetime.now(timezone.utc)
+    start = end - timedelta(days=365 * years)
+    span_s = (end - start).total_seconds()
+    offsets_s = sorted(rng.uniform(0, span_s) for _ in range(size))
+
+    chosen_medal_ids = rng.choices(medal_ids, weights=weights, k=size)
+    chosen_deck_ids = rng.choices(deck_ids, weights=deck_weights, k=size)
+
+    rows = (
+        (
+            medal_id,
+            sqlite_timestamp(start + timedelta(seconds=offset_s)),
+            deck_id,
+            str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+        )
+        for medal_id, offset_s, deck_id in zip(
+            chosen_medal_ids, offsets_s, chosen_deck_ids
+        )
+    )
+
+    conn.execute("BEGIN")
+    conn.executemany(
+        """
+        INSERT INTO achievements(medal_id, created_at, deck_id, uuid)
+        VALUES (?, ?, ?, ?)
+        """,
+        rows,
+    )
+    conn.execute("COMMIT")
+
+    return deck_ids
+
+
+def time_calls(f, repetitions):
+    """Calls f repetitions times, returning each call's duration in ms"""
+    durations_ms = []
+
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        f()
+        durations_ms.append((time.perf_counter() - start) * 1000)
+
+    return durations_ms
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def summarize(durations_ms):
+    ordered = sorted(durations_ms)
+    return dict(
+        n=len(ordered),
+        mean_ms=statistics.fmean(ordered),
+        p50_ms=percentile(ordered, 0.50),
+        p99_ms=percentile(ordered, 0.99),
+        max_ms=ordered[-1],
+    )
+
+
+def format_summary(name, summary):
+    return (
+        f"{name:<50} n={summary['n']:<7} "
+        f"p50={summary['p50_ms']:8.3f}ms p99={summary['p99_ms']:8.3f}ms "
+        f"max={summary['max_ms']:8.3f}ms"
+    )
@@ -0,0 +1,103 @@
+"""
+Peak memory of building the leaderboard sync upload.
+
+Compares the streaming payload builder in leaderboards.py with the
+previous approach (list of attrs -> one JSON string -> one-shot zlib) on a
+synthetic history, 1M achievements by default. Peak memory is measured
+with tracemalloc, so absolute times are slower than without it.
+
+    python -m benchmarks.sync_payload --size 1000000
+"""
+import argparse
+import codecs
+import json
+import random
+import time
+import tracemalloc
+import zlib
+
+from anki_killstreaks import leaderboards
+from anki_killstreaks._vendor import attr
+from anki_killstreaks.persistence import (
+    AchievementsRepository,
+    DbTuning,
+    PersistedAchievement,
+    min_datetime,
+)
+
+from .support import generate_history, temporary_database
+
+
+def build_payload_in_one_shot(repo):
+    """How _sync_achievements built the upload before it was streamed"""
+    attrs = [
+        attr.asdict(
+            a,
+            filter=attr.filters.exclude(
+                attr.fields(PersistedAchievement).medal
+            ),
+        )
+        for a in repo.all(min_datetime)
+    ]
+    return codecs.encode(bytes(json.dumps(attrs), "utf-8"), "zlib")
+
+
+def _paged_achievements(repo, chunk_size=10_000):
+    after_id = 0
+    while True:
+        chunk = repo.page_since(min_datetime, after_id, chunk_size)
+        if len(chunk) == 0:
+            return
+        yield from chunk
+        after_id = chunk[-1].id_
+
+
+def build_payload_streaming(repo):
+    with leaderboards._compress_achievements_attrs(
+        leaderboards._iter_achievements_attrs(_paged_achievements(repo))
+    ) as payload:
+        return payload.read()
+
+
+def measure(build):
+    tracemalloc.start()
+    start = time.perf_counter()
+    payload = build()
+    elapsed_s = time.perf_counter() - start
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return payload, elapsed_s, peak_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=241)
+    args = parser.parse_args()
+
+    with temporary_database(tuning=DbTuning()) as connection_manager:
+        conn = connection_manager.connection()
+        generate_history(
+            conn, args.size, deck_count=300, years=3,
+            rng=random.Random(args.seed),
+        )
+        repo = AchievementsRepository(connection_manager.connection)
+
+        payloads = []
+        for name, build in [
+            ("one shot (list + dumps + zlib)", build_payload_in_one_shot),
+            ("streaming (pages + compressobj)", build_payload_streaming),
+        ]:
+            payload, elapsed_s, peak_bytes = measure(lambda: build(repo))
+            payloads.append(payload)
+            print(
+                f"{name:<35} peak={peak_bytes / 2**20:8.1f}MiB "
+                f"time={elapsed_s:6.2f}s "
+                f"payload={len(payload) / 2**20:6.1f}MiB"
+            )
+
+    assert zlib.decompress(payloads[0]) == zlib.decompress(payloads[1])
+
+
+if __name__ == "__main__":
+    main()
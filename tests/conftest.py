@@ -18,6 +18,7 @@ from anki_killstreaks.persistence import (
     migrate_database,
     AchievementsRepository,
 )
+from .stub_server import StubServer
 
 
 @pytest.yield_fixture()
@@ -65,3 +66,10 @@ def get_db_connection(db_settings):
 @pytest.fixture
 def achievements_repo(get_db_connection):
     return AchievementsRepository(get_db_connection)
+
+
+@pytest.fixture
+def stub_server():
+    server = StubServer().start()
+    yield server
+    server.stop()
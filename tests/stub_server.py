@@ -0,0 +1,135 @@
+"""
+Anki Killstreaks add-on
+
+Minimal local HTTP server standing in for ankiachievements.com in tests.
+
+Copyright: (c) jac241 2019-2021 <https://github.com/jac241>
+License: GNU AGPLv3 or later <https://www.gnu.org/licenses/agpl.html>
+"""
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from threading import Lock, Thread
+
+from anki_killstreaks._vendor import attr
+
+
+@attr.s(frozen=True)
+class RecordedRequest:
+    method = attr.ib()
+    path = attr.ib()
+    headers = attr.ib()
+    body = attr.ib()
+
+    def json(self):
+        return json.loads(self.body)
+
+    def files(self):
+        """Uploaded files of a multipart/form-data body by field name"""
+        message = BytesParser(policy=default_policy).parsebytes(
+            b"Content-Type: "
+            + self.headers["Content-Type"].encode("utf-8")
+            + b"\r\n\r\n"
+            + self.body
+        )
+        return {
+            part.get_param("name", header="content-disposition"): (
+                part.get_payload(decode=True)
+            )
+            for part in message.iter_parts()
+            if part.get_filename()
+        }
+
+
+def json_response(body, status=200, headers=None):
+    return status, {"Content-Type": "application/json", **(headers or {})}, (
+        json.dumps(body).encode("utf-8")
+    )
+
+
+class StubServer:
+    """
+    Serves responses from handlers registered per (method, path) and
+    records every request it receives. A handler takes the RecordedRequest
+    and returns (status, headers, body bytes).
+    """
+
+    def __init__(self):
+        self.requests = []
+        self._handlers = dict()
+        self._lock = Lock()
+        self._server = ThreadingHTTPServer(
+            ("127.0.0.1", 0), self._build_request_handler()
+        )
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def route(self, method, path, handler):
+        self._handlers[(method, path)] = handler
+
+    def requests_to(self, method, path):
+        with self._lock:
+            return [
+                r for r in self.requests
+                if r.method == method and r.path == path
+            ]
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handle(self, handler):
+        length = int(handler.headers.get("Content-Length", 0))
+        request = RecordedRequest(
+            method=handler.command,
+            path=handler.path,
+            headers=dict(handler.headers),
+            body=handler.rfile.read(length),
+        )
+        with self._lock:
+            self.requests.append(request)
+
+        route = self._handlers.get((request.method, request.path))
+        if route is None:
+            status, headers, body = 404, {}, b""
+        else:
+            status, headers, body = route(request)
+
+        handler.send_response(status)
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _build_request_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                stub._handle(self)
+
+            def do_POST(self):
+                stub._handle(self)
+
+            def do_PUT(self):
+                stub._handle(self)
+
+            def do_DELETE(self):
+                stub._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
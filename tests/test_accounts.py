@@ -1,4 +1,4 @@
-from anki_killstreaks.accounts import UserRepository
+from anki_killstreaks.accounts import CachingUserRepository, UserRepository
 
 import pytest
 
@@ -22,3 +22,60 @@ def test_UserRepository_save_should_user_with_passed_attributes(user_repository)
     assert saved_user[2] == "token"
     assert saved_user[3] == "a client"
     assert saved_user[4] == "sometime"
+
+
+@pytest.fixture
+def caching_user_repository(user_repository):
+    return CachingUserRepository(user_repository)
+
+
+def _save_user(user_repository, token="token"):
+    user_repository.save(
+        uid="JimmyYoshi@gmail.com",
+        token=token,
+        client="a client",
+        expiry="sometime",
+    )
+
+
+def test_CachingUserRepository_load_should_serve_repeated_loads_from_memory(caching_user_repository):
+    _save_user(caching_user_repository)
+
+    first = caching_user_repository.load()
+    second = caching_user_repository.load()
+
+    assert first is second
+    assert first.token == "token"
+    assert caching_user_repository.misses == 1
+    assert caching_user_repository.hits == 1
+
+
+def test_CachingUserRepository_save_should_skip_unchanged_credentials(caching_user_repository, user_repository):
+    _save_user(caching_user_repository)
+    caching_user_repository.load()
+
+    with user_repository.get_db_connection() as conn:
+        conn.execute("UPDATE users SET token = 'changed behind its back'")
+    _save_user(caching_user_repository)
+
+    assert caching_user_repository.writes_skipped == 1
+    assert user_repository.load().token == "changed behind its back"
+
+
+def test_CachingUserRepository_save_should_write_rotated_tokens_through(caching_user_repository, user_repository):
+    _save_user(caching_user_repository)
+    caching_user_repository.load()
+
+    _save_user(caching_user_repository, token="rotated")
+
+    assert user_repository.load().token == "rotated"
+    assert caching_user_repository.load().token == "rotated"
+
+
+def test_CachingUserRepository_invalidate_should_reread_the_user(caching_user_repository, user_repository):
+    caching_user_repository.load()
+    _save_user(user_repository, token="saved elsewhere")
+
+    caching_user_repository.invalidate()
+
+    assert caching_user_repository.load().token == "saved elsewhere"
@@ -0,0 +1,133 @@
+"""
+Anki Killstreaks add-on
+
+Copyright: (c) jac241 2019-2021 <https://github.com/jac241>
+License: GNU AGPLv3 or later <https://www.gnu.org/licenses/agpl.html>
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+import requests
+
+from anki_killstreaks import async_networking
+from anki_killstreaks.accounts import UserRepository
+from anki_killstreaks.async_networking import (
+    AsyncTokenAuthHttpClient,
+    EventLoopThread,
+    HttpResponse,
+    RequestsTransport,
+)
+from anki_killstreaks.networking import HttpSettings, build_http_session
+
+from .stub_server import json_response
+
+
+@pytest.fixture
+def event_loop_thread():
+    event_loop_thread = EventLoopThread()
+    event_loop_thread.start()
+    yield event_loop_thread
+    event_loop_thread.stop(timeout_s=5)
+
+
+@pytest.fixture(params=["requests", "aiohttp"])
+def transport(request, event_loop_thread):
+    if request.param == "aiohttp" and async_networking.aiohttp is None:
+        pytest.skip("aiohttp isn't installed")
+
+    if request.param == "aiohttp":
+        async def build():
+            return async_networking.AiohttpTransport(pool_size=4)
+    else:
+        session = build_http_session(HttpSettings(pool_size=4))
+
+        async def build():
+            return RequestsTransport(session, pool_size=4)
+
+    transport = event_loop_thread.submit(build()).result(timeout=5)
+    yield transport
+    event_loop_thread.submit(transport.close()).result(timeout=5)
+
+
+@pytest.fixture
+def user_repo(get_db_connection):
+    user_repo = UserRepository(get_db_connection)
+    user_repo.save(uid="a@b.c", token="token", client="client", expiry="1")
+    return user_repo
+
+
+def _run(event_loop_thread, coroutine):
+    return event_loop_thread.submit(coroutine).result(timeout=5)
+
+
+def test_EventLoopThread_submit_should_run_coroutines_on_the_loop_thread(event_loop_thread):
+    async def thread_name():
+        return threading.current_thread().name
+
+    assert _run(event_loop_thread, thread_name()) == "killstreaks-event-loop"
+
+
+def test_AsyncTokenAuthHttpClient_should_send_and_store_auth_headers(stub_server, event_loop_thread, transport, user_repo):
+    stub_server.route(
+        "GET",
+        "/api/v2/rivalries/halo-3",
+        lambda r: json_response(
+            {"rival": "someone"},
+            headers={
+                "access-token": "rotated",
+                "uid": "a@b.c",
+                "client": "client",
+                "expiry": "2",
+            },
+        ),
+    )
+    client = AsyncTokenAuthHttpClient(user_repo, transport)
+
+    response = _run(
+        event_loop_thread,
+        client.get(url=f"{stub_server.base_url}/api/v2/rivalries/halo-3"),
+    )
+
+    assert response.json() == {"rival": "someone"}
+    sent = stub_server.requests_to("GET", "/api/v2/rivalries/halo-3")[0]
+    assert sent.headers["access-token"] == "token"
+    assert user_repo.load().token == "rotated"
+
+
+def test_AsyncTokenAuthHttpClient_should_keep_many_requests_in_flight(stub_server, event_loop_thread, transport, user_repo):
+    def slow_response(request):
+        time.sleep(0.2)
+        return json_response({})
+
+    stub_server.route("GET", "/slow", slow_response)
+    client = AsyncTokenAuthHttpClient(user_repo, transport)
+
+    async def get_all():
+        return await asyncio.gather(
+            *[client.get(url=f"{stub_server.base_url}/slow") for _ in range(4)]
+        )
+
+    start = time.perf_counter()
+    responses = _run(event_loop_thread, get_all())
+
+    assert [r.status_code for r in responses] == [200] * 4
+    assert time.perf_counter() - start < 0.6
+
+
+def test_transports_should_raise_requests_connection_errors(event_loop_thread, transport):
+    with pytest.raises(requests.exceptions.ConnectionError):
+        _run(
+            event_loop_thread,
+            transport.request("get", "http://127.0.0.1:9", timeout=(1, 1)),
+        )
+
+
+def test_HttpResponse_raise_for_status_should_raise_requests_http_errors():
+    response = HttpResponse(status_code=503, headers={}, text="")
+
+    with pytest.raises(requests.HTTPError) as error:
+        response.raise_for_status()
+
+    assert error.value.response is response
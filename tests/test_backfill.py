@@ -0,0 +1,269 @@
+"""
+Anki Killstreaks add-on
+
+Copyright: (c) jac241 2019-2021 <https://github.com/jac241>
+License: GNU AGPLv3 or later <https://www.gnu.org/licenses/agpl.html>
+"""
+from collections import Counter
+from datetime import datetime, timezone
+import random
+import sqlite3
+import threading
+
+import pytest
+
+from anki_killstreaks.backfill import BackfillWorker, RevlogBackfill, RevlogReader
+from anki_killstreaks.persistence import (
+    AchievementsRepository,
+    BackfillStateRepository,
+    min_datetime,
+    sqlite_timestamp,
+)
+from anki_killstreaks.streaks import (
+    HALO_MULTIKILL_STATES,
+    NewAchievement,
+    replay_reviews,
+)
+
+
+config = dict(multikill_interval_s=8, killing_spree_interval_s=60)
+
+home_deck_id = 1_500
+filtered_deck_id = 1_600
+default_deck_id = 1
+deleted_card_id = 3
+
+
+class FakeCollectionDb:
+    """The parts of Anki's col.db the backfill uses, over a bare revlog"""
+
+    def __init__(self):
+        self._conn = sqlite3.connect(":memory:", check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE cards (id INTEGER PRIMARY KEY, did INTEGER, odid INTEGER);
+            CREATE TABLE revlog (
+                id INTEGER PRIMARY KEY, cid INTEGER, ease INTEGER, time INTEGER
+            );
+            """
+        )
+        self._conn.execute("INSERT INTO cards VALUES (1, ?, 0)", (home_deck_id,))
+        self._conn.execute(
+            "INSERT INTO cards VALUES (2, ?, ?)", (filtered_deck_id, home_deck_id)
+        )
+
+    def add_reviews(self, reviews):
+        self._conn.executemany(
+            "INSERT INTO revlog(id, cid, ease, time) VALUES (?, ?, ?, ?)",
+            reviews,
+        )
+
+    def all(self, sql, *args):
+        return self._conn.execute(sql, args).fetchall()
+
+    def scalar(self, sql, *args):
+        return self._conn.execute(sql, args).fetchone()[0]
+
+
+def _reviews(rng, size, start_ms=1_500_000_000_000):
+    """(revlog id, card id, ease, ms taken) answered one after another"""
+    reviews = []
+    answered_at_ms = start_ms
+    for _ in range(size):
+        answered_at_ms += rng.randint(1_000, 15_000)
+        reviews.append(
+            (
+                answered_at_ms,
+                rng.choice([1, 2]),
+                1 if rng.random() < 0.1 else rng.choice([2, 3, 4]),
+                rng.randint(500, 5_000),
+            )
+        )
+    return reviews
+
+
+def _expected_rows(reviews, game_id, deck_id=home_deck_id):
+    revlog_ids, _card_ids, eases, taken_ms = zip(*reviews)
+    replayed = replay_reviews(
+        [id_ - ms for id_, ms in zip(revlog_ids, taken_ms)],
+        revlog_ids,
+        eases,
+        config,
+        game_ids=[game_id],
+    )[game_id]
+
+    return Counter(
+        (
+            medal.id_,
+            deck_id,
+            sqlite_timestamp(
+                datetime.fromtimestamp(
+                    revlog_ids[review_index] / 1000, timezone.utc
+                )
+            ),
+        )
+        for review_index, medal in replayed
+    )
+
+
+def _saved_rows(get_db_connection):
+    with get_db_connection() as conn:
+        return Counter(
+            conn.execute(
+                "SELECT medal_id, deck_id, created_at FROM achievements"
+            ).fetchall()
+        )
+
+
+@pytest.fixture
+def col_db():
+    return FakeCollectionDb()
+
+
+@pytest.fixture
+def backfill_state_repo(get_db_connection):
+    return BackfillStateRepository(get_db_connection)
+
+
+def test_RevlogBackfill_run_should_save_medals_when_their_reviews_were_answered(col_db, backfill_state_repo, get_db_connection):
+    reviews = _reviews(random.Random(1), 2_000)
+    col_db.add_reviews(reviews)
+    progress = []
+    backfill = RevlogBackfill(
+        RevlogReader(col_db, batch_size=300),
+        backfill_state_repo,
+        config,
+        on_progress=lambda done, total: progress.append((done, total)),
+    )
+
+    medals_created = backfill.run("halo_3", now_ms=reviews[-1][0] + 1)
+
+    expected = _expected_rows(reviews, "halo_3")
+    assert sum(expected.values()) > 100
+    assert medals_created == sum(expected.values())
+    assert _saved_rows(get_db_connection) == expected
+    assert progress[0] == (0, 2_000)
+    assert progress[-1] == (2_000, 2_000)
+    assert backfill_state_repo.load_in_progress() is None
+    with get_db_connection() as conn:
+        outbox_count = conn.execute(
+            "SELECT count() FROM achievement_outbox"
+        ).fetchone()[0]
+    assert outbox_count == 0
+
+
+def test_RevlogBackfill_run_should_save_medals_for_deleted_cards_in_the_default_deck(col_db, backfill_state_repo, get_db_connection):
+    reviews = [
+        (answered_at_ms, deleted_card_id, ease, ms)
+        for answered_at_ms, _card_id, ease, ms in _reviews(random.Random(5), 500)
+    ]
+    col_db.add_reviews(reviews)
+
+    RevlogBackfill(
+        RevlogReader(col_db, batch_size=100), backfill_state_repo, config
+    ).run("halo_3", now_ms=reviews[-1][0] + 1)
+
+    expected = _expected_rows(reviews, "halo_3", deck_id=default_deck_id)
+    assert sum(expected.values()) > 10
+    assert _saved_rows(get_db_connection) == expected
+
+
+def test_RevlogBackfill_run_should_save_medals_that_are_never_synced(col_db, backfill_state_repo, get_db_connection):
+    # after min_datetime, so they would be in the page if not left out
+    reviews = _reviews(random.Random(6), 500, start_ms=1_700_000_000_000)
+    col_db.add_reviews(reviews)
+    achievements_repo = AchievementsRepository(get_db_connection)
+
+    medals_created = RevlogBackfill(
+        RevlogReader(col_db, batch_size=100), backfill_state_repo, config
+    ).run("halo_3", now_ms=reviews[-1][0] + 1)
+    earned_live = achievements_repo.create_all(
+        [NewAchievement(medal=HALO_MULTIKILL_STATES[2], deck_id=home_deck_id)]
+    )
+
+    assert medals_created > 0
+    assert len(achievements_repo.all()) == medals_created + 1
+    sync_page = achievements_repo.page_since(
+        since_datetime=min_datetime, after_id=0, limit=10_000
+    )
+    assert [a.id_ for a in sync_page] == [earned_live[0].id_]
+
+
+def test_RevlogBackfill_run_should_carry_on_after_being_cancelled(col_db, backfill_state_repo, get_db_connection):
+    reviews = _reviews(random.Random(2), 2_000)
+    col_db.add_reviews(reviews)
+
+    def cancel_after_a_batch(done, total):
+        if done > 0:
+            interrupted.cancel()
+
+    interrupted = RevlogBackfill(
+        RevlogReader(col_db, batch_size=700),
+        backfill_state_repo,
+        config,
+        on_progress=cancel_after_a_batch,
+    )
+    assert interrupted.run("halo_3", now_ms=reviews[-1][0] + 1) is None
+    assert backfill_state_repo.load_in_progress().last_revlog_id == reviews[699][0]
+
+    progress = []
+    resumed = RevlogBackfill(
+        RevlogReader(col_db, batch_size=700),
+        backfill_state_repo,
+        config,
+        on_progress=lambda done, total: progress.append((done, total)),
+    )
+    # the game it was started with is carried on with
+    medals_created = resumed.run("halo_5", now_ms=reviews[-1][0] + 1)
+
+    expected = _expected_rows(reviews, "halo_3")
+    assert medals_created == sum(expected.values())
+    assert _saved_rows(get_db_connection) == expected
+    assert progress[0] == (700, 2_000)
+
+
+def test_RevlogBackfill_run_should_only_replay_reviews_before_the_first_medal(col_db, backfill_state_repo, get_db_connection):
+    reviews = _reviews(random.Random(3), 1_000)
+    col_db.add_reviews(reviews)
+    with get_db_connection() as conn:
+        conn.execute(
+            """
+            INSERT INTO achievements(medal_id, deck_id, uuid, created_at)
+            VALUES (1, 1, 'earned-live', ?)
+            """,
+            (
+                sqlite_timestamp(
+                    datetime.fromtimestamp(reviews[600][0] / 1000, timezone.utc)
+                ),
+            ),
+        )
+    earned_live = _saved_rows(get_db_connection)
+
+    RevlogBackfill(
+        RevlogReader(col_db, batch_size=250), backfill_state_repo, config
+    ).run("halo_3", now_ms=reviews[-1][0] + 1)
+
+    # the medal's timestamp is truncated to the second
+    replayed = [review for review in reviews if review[0] < reviews[600][0] // 1000 * 1000]
+    assert _saved_rows(get_db_connection) == (
+        _expected_rows(replayed, "halo_3") + earned_live
+    )
+
+
+def test_BackfillWorker_should_close_its_connection_on_its_own_thread_once_stopped(col_db, backfill_state_repo):
+    reviews = _reviews(random.Random(4), 2_000)
+    col_db.add_reviews(reviews)
+    closed_on = []
+    worker = BackfillWorker(
+        RevlogReader(col_db, batch_size=10),
+        backfill_state_repo,
+        config,
+        close_connection=lambda: closed_on.append(threading.current_thread()),
+    )
+
+    worker.start("halo_3", now_ms=reviews[-1][0] + 1)
+    worker.cancel()
+
+    assert worker.wait(timeout_s=5)
+    assert len(closed_on) == 1
+    assert closed_on[0].name == "killstreaks-backfill"
@@ -0,0 +1,338 @@
+"""
+Anki Killstreaks add-on
+
+Copyright: (c) jac241 2019-2021 <https://github.com/jac241>
+License: GNU AGPLv3 or later <https://www.gnu.org/licenses/agpl.html>
+"""
+import sys
+import threading
+
+import pytest
+
+from anki_killstreaks import chase_mode
+from anki_killstreaks._vendor import attr
+from anki_killstreaks.accounts import UserRepository
+from anki_killstreaks.async_networking import EventLoopThread, HttpResponse
+from anki_killstreaks.networking import TokenAuthHttpClient
+
+
+class FakeWebview:
+    def __init__(self):
+        self.evaluated = []
+        self.eval_threads = []
+
+    def eval(self, js):
+        self.evaluated.append(js)
+        self.eval_threads.append(threading.current_thread())
+
+
+@attr.s
+class FakeChaseModeContext:
+    webview = attr.ib(factory=FakeWebview)
+    current_game_id = attr.ib(default="halo_3")
+
+
+@attr.s(frozen=True)
+class FakeResponse:
+    text = attr.ib()
+    headers = attr.ib(factory=dict)
+
+
+@pytest.fixture(autouse=True)
+def rivalry_cache(monkeypatch):
+    rivalry_cache = chase_mode.RivalryCache()
+    monkeypatch.setattr(chase_mode, "_rivalry_cache", rivalry_cache)
+    return rivalry_cache
+
+
+@pytest.fixture(autouse=True)
+def renderer(monkeypatch):
+    renderer = chase_mode.ChaseModeRenderer()
+    monkeypatch.setattr(chase_mode, "_renderer", renderer)
+    return renderer
+
+
+@pytest.fixture
+def rivalry_server(stub_server, monkeypatch):
+    monkeypatch.setattr(chase_mode, "sra_base_url", stub_server.base_url)
+    return stub_server
+
+
+def _rivalry_route(html, etag):
+    def respond(request):
+        if request.headers.get("If-None-Match") == etag:
+            return 304, {"ETag": etag}, b""
+        return 200, {"ETag": etag}, html.encode("utf-8")
+
+    return respond
+
+
+@pytest.fixture
+def http_client(get_db_connection):
+    return TokenAuthHttpClient(
+        UserRepository(get_db_connection), shared_headers={}
+    )
+
+
+def _fetch(http_client, context):
+    chase_mode._fetch_and_display_chase_mode(
+        http_client, context, reraise=True
+    )
+
+
+def test_fetch_and_display_chase_mode_should_not_rerender_an_unchanged_rivalry(rivalry_server, http_client, rivalry_cache):
+    rivalry_server.route(
+        "GET", "/api/v2/rivalries/halo-3", _rivalry_route("<p>rival</p>", '"v1"')
+    )
+    context = FakeChaseModeContext()
+
+    _fetch(http_client, context)
+    _fetch(http_client, context)
+
+    requests_sent = rivalry_server.requests_to("GET", "/api/v2/rivalries/halo-3")
+    assert "If-None-Match" not in requests_sent[0].headers
+    assert requests_sent[1].headers["If-None-Match"] == '"v1"'
+    assert len(context.webview.evaluated) == 1
+    assert "<p>rival</p>" in context.webview.evaluated[0]
+    assert rivalry_cache.not_modified_count == 1
+
+
+def test_fetch_and_display_chase_mode_should_render_a_changed_rivalry(rivalry_server, http_client):
+    rivalry_server.route(
+        "GET", "/api/v2/rivalries/halo-3", _rivalry_route("<p>old</p>", '"v1"')
+    )
+    context = FakeChaseModeContext()
+    _fetch(http_client, context)
+
+    rivalry_server.route(
+        "GET", "/api/v2/rivalries/halo-3", _rivalry_route("<p>new</p>", '"v2"')
+    )
+    _fetch(http_client, context)
+
+    assert len(context.webview.evaluated) == 2
+    assert "<p>new</p>" in context.webview.evaluated[1]
+
+
+def test_render_cached_rivalry_should_show_the_cached_game_right_away(rivalry_server, http_client):
+    for slug, html in [("halo-3", "<p>halo 3</p>"), ("halo-5", "<p>halo 5</p>")]:
+        rivalry_server.route(
+            "GET", f"/api/v2/rivalries/{slug}", _rivalry_route(html, slug)
+        )
+    webview = FakeWebview()
+    _fetch(http_client, FakeChaseModeContext(webview, "halo_3"))
+    _fetch(http_client, FakeChaseModeContext(webview, "halo_5"))
+
+    chase_mode._render_cached_rivalry(FakeChaseModeContext(webview, "halo_3"))
+
+    assert "<p>halo 3</p>" in webview.evaluated[-1]
+    assert len(webview.evaluated) == 3
+
+
+class FakeAsyncHttpClient:
+    def __init__(self, response):
+        self._response = response
+
+    async def get(self, url, headers):
+        return self._response
+
+
+@pytest.fixture
+def qt_app():
+    from PyQt5.QtCore import QCoreApplication
+
+    return QCoreApplication.instance() or QCoreApplication(sys.argv)
+
+
+@pytest.fixture
+def event_loop_thread():
+    event_loop_thread = EventLoopThread()
+    event_loop_thread.start()
+    yield event_loop_thread
+    event_loop_thread.stop(timeout_s=5)
+
+
+def test_fetch_and_display_chase_mode_async_should_render_on_the_main_thread(qt_app, event_loop_thread):
+    webview = FakeWebview()
+    display = chase_mode.AsyncRivalryDisplay()
+    http_client = FakeAsyncHttpClient(
+        HttpResponse(status_code=200, headers={}, text="<p>rival</p>")
+    )
+
+    event_loop_thread.submit(
+        chase_mode._fetch_and_display_chase_mode_async(
+            http_client,
+            webview,
+            slug="halo-3",
+            display=display,
+        )
+    ).result(timeout=5)
+
+    assert webview.evaluated == []
+    qt_app.processEvents()
+    assert "<p>rival</p>" in webview.evaluated[0]
+    assert webview.eval_threads == [threading.main_thread()]
+
+
+def test_ChaseModeRenderer_render_should_patch_only_the_changed_row(renderer):
+    webview = FakeWebview()
+    rows = "".join(f"<tr><td>rival {i}</td><td>{i}</td></tr>" for i in range(20))
+    renderer.render(webview, f"<div><table><tbody>{rows}</tbody></table></div>")
+
+    renderer.render(
+        webview,
+        f"<div><table><tbody>{rows.replace('<td>7</td>', '<td>8</td>')}</tbody></table></div>",
+    )
+
+    assert webview.evaluated[1] == 'patchChaseModeHTML([[[0, 0, 0, 7, 1], "td", "inner", "8"]])'
+    assert renderer.full_renders == 1
+    assert renderer.patches == 1
+    assert renderer.eval_bytes == sum(len(js) for js in webview.evaluated)
+    assert len(webview.evaluated[1]) < len(webview.evaluated[0]) / 10
+
+
+def test_ChaseModeRenderer_render_should_skip_html_already_showing(renderer):
+    webview = FakeWebview()
+
+    renderer.render(webview, "<p>rival</p>")
+    renderer.render(webview, "<p>rival</p>")
+
+    assert len(webview.evaluated) == 1
+    assert renderer.renders_skipped == 1
+
+
+def test_ChaseModeRenderer_render_should_render_in_full_after_forgetting(renderer):
+    webview = FakeWebview()
+    renderer.render(webview, "<p>rival</p>")
+
+    renderer.forget()
+    renderer.render(webview, "<p>rival</p>")
+
+    assert webview.evaluated == ['setChaseModeHTML("<p>rival</p>")'] * 2
+
+
+def test_ChaseModeRenderer_render_should_escape_html_for_javascript(renderer):
+    webview = FakeWebview()
+
+    renderer.render(webview, '<p title="`${x}`">\\</p>')
+
+    assert webview.evaluated == [r'setChaseModeHTML("<p title=\"`${x}`\">\\</p>")']
+
+
+def test_RivalryCache_validators_for_should_send_last_modified_too(rivalry_cache):
+    rivalry_cache.store(
+        "halo-3",
+        FakeResponse("", {"Last-Modified": "Wed, 21 Oct 2015 07:28:00 GMT"}),
+    )
+
+    assert rivalry_cache.validators_for("halo-3") == {
+        "If-Modified-Since": "Wed, 21 Oct 2015 07:28:00 GMT"
+    }
+    assert rivalry_cache.validators_for("halo-5") == {}
+
+
+class FakeTimer:
+    def __init__(self, on_timeout):
+        self.on_timeout = on_timeout
+        self.remaining_ms = None
+        self.started = []
+
+    def start(self, interval_ms):
+        self.remaining_ms = interval_ms
+        self.started.append(interval_ms)
+
+    def stop(self):
+        self.remaining_ms = None
+
+    def isActive(self):
+        return self.remaining_ms is not None
+
+    def remainingTime(self):
+        return self.remaining_ms
+
+    def fire(self):
+        self.remaining_ms = None
+        self.on_timeout()
+
+
+@attr.s
+class Review:
+    is_reviewing = attr.ib(default=True)
+    fetches = attr.ib(default=0)
+
+    def fetch(self):
+        self.fetches += 1
+
+
+@pytest.fixture
+def timers():
+    return []
+
+
+@pytest.fixture
+def scheduler(timers):
+    def build_timer(parent, on_timeout):
+        timers.append(FakeTimer(on_timeout))
+        return timers[-1]
+
+    return chase_mode.ChaseModeRefreshScheduler(
+        active_interval_ms=100,
+        idle_interval_ms=350,
+        after_medals_delay_ms=5,
+        build_timer=build_timer,
+    )
+
+
+def _start(scheduler, review):
+    scheduler.start(
+        review.fetch, is_reviewing=lambda: review.is_reviewing, parent=None
+    )
+
+
+def test_ChaseModeRefreshScheduler_should_back_off_while_idle(scheduler, timers):
+    review = Review()
+    _start(scheduler, review)
+
+    for _ in range(4):
+        timers[0].fire()
+
+    assert timers[0].started == [100, 200, 350, 350, 350]
+    assert scheduler.polls_issued == review.fetches == 4
+
+
+def test_ChaseModeRefreshScheduler_should_refresh_soon_after_medals(scheduler, timers):
+    _start(scheduler, Review())
+    timers[0].fire()
+    timers[0].fire()
+
+    scheduler.on_answer(earned_medal_count=0)
+    assert timers[0].remaining_ms == 100
+    scheduler.on_answer(earned_medal_count=2)
+    assert timers[0].remaining_ms == 5
+    # answering without medals doesn't push the refresh back
+    scheduler.on_answer(earned_medal_count=0)
+    assert timers[0].remaining_ms == 5
+
+
+def test_ChaseModeRefreshScheduler_should_stop_when_the_reviewer_is_not_showing(scheduler, timers):
+    review = Review()
+    _start(scheduler, review)
+
+    review.is_reviewing = False
+    timers[0].fire()
+    scheduler.on_answer(earned_medal_count=1)
+
+    assert review.fetches == 0
+    assert scheduler.polls_skipped == 1
+    assert not timers[0].isActive()
+    assert not scheduler.is_running
+
+
+def test_ChaseModeRefreshScheduler_should_reuse_its_one_timer(scheduler, timers):
+    first, second = Review(), Review()
+    _start(scheduler, first)
+    _start(scheduler, second)
+
+    timers[0].fire()
+
+    assert len(timers) == 1
+    assert (first.fetches, second.fetches) == (0, 1)
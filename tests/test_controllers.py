@@ -5,13 +5,26 @@ Copyright: (c) jac241 2019-2020 <https://github.com/jac241>
 License: GNU AGPLv3 or later <https://www.gnu.org/licenses/agpl.html>
 """
 import itertools
+import sqlite3
+import threading
+import time
 from unittest.mock import Mock
 
 import pytest
 from .test_streaks import question_shown_state
 
-from anki_killstreaks.controllers import ReviewingController, AllMedalsAchievedNotifier
-from anki_killstreaks.persistence import AchievementsRepository
+from anki_killstreaks.controllers import (
+    AllMedalsAchievedNotifier,
+    AnswerListeningController,
+    ReviewingController,
+    _finish_network_jobs,
+)
+from anki_killstreaks.networking import ExecutorSettings, JobExecutor
+from anki_killstreaks.persistence import (
+    AchievementsRepository,
+    ConnectionManager,
+    migrate_database,
+)
 from anki_killstreaks.streaks import Store
 
 
@@ -108,3 +121,57 @@ def test_AllMedalsAcheivedNotifier_should_call_callback_when_all_medals_acheived
         notifier.on_answer(ease=4, deck_id=0)
 
     assert flag == True
+
+
+def test_AnswerListeningController_on_answer_should_pass_earned_medals_on(reviewing_controller):
+    on_answered = Mock()
+    controller = AnswerListeningController(
+        controller=reviewing_controller, on_answered=on_answered
+    )
+
+    earned_medals = controller.on_answer(ease=3, deck_id=0)
+
+    on_answered.assert_called_once_with(earned_medals)
+    assert controller.store is reviewing_controller.store
+
+
+def _wait_until(condition, timeout_s=5):
+    deadline = time.monotonic() + timeout_s
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_finish_network_jobs_should_have_every_worker_close_its_connection(db_settings):
+    migrate_database(settings=db_settings)
+    connection_manager = ConnectionManager(db_settings)
+    executor = JobExecutor(ExecutorSettings(worker_count=2, live_limit=2))
+    executor.call_after_each_job(connection_manager.close_current_if_retired)
+    both_connected = threading.Barrier(2, timeout=5)
+
+    def connect():
+        connection_manager.connection()
+        both_connected.wait()
+
+    executor.start()
+    executor.put(connect)
+    executor.put(connect)
+    _wait_until(lambda: connection_manager.open_connection_count == 2)
+
+    outbox = Mock()
+    _finish_network_jobs(
+        outbox=outbox,
+        connection_manager=connection_manager,
+        job_queue=executor,
+        http_session=Mock(),
+        deliver_achievements=True,
+    )
+
+    # idle workers close theirs without waiting for another job
+    _wait_until(lambda: connection_manager.open_connection_count == 0)
+    open_connection_count = connection_manager.open_connection_count
+    executor.shutdown(timeout_s=5)
+
+    outbox.deliver_now.assert_called_once()
+    assert open_connection_count == 0
+    with pytest.raises(sqlite3.ProgrammingError):
+        connection_manager.connection()
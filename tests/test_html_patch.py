@@ -0,0 +1,72 @@
+"""
+Anki Killstreaks add-on
+
+Copyright: (c) jac241 2019-2021 <https://github.com/jac241>
+License: GNU AGPLv3 or later <https://www.gnu.org/licenses/agpl.html>
+"""
+from anki_killstreaks import html_patch
+
+
+def test_diff_should_be_empty_for_the_same_html():
+    assert html_patch.diff("<p>a</p>", "<p>a</p>") == []
+
+
+def test_diff_should_replace_the_contents_of_the_innermost_changed_element():
+    old = '<div class="rival">\n  <span>Jon</span>\n  <span>10</span>\n</div>'
+    new = '<div class="rival">\n  <span>Jon</span>\n  <span>12</span>\n</div>'
+
+    assert html_patch.diff(old, new) == [[[0, 1], "span", "inner", "12"]]
+
+
+def test_diff_should_find_elements_after_other_kinds_of_line_breaks():
+    old = '<div>\r\n  <b>Jon\u2028Snow</b>\r\n  <span>10</span>\n</div>'
+    new = '<div>\r\n  <b>Jon\u2028Snow</b>\r\n  <span>12</span>\n</div>'
+
+    assert html_patch.diff(old, new) == [[[0, 1], "span", "inner", "12"]]
+
+
+def test_diff_should_replace_an_element_whose_attributes_changed():
+    old = '<ul><li class="behind">a</li><li>b</li></ul>'
+    new = '<ul><li class="ahead">a</li><li>b</li></ul>'
+
+    assert html_patch.diff(old, new) == [
+        [[0, 0], "li", "outer", '<li class="ahead">a</li>']
+    ]
+
+
+def test_diff_should_replace_the_parents_contents_when_children_are_added():
+    old = "<ul><li>a</li></ul>"
+    new = "<ul><li>a</li><li>b</li></ul>"
+
+    assert html_patch.diff(old, new) == [
+        [[0], "ul", "inner", "<li>a</li><li>b</li>"]
+    ]
+
+
+def test_diff_should_replace_everything_when_top_level_text_changed():
+    assert html_patch.diff("Loading<br>", "") == [[[], None, "inner", ""]]
+
+
+def test_diff_should_handle_void_and_self_closing_elements():
+    old = '<div><img src="a.png"><br/><span>1</span></div>'
+    new = '<div><img src="b.png"><br/><span>2</span></div>'
+
+    assert html_patch.diff(old, new) == [
+        [[0, 0], "img", "outer", '<img src="b.png">'],
+        [[0, 2], "span", "inner", "2"],
+    ]
+
+
+def test_diff_should_not_patch_inside_tables_the_browser_adds_a_tbody_to():
+    old = "<table><tr><td>1</td></tr></table>"
+    new = "<table><tr><td>2</td></tr></table>"
+
+    assert html_patch.diff(old, new) == [
+        [[0], "table", "inner", "<tr><td>2</td></tr>"]
+    ]
+
+
+def test_diff_should_give_up_on_html_the_browser_would_restructure():
+    assert html_patch.diff("<p><div>a</div></p>", "<p><div>b</div></p>") is None
+    assert html_patch.diff("<ul><li>a</ul>", "<ul><li>b</ul>") is None
+    assert html_patch.diff("<div>a", "<div>b") is None
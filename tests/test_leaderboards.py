@@ -0,0 +1,461 @@
+"""
+Anki Killstreaks add-on
+
+Copyright: (c) jac241 2019-2021 <https://github.com/jac241>
+License: GNU AGPLv3 or later <https://www.gnu.org/licenses/agpl.html>
+"""
+import json
+from unittest.mock import Mock
+import zlib
+
+import pytest
+import requests
+
+from anki_killstreaks import leaderboards
+from anki_killstreaks.accounts import UserRepository
+from anki_killstreaks.networking import TokenAuthHttpClient
+from anki_killstreaks.persistence import (
+    AchievementOutboxRepository,
+    SyncStateRepository,
+    min_datetime,
+)
+from anki_killstreaks.streaks import HALO_MULTIKILL_STATES, NewAchievement
+
+from .stub_server import json_response
+
+
+@pytest.fixture
+def saved_achievements(achievements_repo):
+    return achievements_repo.create_all(
+        [
+            NewAchievement(medal=medal, deck_id=i)
+            for i, medal in enumerate(HALO_MULTIKILL_STATES[2:])
+        ]
+    )
+
+
+@pytest.mark.parametrize("flush_threshold_bytes", [1, 64 * 1024])
+def test_compress_achievements_attrs_should_stream_the_same_json_as_dumping_a_list(achievements_repo, saved_achievements, monkeypatch, flush_threshold_bytes):
+    monkeypatch.setattr(
+        leaderboards, "_json_flush_threshold_bytes", flush_threshold_bytes
+    )
+    chunk = achievements_repo.page_since(
+        since_datetime=min_datetime, after_id=0, limit=100
+    )
+    expected_attrs = list(leaderboards._iter_achievements_attrs(chunk))
+
+    with leaderboards._compress_achievements_attrs(
+        leaderboards._iter_achievements_attrs(chunk)
+    ) as payload:
+        decompressed = zlib.decompress(payload.read())
+
+    assert decompressed == json.dumps(expected_attrs).encode("utf-8")
+    assert {a["uuid"] for a in expected_attrs} == {
+        a.uuid for a in saved_achievements
+    }
+
+
+def test_compress_achievements_attrs_should_encode_an_empty_history():
+    with leaderboards._compress_achievements_attrs(iter([])) as payload:
+        assert json.loads(zlib.decompress(payload.read())) == []
+
+
+@pytest.fixture
+def user_repo(get_db_connection):
+    return UserRepository(get_db_connection)
+
+
+@pytest.fixture
+def sync_state_repo(get_db_connection):
+    return SyncStateRepository(get_db_connection)
+
+
+@pytest.fixture
+def sync_server(stub_server, monkeypatch):
+    monkeypatch.setattr(leaderboards, "sra_base_url", stub_server.base_url)
+    stub_server.route("GET", "/api/v1/syncs", lambda r: json_response([]))
+    stub_server.route("POST", "/api/v1/syncs", lambda r: json_response({}))
+    return stub_server
+
+
+def _uploaded_uuids(sync_requests):
+    return [
+        a["uuid"]
+        for request in sync_requests
+        for a in json.loads(
+            zlib.decompress(request.files()["achievements_file"])
+        )
+    ]
+
+
+def _sync(user_repo, achievements_repo, sync_state_repo, chunk_size):
+    leaderboards._sync_achievements(
+        user_repo,
+        achievements_repo,
+        sync_state_repo,
+        TokenAuthHttpClient(user_repo),
+        chunk_size=chunk_size,
+    )
+
+
+def test_sync_achievements_should_upload_in_chunks(sync_server, user_repo, achievements_repo, sync_state_repo):
+    saved = achievements_repo.create_all(
+        [NewAchievement(medal=HALO_MULTIKILL_STATES[2], deck_id=0)] * 12
+    )
+
+    _sync(user_repo, achievements_repo, sync_state_repo, chunk_size=5)
+
+    assert len(sync_server.requests_to("POST", "/api/v1/syncs")) == 3
+    assert _uploaded_uuids(
+        sync_server.requests_to("POST", "/api/v1/syncs")
+    ) == [a.uuid for a in saved]
+    assert sync_state_repo.load_in_progress() is None
+
+
+class TimeoutRecordingSession:
+    def __init__(self):
+        self.timeouts = []
+
+    def get(self, **kwargs):
+        self.timeouts.append(kwargs["timeout"])
+        return requests.get(**kwargs)
+
+    def post(self, **kwargs):
+        self.timeouts.append(kwargs["timeout"])
+        return requests.post(**kwargs)
+
+
+def test_sync_achievements_should_use_the_configured_timeout(sync_server, user_repo, achievements_repo, sync_state_repo):
+    achievements_repo.create_all(
+        [NewAchievement(medal=HALO_MULTIKILL_STATES[2], deck_id=0)] * 3
+    )
+    session = TimeoutRecordingSession()
+
+    leaderboards._sync_achievements(
+        user_repo,
+        achievements_repo,
+        sync_state_repo,
+        TokenAuthHttpClient(user_repo, session=session, timeout=(3, 45)),
+    )
+
+    assert session.timeouts == [(3, 45), (3, 45)]
+
+
+def test_sync_achievements_should_not_post_an_empty_chunk_after_a_full_one(sync_server, user_repo, achievements_repo, sync_state_repo):
+    saved = achievements_repo.create_all(
+        [NewAchievement(medal=HALO_MULTIKILL_STATES[2], deck_id=0)] * 10
+    )
+
+    _sync(user_repo, achievements_repo, sync_state_repo, chunk_size=5)
+
+    posts = sync_server.requests_to("POST", "/api/v1/syncs")
+    assert len(posts) == 2
+    assert _uploaded_uuids(posts) == [a.uuid for a in saved]
+    assert sync_state_repo.load_in_progress() is None
+
+
+def test_sync_achievements_should_resume_after_the_last_acknowledged_chunk(sync_server, user_repo, achievements_repo, sync_state_repo):
+    saved = achievements_repo.create_all(
+        [NewAchievement(medal=HALO_MULTIKILL_STATES[2], deck_id=0)] * 12
+    )
+    post_count = 0
+
+    def fail_second_chunk(request):
+        nonlocal post_count
+        post_count += 1
+        return json_response({}, status=500 if post_count == 2 else 200)
+
+    sync_server.route("POST", "/api/v1/syncs", fail_second_chunk)
+
+    with pytest.raises(requests.HTTPError):
+        _sync(user_repo, achievements_repo, sync_state_repo, chunk_size=5)
+
+    assert sync_state_repo.load_in_progress().last_acknowledged_id == (
+        saved[4].id_
+    )
+
+    _sync(user_repo, achievements_repo, sync_state_repo, chunk_size=5)
+
+    posts = sync_server.requests_to("POST", "/api/v1/syncs")
+    acknowledged_posts = [posts[0], *posts[2:]]
+    acknowledged_uuids = _uploaded_uuids(acknowledged_posts)
+    assert acknowledged_uuids == [a.uuid for a in saved]
+    # resuming doesn't ask the server where to start again
+    assert len(sync_server.requests_to("GET", "/api/v1/syncs")) == 1
+    assert sync_state_repo.load_in_progress() is None
+
+
+class ImmediateJobQueue:
+    def __init__(self):
+        self.jobs = []
+
+    def put(self, job):
+        self.jobs.append(job)
+
+    def run_all(self):
+        while self.jobs:
+            self.jobs.pop(0)()
+
+    def report_reachable(self):
+        pass
+
+    def report_unreachable(self):
+        pass
+
+    def retry_later(self, job, attempt):
+        return False
+
+
+@pytest.fixture
+def job_queue():
+    return ImmediateJobQueue()
+
+
+@pytest.fixture
+def outbox_repo(get_db_connection):
+    return AchievementOutboxRepository(get_db_connection)
+
+
+class FakeTimers:
+    def __init__(self):
+        self.pending = []
+
+    def start(self, interval, function):
+        self.pending.append(function)
+
+    def fire_all(self):
+        while self.pending:
+            self.pending.pop(0)()
+
+
+@pytest.fixture
+def timers():
+    return FakeTimers()
+
+
+@pytest.fixture
+def achievements_server(sync_server):
+    sync_server.route(
+        "POST", "/api/v1/achievements/batch", lambda r: json_response({})
+    )
+    sync_server.route(
+        "POST", "/api/v1/achievements", lambda r: json_response({})
+    )
+    return sync_server
+
+
+@pytest.fixture
+def outbox(achievements_server, user_repo, outbox_repo, sync_state_repo, job_queue, timers):
+    user_repo.save(uid="a@b.c", token="token", client="client", expiry="1")
+    return leaderboards.AchievementOutbox(
+        outbox_repo=outbox_repo,
+        user_repo=user_repo,
+        http_client=TokenAuthHttpClient(user_repo),
+        job_queue=job_queue,
+        sync_state_repo=sync_state_repo,
+        upload_settings=leaderboards.UploadSettings(window_s=0.5, batch_size=3),
+        start_timer=timers.start,
+    )
+
+
+def _save_double_kills(achievements_repo, count):
+    return achievements_repo.create_all(
+        [NewAchievement(medal=HALO_MULTIKILL_STATES[2], deck_id=0)] * count,
+        queue_for_upload=True,
+    )
+
+
+def _batched_uuids(batch_requests):
+    return [
+        [a["client_db_uuid"] for a in r.json()["achievements"]]
+        for r in batch_requests
+    ]
+
+
+def test_AchievementOutbox_should_coalesce_achievements_until_the_window_closes(achievements_server, outbox, achievements_repo, job_queue, timers):
+    first = _save_double_kills(achievements_repo, 1)
+    outbox.deliver_pending(new_achievement_count=1)
+    second = _save_double_kills(achievements_repo, 1)
+    outbox.deliver_pending(new_achievement_count=1)
+
+    assert len(timers.pending) == 1
+    assert job_queue.jobs == []
+
+    timers.fire_all()
+    job_queue.run_all()
+
+    assert _batched_uuids(
+        achievements_server.requests_to("POST", "/api/v1/achievements/batch")
+    ) == [[first[0].uuid, second[0].uuid]]
+    assert outbox.pending_count == 0
+    assert outbox.upload_stats["requests_per_achievement"] == 0.5
+
+
+def test_AchievementOutbox_should_deliver_once_a_full_batch_is_waiting(achievements_server, outbox, achievements_repo, job_queue, timers):
+    saved = _save_double_kills(achievements_repo, 4)
+    outbox.deliver_pending(new_achievement_count=4)
+
+    job_queue.run_all()
+    # the window was cut short, its timer has nothing left to do
+    timers.fire_all()
+    job_queue.run_all()
+
+    assert _batched_uuids(
+        achievements_server.requests_to("POST", "/api/v1/achievements/batch")
+    ) == [[a.uuid for a in saved[:3]], [saved[3].uuid]]
+
+
+def test_AchievementOutbox_flush_should_deliver_without_waiting_for_the_window(achievements_server, outbox, achievements_repo, job_queue, timers):
+    _save_double_kills(achievements_repo, 1)
+    outbox.deliver_pending(new_achievement_count=1)
+
+    outbox.flush()
+    job_queue.run_all()
+
+    assert outbox.pending_count == 0
+    assert len(
+        achievements_server.requests_to("POST", "/api/v1/achievements/batch")
+    ) == 1
+
+
+def test_AchievementOutbox_should_fall_back_to_single_posts_without_a_batch_endpoint(achievements_server, outbox, achievements_repo, job_queue):
+    achievements_server.route(
+        "POST",
+        "/api/v1/achievements/batch",
+        lambda r: json_response({}, status=404),
+    )
+    saved = _save_double_kills(achievements_repo, 2)
+
+    outbox.flush()
+    job_queue.run_all()
+
+    assert [
+        r.json()["client_db_uuid"]
+        for r in achievements_server.requests_to(
+            "POST", "/api/v1/achievements"
+        )
+    ] == [a.uuid for a in saved]
+    assert outbox.pending_count == 0
+
+
+def test_AchievementOutbox_should_keep_achievements_the_server_failed_on(achievements_server, outbox, achievements_repo, job_queue):
+    achievements_server.route(
+        "POST",
+        "/api/v1/achievements/batch",
+        lambda r: json_response({}, status=503),
+    )
+    _save_double_kills(achievements_repo, 2)
+
+    outbox.flush()
+    with pytest.raises(requests.HTTPError):
+        job_queue.run_all()
+
+    assert outbox.pending_count == 2
+
+
+def test_AchievementOutbox_should_drop_achievements_the_server_rejected(achievements_server, outbox, achievements_repo, job_queue):
+    achievements_server.route(
+        "POST",
+        "/api/v1/achievements/batch",
+        lambda r: json_response({}, status=422),
+    )
+    _save_double_kills(achievements_repo, 2)
+
+    outbox.flush()
+    job_queue.run_all()
+
+    assert outbox.pending_count == 0
+
+
+def test_RemoteAchievementsRepository_create_all_should_deliver_through_the_outbox(achievements_server, outbox, user_repo, achievements_repo, job_queue, timers):
+    remote_repo = leaderboards.RemoteAchievementsRepository(
+        local_repo=achievements_repo,
+        user_repo=user_repo,
+        outbox=outbox,
+    )
+
+    saved = remote_repo.create_all(
+        [NewAchievement(medal=HALO_MULTIKILL_STATES[2], deck_id=0)]
+    )
+    timers.fire_all()
+    job_queue.run_all()
+
+    assert _batched_uuids(
+        achievements_server.requests_to("POST", "/api/v1/achievements/batch")
+    ) == [[saved[0].uuid]]
+
+
+def test_RemoteAchievementsRepository_create_all_should_not_queue_while_logged_out(user_repo, achievements_repo, outbox_repo):
+    outbox = Mock()
+    remote_repo = leaderboards.RemoteAchievementsRepository(
+        local_repo=achievements_repo,
+        user_repo=user_repo,
+        outbox=outbox,
+    )
+
+    remote_repo.create_all(
+        [NewAchievement(medal=HALO_MULTIKILL_STATES[2], deck_id=0)]
+    )
+
+    assert outbox_repo.pending_count() == 0
+    outbox.deliver_pending.assert_not_called()
+
+
+def test_AchievementOutbox_should_hold_deliveries_while_a_sync_is_in_progress(achievements_server, outbox, achievements_repo, sync_state_repo, job_queue):
+    _save_double_kills(achievements_repo, 2)
+    sync_state_repo.start(min_datetime)
+
+    outbox.flush()
+    job_queue.run_all()
+
+    assert achievements_server.requests_to(
+        "POST", "/api/v1/achievements/batch"
+    ) == []
+    assert outbox.pending_count == 2
+
+
+def test_sync_if_logged_in_should_deliver_only_what_the_sync_did_not_upload(achievements_server, outbox, user_repo, achievements_repo, sync_state_repo, job_queue):
+    synced = _save_double_kills(achievements_repo, 3)
+
+    def save_during_sync(request):
+        unsynced.extend(_save_double_kills(achievements_repo, 1))
+        return json_response({})
+
+    unsynced = []
+    achievements_server.route("POST", "/api/v1/syncs", save_during_sync)
+    leaderboards.sync_if_logged_in(
+        user_repo,
+        achievements_repo,
+        sync_state_repo,
+        job_queue,
+        TokenAuthHttpClient(user_repo),
+        outbox,
+    )
+    job_queue.run_all()
+
+    assert _uploaded_uuids(
+        achievements_server.requests_to("POST", "/api/v1/syncs")
+    ) == [a.uuid for a in synced]
+    assert _batched_uuids(
+        achievements_server.requests_to("POST", "/api/v1/achievements/batch")
+    ) == [[a.uuid for a in unsynced]]
+    assert outbox.pending_count == 0
+
+
+def test_AchievementOutbox_should_retry_a_delivery_that_timed_out(outbox, achievements_repo, job_queue, monkeypatch):
+    retried = []
+    monkeypatch.setattr(
+        job_queue, "retry_later", lambda job, attempt: retried.append(job)
+    )
+
+    def time_out(user, http_client, achievements):
+        raise requests.exceptions.Timeout()
+
+    monkeypatch.setattr(leaderboards, "_post_achievements", time_out)
+    _save_double_kills(achievements_repo, 1)
+
+    outbox.flush()
+    job_queue.run_all()
+
+    assert len(retried) == 1
+    assert outbox.pending_count == 1
@@ -0,0 +1,395 @@
+"""
+Anki Killstreaks add-on
+
+Copyright: (c) jac241 2019-2021 <https://github.com/jac241>
+License: GNU AGPLv3 or later <https://www.gnu.org/licenses/agpl.html>
+"""
+from functools import partial
+import threading
+import time
+from unittest.mock import Mock
+
+import pytest
+
+from anki_killstreaks.accounts import UserRepository
+from anki_killstreaks.networking import (
+    CircuitBreaker,
+    DelayedJobScheduler,
+    ExecutorSettings,
+    HttpSettings,
+    JobExecutor,
+    JobPriority,
+    RequeuingJob,
+    RetryPolicy,
+    TokenAuthHttpClient,
+    build_http_session,
+    default_timeout,
+)
+
+
+@pytest.fixture
+def user_repo(get_db_connection):
+    return UserRepository(get_db_connection)
+
+
+@pytest.fixture
+def session():
+    session = Mock()
+    session.get.return_value = Mock(status_code=200, headers={})
+    return session
+
+
+def test_TokenAuthHttpClient_should_send_requests_through_its_session(user_repo, session):
+    client = TokenAuthHttpClient(user_repo, session=session)
+
+    client.get(url="https://example.com")
+
+    session.get.assert_called_once()
+
+
+def test_TokenAuthHttpClient_should_apply_its_timeout_to_every_request(user_repo, session):
+    client = TokenAuthHttpClient(user_repo, session=session)
+
+    client.get(url="https://example.com")
+
+    assert session.get.call_args.kwargs["timeout"] == default_timeout
+
+
+def test_TokenAuthHttpClient_should_let_a_request_override_the_timeout(user_repo, session):
+    client = TokenAuthHttpClient(user_repo, session=session, timeout=(1, 2))
+
+    client.get(url="https://example.com", timeout=5)
+
+    assert session.get.call_args.kwargs["timeout"] == 5
+
+
+def test_HttpSettings_from_config_should_fall_back_to_defaults():
+    settings = HttpSettings.from_config({"http_read_timeout_s": 10})
+
+    assert settings.timeout == (HttpSettings().connect_timeout_s, 10)
+    assert settings.pool_size == HttpSettings().pool_size
+
+
+def test_build_http_session_should_pool_connections_per_scheme():
+    session = build_http_session(HttpSettings(pool_size=2))
+
+    adapter = session.get_adapter("https://ankiachievements.com")
+
+    assert adapter is session.get_adapter("http://localhost:5000")
+    assert adapter._pool_maxsize == 2
+    session.close()
+
+
+def _blocking_job(started, release):
+    def job():
+        started.set()
+        release.wait(timeout=5)
+
+    return job
+
+
+def test_JobExecutor_should_run_higher_priority_jobs_first():
+    executor = JobExecutor(ExecutorSettings(worker_count=1))
+    started, release = threading.Event(), threading.Event()
+    ran = []
+    executor.put(_blocking_job(started, release))
+    executor.start()
+    started.wait(timeout=5)
+
+    executor.put(lambda: ran.append("bulk"), priority=JobPriority.BULK)
+    executor.put(lambda: ran.append("live"), priority=JobPriority.LIVE)
+    executor.put(
+        lambda: ran.append("interactive"), priority=JobPriority.INTERACTIVE
+    )
+    release.set()
+    executor.shutdown(timeout_s=5)
+
+    assert ran == ["interactive", "live", "bulk"]
+
+
+def test_JobExecutor_should_take_the_priority_of_requeuing_jobs():
+    executor = JobExecutor(ExecutorSettings(worker_count=1))
+    ran = []
+
+    executor.put(
+        RequeuingJob(
+            lambda: ran.append("sync"),
+            exception_to_retry_on=ConnectionError,
+            job_queue=executor,
+            priority=JobPriority.BULK,
+        )
+    )
+
+    assert executor.metrics["bulk"]["queued"] == 1
+    executor.start()
+    executor.shutdown(timeout_s=5)
+    assert ran == ["sync"]
+
+
+def test_JobExecutor_should_respect_per_priority_concurrency_limits():
+    executor = JobExecutor(ExecutorSettings(worker_count=3, bulk_limit=1))
+    lock = threading.Lock()
+    running = 0
+    most_running = 0
+
+    def bulk_job():
+        nonlocal running, most_running
+        with lock:
+            running += 1
+            most_running = max(most_running, running)
+        time.sleep(0.01)
+        with lock:
+            running -= 1
+
+    for _ in range(5):
+        executor.put(bulk_job, priority=JobPriority.BULK)
+    executor.start()
+    executor.shutdown(timeout_s=5)
+
+    assert most_running == 1
+    assert executor.metrics["bulk"]["completed"] == 5
+
+
+def test_JobExecutor_should_not_block_other_classes_behind_a_slow_bulk_job():
+    executor = JobExecutor(ExecutorSettings(worker_count=2))
+    started, release = threading.Event(), threading.Event()
+    live_ran = threading.Event()
+    executor.start()
+
+    executor.put(_blocking_job(started, release), priority=JobPriority.BULK)
+    started.wait(timeout=5)
+    executor.put(live_ran.set, priority=JobPriority.LIVE)
+
+    assert live_ran.wait(timeout=5)
+    release.set()
+    executor.shutdown(timeout_s=5)
+
+
+def test_JobExecutor_shutdown_should_drain_queued_jobs_then_refuse_new_ones():
+    executor = JobExecutor(ExecutorSettings(worker_count=2))
+    ran = []
+    for i in range(10):
+        executor.put(partial(ran.append, i))
+    executor.start()
+
+    assert executor.shutdown(timeout_s=5)
+    executor.put(partial(ran.append, "too late"))
+
+    assert sorted(ran) == list(range(10))
+    assert executor.queue_depth == 0
+
+
+def test_JobExecutor_should_count_failed_jobs_and_keep_working():
+    executor = JobExecutor(ExecutorSettings(worker_count=1))
+    ran = []
+
+    executor.put(lambda: 1 / 0)
+    executor.put(partial(ran.append, "after"))
+    executor.start()
+    executor.shutdown(timeout_s=5)
+
+    assert ran == ["after"]
+    assert executor.metrics["live"]["failed"] == 1
+    assert executor.metrics["live"]["completed"] == 2
+
+
+def test_JobExecutor_call_after_each_job_should_call_back_on_the_worker_after_every_job():
+    executor = JobExecutor(ExecutorSettings(worker_count=1))
+    worker_names, calls = [], []
+
+    executor.call_after_each_job(
+        lambda: calls.append(threading.current_thread().name)
+    )
+    for _ in range(3):
+        executor.put(
+            lambda: worker_names.append(threading.current_thread().name)
+        )
+    executor.start()
+    executor.shutdown(timeout_s=5)
+
+    # and once more as it stops
+    assert calls[:3] == worker_names
+    assert len(calls) >= 4
+
+
+def test_JobExecutor_wake_idle_workers_should_have_them_call_back():
+    executor = JobExecutor(ExecutorSettings(worker_count=2))
+    called_back_on = set()
+    all_called_back = threading.Event()
+
+    def callback():
+        called_back_on.add(threading.current_thread().name)
+        if len(called_back_on) == 2:
+            all_called_back.set()
+
+    executor.start()
+    executor.call_after_each_job(callback)
+    executor.wake_idle_workers()
+
+    assert all_called_back.wait(timeout=5)
+    executor.shutdown(timeout_s=5)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class NoJitter:
+    def uniform(self, a, b):
+        return 0
+
+
+def test_RetryPolicy_delay_s_should_back_off_exponentially_up_to_the_cap():
+    policy = RetryPolicy(max_backoff_s=10, max_attempts=6)
+
+    delays = [policy.delay_s(attempt, rng=NoJitter()) for attempt in range(1, 7)]
+
+    assert delays == [2, 4, 8, 10, 10, None]
+
+
+def test_DelayedJobScheduler_run_due_should_only_call_what_is_due_in_order():
+    clock = FakeClock()
+    scheduler = DelayedJobScheduler(clock=clock)
+    called = []
+    scheduler.call_later(10, partial(called.append, "later"))
+    scheduler.call_later(5, partial(called.append, "sooner"))
+
+    assert scheduler.run_due() == 0
+    clock.advance(5)
+    assert scheduler.run_due() == 1
+    clock.advance(5)
+    scheduler.run_due()
+
+    assert called == ["sooner", "later"]
+    assert scheduler.pending_count == 0
+
+
+def test_DelayedJobScheduler_should_call_functions_from_its_thread():
+    scheduler = DelayedJobScheduler()
+    called = threading.Event()
+    scheduler.start()
+
+    scheduler.call_later(0.01, called.set)
+
+    assert called.wait(timeout=5)
+    scheduler.stop()
+
+
+def test_CircuitBreaker_should_open_after_consecutive_failures_until_open_s_passes():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failures_to_open=2, open_s=30, clock=clock)
+
+    breaker.record_failure()
+    assert not breaker.is_open()
+    breaker.record_failure()
+    assert breaker.is_open()
+
+    clock.advance(30)
+    assert not breaker.is_open()
+    # still failing, so the next failure reopens it straight away
+    breaker.record_failure()
+    assert breaker.is_open()
+    assert breaker.times_opened == 2
+
+
+def test_CircuitBreaker_record_success_should_close_it():
+    breaker = CircuitBreaker(failures_to_open=1, clock=FakeClock())
+    breaker.record_failure()
+
+    breaker.record_success()
+
+    assert not breaker.is_open()
+
+
+class RecordingJobQueue:
+    def __init__(self):
+        self.retries = []
+        self.reports = []
+
+    def retry_later(self, job, attempt):
+        self.retries.append((job, attempt))
+        return True
+
+    def report_reachable(self):
+        self.reports.append("reachable")
+
+    def report_unreachable(self):
+        self.reports.append("unreachable")
+
+
+def test_RequeuingJob_should_hand_failed_jobs_back_for_a_retry():
+    job_queue = RecordingJobQueue()
+
+    def fail():
+        raise ConnectionError
+
+    RequeuingJob(
+        fail, exception_to_retry_on=ConnectionError, job_queue=job_queue
+    )()
+    retry, attempt = job_queue.retries[0]
+    retry()
+
+    assert attempt == 1
+    assert job_queue.retries[1][1] == 2
+    assert job_queue.reports == ["unreachable", "unreachable"]
+
+
+def test_RequeuingJob_should_report_successes():
+    job_queue = RecordingJobQueue()
+
+    RequeuingJob(
+        lambda: None, exception_to_retry_on=ConnectionError, job_queue=job_queue
+    )()
+
+    assert job_queue.retries == []
+    assert job_queue.reports == ["reachable"]
+
+
+def test_JobExecutor_retry_later_should_queue_the_job_once_its_backoff_passes():
+    clock = FakeClock()
+    executor = JobExecutor(
+        ExecutorSettings(
+            retry_policy=RetryPolicy(max_backoff_s=4, max_attempts=3)
+        ),
+        clock=clock,
+    )
+
+    assert executor.retry_later(lambda: None, attempt=2)
+    assert executor.metrics["scheduled_retries"] == 1
+
+    clock.advance(5)
+    executor._scheduler.run_due()
+
+    assert executor.metrics["live"]["queued"] == 1
+    assert not executor.retry_later(lambda: None, attempt=3)
+
+
+def test_JobExecutor_should_hold_jobs_while_the_circuit_is_open():
+    clock = FakeClock()
+    executor = JobExecutor(
+        ExecutorSettings(
+            worker_count=1, failures_to_open_circuit=1, circuit_open_s=30
+        ),
+        clock=clock,
+    )
+    ran = []
+    executor.report_unreachable()
+    executor.start()
+
+    executor.put(partial(ran.append, "held"))
+    time.sleep(0.05)
+    assert ran == []
+    assert executor.metrics["circuit_open"]
+
+    clock.advance(30)
+    executor.put(partial(ran.append, "after"))
+    executor.shutdown(timeout_s=5)
+
+    assert ran == ["held", "after"]
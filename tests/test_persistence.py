@@ -1,14 +1,24 @@
 from datetime import datetime, timedelta, date, timezone
 from pathlib import Path
 import sqlite3
+from threading import Event, Thread
+from unittest.mock import Mock
 
 import pytest
+from anki_killstreaks import persistence
+from anki_killstreaks._vendor import attr
 from anki_killstreaks.persistence import (
     DbSettings,
     migrate_database,
     AchievementsRepository,
+    AchievementOutboxRepository,
+    CachingAchievementsRepository,
+    ConnectionManager,
+    DbTuning,
     day_start_time,
+    min_datetime,
     SettingsRepository,
+    SyncStateRepository,
 )
 from anki_killstreaks.streaks import (
     MultikillMedalState,
@@ -46,6 +56,63 @@ def test_AchievementsRepository_create_all_should_save_achievements(achievements
     assert achievements[0].medal_name == a_new_achievement.medal_name
 
 
+@pytest.mark.parametrize("supports_returning", [True, False])
+def test_AchievementsRepository_create_all_should_return_what_it_saved(achievements_repo, a_new_achievement, monkeypatch, supports_returning):
+    monkeypatch.setattr(
+        persistence, "_sqlite_supports_returning", supports_returning
+    )
+
+    created = achievements_repo.create_all(
+        [a_new_achievement, attr.evolve(a_new_achievement, deck_id=1)]
+    )
+
+    with achievements_repo.get_db_connection() as conn:
+        saved_rows = conn.execute(
+            "SELECT id, medal_id, created_at, deck_id, uuid FROM achievements"
+        ).fetchall()
+
+    assert [
+        (a.id_, a.medal_id, a.created_at, a.deck_id, a.uuid) for a in created
+    ] == saved_rows
+
+
+def test_AchievementsRepository_create_all_with_no_achievements_should_not_touch_the_db(a_new_achievement):
+    get_db_connection = Mock()
+    repo = AchievementsRepository(get_db_connection)
+
+    assert repo.create_all([]) == []
+    get_db_connection.assert_not_called()
+
+
+def test_AchievementsRepository_iter_since_should_stream_achievements_with_their_medals(achievements_repo, a_new_achievement):
+    achievements_repo.create_all([a_new_achievement] * 5)
+    with achievements_repo.get_db_connection() as conn:
+        conn.execute(
+            "INSERT INTO achievements(medal_id, deck_id) VALUES (?, ?)",
+            ("Not a medal", 0),
+        )
+
+    streamed = achievements_repo.iter_since(min_datetime, batch_size=2)
+
+    assert not isinstance(streamed, list)
+    achievements = list(streamed)
+    assert len(achievements) == 5
+    assert all(a.medal_name == "Double Kill" for a in achievements)
+
+
+def test_AchievementsRepository_iter_since_should_skip_older_achievements(achievements_repo, a_new_achievement):
+    achievements_repo.create_all([a_new_achievement])
+    with achievements_repo.get_db_connection() as conn:
+        conn.execute(
+            "INSERT INTO achievements(medal_id, created_at, deck_id) VALUES (?, ?, ?)",
+            ("Double Kill", datetime.now() - timedelta(days=40), 0),
+        )
+
+    since = datetime.now() - timedelta(days=32)
+
+    assert len(list(achievements_repo.iter_since(since))) == 1
+
+
 def test_AchievementsRepository_count_by_medal_id_returns_dict_of_counted_achievements(achievements_repo, a_new_achievement):
     medal_id = "Double Kill"
     achievements_repo.create_all([a_new_achievement, a_new_achievement, a_new_achievement])
@@ -143,6 +210,187 @@ def test_AchievementsRepository_achievements_for_whole_collection_since_returns_
     assert result['Double Kill'] == 3
 
 
+@pytest.fixture
+def outbox_repo(get_db_connection):
+    return AchievementOutboxRepository(get_db_connection)
+
+
+def test_AchievementsRepository_create_all_should_queue_achievements_in_the_outbox(achievements_repo, outbox_repo, a_new_achievement):
+    saved = achievements_repo.create_all(
+        [a_new_achievement] * 3, queue_for_upload=True
+    )
+
+    pending = outbox_repo.pending(limit=10)
+
+    assert [a.uuid for a in pending] == [a.uuid for a in saved]
+    assert pending[0].medal.id_ == a_new_achievement.medal_id
+    assert outbox_repo.pending_count() == 3
+
+
+def test_AchievementsRepository_create_all_should_only_queue_achievements_when_asked(achievements_repo, outbox_repo, a_new_achievement):
+    achievements_repo.create_all([a_new_achievement] * 3)
+
+    assert outbox_repo.pending_count() == 0
+
+
+def test_AchievementOutboxRepository_mark_delivered_should_remove_achievements_from_pending(achievements_repo, outbox_repo, a_new_achievement):
+    saved = achievements_repo.create_all(
+        [a_new_achievement] * 3, queue_for_upload=True
+    )
+
+    outbox_repo.mark_delivered([saved[0].id_, saved[2].id_])
+
+    assert [a.id_ for a in outbox_repo.pending(limit=10)] == [saved[1].id_]
+
+
+def test_SyncStateRepository_finish_should_mark_synced_achievements_delivered(achievements_repo, outbox_repo, get_db_connection, a_new_achievement):
+    saved = achievements_repo.create_all(
+        [a_new_achievement] * 3, queue_for_upload=True
+    )
+    sync_state_repo = SyncStateRepository(get_db_connection)
+    sync_state_repo.start(min_datetime)
+
+    sync_state_repo.finish(last_synced_id=saved[1].id_)
+
+    assert [a.id_ for a in outbox_repo.pending(limit=10)] == [saved[2].id_]
+    assert sync_state_repo.load_in_progress() is None
+
+
+def _raw_counts_by_medal_id(conn, since_datetime, deck_ids=None):
+    deck_filter = (
+        f"AND deck_id in ({','.join('?' for i in deck_ids)})"
+        if deck_ids is not None
+        else ""
+    )
+    cursor = conn.execute(
+        f"""
+        SELECT medal_id, count(*)
+        FROM achievements
+        WHERE created_at > ? {deck_filter}
+        GROUP BY medal_id
+        """,
+        (since_datetime.astimezone(timezone.utc), *(deck_ids or [])),
+    )
+    return dict(row for row in cursor)
+
+
+def test_AchievementsRepository_counts_from_daily_rollup_should_match_raw_counts(achievements_repo):
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    midnight = now.replace(hour=0, minute=0, second=0)
+    created_ats = [
+        midnight - timedelta(days=3, seconds=1),
+        midnight - timedelta(days=1),
+        midnight - timedelta(hours=20),
+        midnight,
+        midnight + timedelta(seconds=1),
+        now,
+    ]
+
+    with achievements_repo.get_db_connection() as conn:
+        for i, created_at in enumerate(created_ats):
+            conn.execute(
+                "INSERT INTO achievements(medal_id, created_at, deck_id) VALUES (?, ?, ?)",
+                (
+                    "Double Kill" if i % 2 else "Triple Kill",
+                    created_at.strftime("%Y-%m-%d %H:%M:%S"),
+                    i % 3,
+                ),
+            )
+
+        for since in [
+            *created_ats,
+            midnight - timedelta(days=2, hours=3),
+            midnight - timedelta(hours=4),
+        ]:
+            assert achievements_repo.achievements_for_whole_collection_since(
+                since_datetime=since
+            ) == _raw_counts_by_medal_id(conn, since)
+            assert achievements_repo.achievements_for_deck_ids_since(
+                deck_ids=[0, 2], since_datetime=since
+            ) == _raw_counts_by_medal_id(conn, since, deck_ids=[0, 2])
+
+
+def test_AchievementsRepository_daily_rollup_should_follow_deleted_achievements(achievements_repo, a_new_achievement):
+    achievements_repo.create_all([a_new_achievement, a_new_achievement])
+
+    with achievements_repo.get_db_connection() as conn:
+        conn.execute("DELETE FROM achievements")
+
+    assert achievements_repo.count_by_medal_id() == {}
+
+
+@pytest.fixture
+def caching_repo(achievements_repo):
+    return CachingAchievementsRepository(achievements_repo)
+
+
+def test_CachingAchievementsRepository_should_serve_repeated_counts_from_memory(caching_repo, a_new_achievement):
+    caching_repo.create_all([a_new_achievement])
+    today = day_start_time(rollover_hour=4)
+
+    first = caching_repo.todays_achievements(today)
+    with caching_repo.get_db_connection() as conn:
+        conn.execute("DELETE FROM achievements")
+    second = caching_repo.todays_achievements(today)
+
+    assert first == second == {"Double Kill": 1}
+    assert caching_repo.cache_stats["hits"] == 1
+    assert caching_repo.cache_stats["misses"] == 1
+
+
+def test_CachingAchievementsRepository_create_all_should_invalidate_counts(caching_repo, a_new_achievement):
+    deck_ids = [0]
+    since = datetime.now() - timedelta(days=30)
+    caching_repo.achievements_for_deck_ids_since(deck_ids, since)
+
+    caching_repo.create_all([a_new_achievement])
+
+    assert caching_repo.achievements_for_deck_ids_since(
+        deck_ids, since
+    ) == {"Double Kill": 1}
+    assert caching_repo.cache_stats["misses"] == 2
+
+
+def test_CachingAchievementsRepository_create_all_without_achievements_should_keep_counts(caching_repo):
+    caching_repo.count_by_medal_id()
+    caching_repo.create_all([])
+    caching_repo.count_by_medal_id()
+
+    assert caching_repo.cache_stats["invalidations"] == 0
+    assert caching_repo.cache_stats["hits"] == 1
+
+
+def test_CachingAchievementsRepository_should_keep_hitting_when_switching_stats_periods(caching_repo):
+    now = datetime.now()
+    periods = [now - timedelta(days=30), now - timedelta(days=365), min_datetime]
+
+    for _ in range(3):
+        for since in periods:
+            caching_repo.achievements_for_whole_collection_since(since)
+
+    assert caching_repo.cache_stats["misses"] == 3
+    assert caching_repo.cache_stats["hits"] == 6
+
+
+def test_CachingAchievementsRepository_should_evict_the_least_recently_used_per_scope(achievements_repo):
+    caching_repo = CachingAchievementsRepository(
+        achievements_repo, entries_per_scope=2
+    )
+    today = day_start_time(rollover_hour=4)
+    yesterday = today - timedelta(days=1)
+
+    caching_repo.todays_achievements(yesterday)
+    caching_repo.todays_achievements(today.replace(hour=5))
+    caching_repo.todays_achievements(yesterday)
+    caching_repo.todays_achievements(today)
+    caching_repo.achievements_for_whole_collection_since(today)
+
+    assert caching_repo.cache_stats["entries"] == 3
+    caching_repo.todays_achievements(today.replace(hour=5))
+    assert caching_repo.cache_stats["hits"] == 1
+    assert caching_repo.cache_stats["misses"] == 5
+
+
 def test_day_start_time_should_return_4am_today_if_it_is_after_4am():
     result = day_start_time(rollover_hour=4)
 
@@ -199,3 +447,146 @@ def test_SettingsRepository_toggle_show_chase_mode_should_toggle_chase_mode(sett
     settings_repo.toggle_show_chase_mode()
     assert settings_repo.should_show_chase_mode is 0
 
+
+
+@pytest.fixture
+def connection_manager(db_settings):
+    migrate_database(settings=db_settings)
+    manager = ConnectionManager(db_settings)
+    yield manager
+    manager.close_all()
+
+
+def test_ConnectionManager_should_reuse_one_connection_per_thread(connection_manager, a_new_achievement):
+    repo = AchievementsRepository(connection_manager.connection)
+    settings_repo = SettingsRepository(connection_manager.connection)
+
+    for _ in range(5):
+        repo.create_all([a_new_achievement])
+        repo.todays_achievements(day_start_time(rollover_hour=4))
+        settings_repo.current_game_id
+
+    assert connection_manager.connections_opened == 1
+    assert len(repo.all()) == 5
+
+
+class ConnectionUsingThread:
+    """Holds a connection on its own thread until told to close it"""
+
+    def __init__(self, connection_manager):
+        self._connection_manager = connection_manager
+        self._opened = Event()
+        self._close = Event()
+        self.closed = Event()
+        self.conn = None
+        self._thread = Thread(target=self._run)
+        self._thread.start()
+        self._opened.wait(timeout=5)
+
+    def close_if_retired(self):
+        self._close.set()
+        self.closed.wait(timeout=5)
+        self._thread.join()
+
+    def _run(self):
+        self.conn = self._connection_manager.connection()
+        self._opened.set()
+        self._close.wait(timeout=5)
+        self._connection_manager.close_current_if_retired()
+        self.closed.set()
+
+
+def test_ConnectionManager_should_open_a_separate_connection_for_other_threads(connection_manager):
+    gui_conn = connection_manager.connection()
+    worker = ConnectionUsingThread(connection_manager)
+
+    assert worker.conn is not gui_conn
+    assert connection_manager.connections_opened == 2
+    assert connection_manager.open_connection_count == 2
+    connection_manager.retire()
+    worker.close_if_retired()
+
+
+def test_ConnectionManager_retire_should_leave_other_threads_connections_open_until_they_close_them(connection_manager):
+    gui_conn = connection_manager.connection()
+    worker = ConnectionUsingThread(connection_manager)
+
+    connection_manager.retire()
+
+    with pytest.raises(sqlite3.ProgrammingError):
+        gui_conn.execute("SELECT 1")
+    assert connection_manager.open_connection_count == 1
+    worker.close_if_retired()
+    assert connection_manager.open_connection_count == 0
+    assert connection_manager.connections_closed == 2
+
+
+def test_ConnectionManager_close_current_if_retired_should_keep_connections_until_retired(connection_manager):
+    conn = connection_manager.connection()
+
+    connection_manager.close_current_if_retired()
+
+    assert conn.execute("SELECT 1").fetchone() == (1,)
+    assert connection_manager.connection() is conn
+
+
+def test_ConnectionManager_connection_should_refuse_to_open_connections_once_retired(connection_manager):
+    connection_manager.retire()
+
+    with pytest.raises(sqlite3.ProgrammingError):
+        connection_manager.connection()
+    assert connection_manager.connections_opened == 0
+
+
+def test_ConnectionManager_close_all_should_close_every_connection(connection_manager):
+    conn = connection_manager.connection()
+
+    connection_manager.close_all()
+
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
+    assert connection_manager.connections_closed == 1
+    assert connection_manager.open_connection_count == 0
+    assert connection_manager.connection() is not conn
+
+
+@pytest.fixture
+def tuned_db_settings(tmp_path):
+    return DbSettings(
+        db_path=tmp_path / "medals.db",
+        migration_dir_path=Path("anki_killstreaks", "migrations").absolute(),
+        tuning=DbTuning.from_config(
+            {"db_synchronous": "normal", "db_cache_size_kib": 4096}
+        ),
+    )
+
+
+def test_migrate_database_should_switch_to_the_tuned_journal_mode(tuned_db_settings):
+    migrate_database(settings=tuned_db_settings)
+
+    conn = sqlite3.connect(str(tuned_db_settings.db_path))
+    try:
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    finally:
+        conn.close()
+
+    assert journal_mode == "wal"
+
+
+def test_ConnectionManager_should_apply_tuned_pragmas_to_new_connections(tuned_db_settings):
+    migrate_database(settings=tuned_db_settings)
+    manager = ConnectionManager(tuned_db_settings)
+
+    try:
+        conn = manager.connection()
+        # NORMAL == 1, MEMORY == 2
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+        assert conn.execute("PRAGMA cache_size").fetchone()[0] == -4096
+        assert conn.execute("PRAGMA temp_store").fetchone()[0] == 2
+    finally:
+        manager.close_all()
+
+
+def test_DbTuning_should_reject_unknown_pragma_values():
+    with pytest.raises(ValueError):
+        DbTuning.from_config({"db_journal_mode": "WAL; DROP TABLE users"})
@@ -0,0 +1,142 @@
+"""
+Anki Killstreaks add-on
+
+Runs EXPLAIN QUERY PLAN for every query the AchievementsRepository makes
+and fails if any of them has to scan a whole table.
+
+Copyright: (c) jac241 2019-2021 <https://github.com/jac241>
+License: GNU AGPLv3 or later <https://www.gnu.org/licenses/agpl.html>
+"""
+from datetime import datetime, timedelta
+import re
+
+import pytest
+
+from anki_killstreaks.persistence import (
+    AchievementsRepository,
+    ConnectionManager,
+    day_start_time,
+    migrate_database,
+    min_datetime,
+)
+from anki_killstreaks.streaks import HALO_MULTIKILL_STATES, NewAchievement
+
+
+@pytest.fixture
+def seeded_achievements_repo(db_settings):
+    migrate_database(settings=db_settings)
+    # one shared connection, like in Anki, so the trace callback sees
+    # every query the repository makes
+    connection_manager = ConnectionManager(db_settings)
+    achievements_repo = AchievementsRepository(connection_manager.connection)
+    achievements_repo.create_all(
+        [
+            NewAchievement(medal=medal, deck_id=deck_id)
+            for medal in HALO_MULTIKILL_STATES[2:]
+            for deck_id in range(3)
+        ]
+    )
+    yield achievements_repo
+    connection_manager.close_all()
+
+
+repository_queries = {
+    "all": lambda repo: repo.all(),
+    "all_since": lambda repo: repo.all(datetime.now() - timedelta(days=1)),
+    "page_since": lambda repo: repo.page_since(
+        since_datetime=min_datetime, after_id=3, limit=5
+    ),
+    "count_by_medal_id": lambda repo: repo.count_by_medal_id(),
+    "todays_achievements": lambda repo: repo.todays_achievements(
+        day_start_time(rollover_hour=4)
+    ),
+    "todays_achievements_for_deck_ids": (
+        lambda repo: repo.todays_achievements_for_deck_ids(
+            day_start_time=day_start_time(rollover_hour=4), deck_ids=[1, 2]
+        )
+    ),
+    "achievements_for_deck_ids_since": (
+        lambda repo: repo.achievements_for_deck_ids_since(
+            deck_ids=[1], since_datetime=datetime.now() - timedelta(days=30)
+        )
+    ),
+    "achievements_for_whole_collection_since": (
+        lambda repo: repo.achievements_for_whole_collection_since(
+            since_datetime=min_datetime
+        )
+    ),
+}
+
+
+def _traced_selects(conn, query):
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        query()
+    finally:
+        conn.set_trace_callback(None)
+
+    return [s for s in statements if s.lstrip().upper().startswith("SELECT")]
+
+
+def _plan_details(conn, statement):
+    return [
+        row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {statement}")
+    ]
+
+
+def _full_table_scans(conn, statement):
+    table_names = {
+        row[0]
+        for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        )
+    }
+    plan_details = _plan_details(conn, statement)
+
+    # SQLite < 3.36 says "SCAN TABLE x", newer versions "SCAN x". Index
+    # scans are reported as "SCAN x USING ... INDEX", so only match bare scans
+    scans = (
+        re.fullmatch(r"SCAN (?:TABLE )?(\w+)", detail)
+        for detail in plan_details
+    )
+    return [
+        scan.group(0)
+        for scan in scans
+        if scan and scan.group(1) in table_names
+    ]
+
+
+@pytest.mark.parametrize("query_name", sorted(repository_queries))
+def test_AchievementsRepository_queries_should_not_scan_whole_tables(seeded_achievements_repo, query_name):
+    conn = seeded_achievements_repo.get_db_connection()
+    selects = _traced_selects(
+        conn,
+        lambda: repository_queries[query_name](seeded_achievements_repo),
+    )
+
+    assert len(selects) > 0
+    for statement in selects:
+        assert _full_table_scans(conn, statement) == [], statement
+
+
+def test_achievements_deck_scoped_count_should_search_a_covering_index(seeded_achievements_repo):
+    conn = seeded_achievements_repo.get_db_connection()
+    (statement,) = _traced_selects(
+        conn,
+        lambda: seeded_achievements_repo.achievements_for_deck_ids_since(
+            deck_ids=[1, 2], since_datetime=datetime.now() - timedelta(days=30)
+        ),
+    )
+
+    achievements_steps = [
+        detail
+        for detail in _plan_details(conn, statement)
+        if re.search(r"\b(?:TABLE )?achievements\b", detail)
+    ]
+
+    assert len(achievements_steps) > 0, statement
+    for detail in achievements_steps:
+        assert re.match(
+            r"SEARCH (?:TABLE )?achievements USING COVERING INDEX", detail
+        ), detail
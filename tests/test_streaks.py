@@ -8,10 +8,11 @@ License: GNU AGPLv3 or later <https://www.gnu.org/licenses/agpl.html>
 from datetime import datetime
 from functools import partial
 from pathlib import Path
+import random
 
 import pytest
 
-from anki_killstreaks import addons
+from anki_killstreaks import addons, streaks
 from anki_killstreaks.streaks import *
 
 
@@ -458,6 +459,425 @@ def test_Store_all_displayable_medals_should_return_all_set_of_possible_displaya
     assert len(result) == len(all_displayable_medals)
 
 
+def test_MedalRegistry_should_index_every_displayable_medal():
+    registry = MedalRegistry([HALO_MULTIKILL_STATES, HALO_KILLING_SPREE_STATES])
+    displayable_medals = [
+        s
+        for s in HALO_MULTIKILL_STATES + HALO_KILLING_SPREE_STATES
+        if s.is_displayable_medal
+    ]
+
+    assert registry.medals == displayable_medals
+    assert registry.by_id == {m.id_: m for m in displayable_medals}
+    assert list(registry.by_game_id) == ["halo_3"]
+    assert registry.by_game_id["halo_3"] == sorted(
+        displayable_medals, key=lambda m: m.rank
+    )
+
+
+def test_MedalRegistry_displayable_medals_in_should_handle_unregistered_states(answer_shown_state):
+    registry = MedalRegistry([HALO_MULTIKILL_STATES])
+
+    assert registry.displayable_medals_in(HALO_MULTIKILL_STATES) == frozenset(
+        s for s in HALO_MULTIKILL_STATES if s.is_displayable_medal
+    )
+    assert registry.displayable_medals_in(
+        answer_shown_state.states
+    ) == frozenset(
+        s for s in answer_shown_state.states if s.is_displayable_medal
+    )
+
+
+def test_medal_registry_should_have_every_game_played(clock):
+    config = dict(multikill_interval_s=8, killing_spree_interval_s=60)
+
+    for game_id, store in get_stores_by_game_id(config).items():
+        assert store.all_displayable_medals == frozenset(
+            medal_registry.by_game_id[game_id]
+        )
+
+
 def test_get_stores_by_game_id_should_not_throw_an_exception():
     config = dict(multikill_interval_s=5, killing_spree_interval_s=10)
     get_stores_by_game_id(config)
+
+
+class FakeClock:
+    def __init__(self):
+        self.current_time = datetime(2021, 1, 1, 12)
+
+    def now(self):
+        return self.current_time
+
+    def advance(self, seconds):
+        self.current_time += timedelta(seconds=seconds)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    # the state objects call datetime.now() directly
+    monkeypatch.setattr(streaks, "datetime", clock)
+    return clock
+
+
+@pytest.fixture(params=["objects", "compact"])
+def build_store(request, clock):
+    def build(state_machines, **kwargs):
+        if request.param == "objects":
+            return Store(state_machines=state_machines)
+        else:
+            return CompactStore.from_state_machines(
+                state_machines, clock=clock.now, **kwargs
+            )
+
+    return build
+
+
+def _multikill_states():
+    return [
+        MultikillStartingState(),
+        MultikillNoMedalState(),
+        MultikillMedalState(
+            id_="test1", name="test1", medal_image=None, rank=2, game_id="t"
+        ),
+        EndState(
+            medal_state=MultikillMedalState(
+                id_="test2", name="test2", medal_image=None, rank=3, game_id="t"
+            ),
+            index_to_return_to=2,
+        ),
+    ]
+
+
+def test_engines_should_advance_multikill_within_the_interval(build_store, clock):
+    states = _multikill_states()
+    store = build_store([InitialStreakState(states=states, interval_s=8)])
+
+    for expected_state in [states[1], states[2], states[3], states[2]]:
+        store = store.on_show_question()
+        clock.advance(3)
+        store = store.on_show_answer()
+        clock.advance(1)
+        store = store.on_answer(card_did_pass=True)
+
+        assert store.current_medal_states == [expected_state]
+
+
+def test_engines_should_restart_streak_at_index_1_when_answer_is_too_slow(build_store, clock):
+    states = _multikill_states()
+    store = build_store(
+        [
+            AnswerShownState(
+                states=states,
+                question_shown_at=clock.now(),
+                answer_shown_at=clock.now() + timedelta(seconds=10),
+                interval_s=8,
+                current_streak_index=2,
+            )
+        ]
+    )
+
+    store = store.on_answer(card_did_pass=True)
+
+    assert store.current_medal_states == [states[1]]
+
+
+def test_engines_should_reset_when_again_pressed(build_store, clock):
+    states = _multikill_states()
+    store = build_store(
+        [
+            QuestionShownState(
+                states,
+                question_shown_at=clock.now(),
+                interval_s=8,
+                current_streak_index=2,
+            )
+        ]
+    )
+
+    store = store.on_show_answer().on_answer(card_did_pass=False)
+
+    assert store.current_medal_states == [states[0]]
+
+
+def test_engines_should_ignore_answers_from_question_without_right_hand_reviews(build_store, clock):
+    states = _multikill_states()
+    store = build_store(
+        [
+            QuestionShownState(
+                states,
+                question_shown_at=clock.now(),
+                addon_is_installed_and_enabled=lambda name: False,
+            )
+        ],
+        addon_is_installed_and_enabled=lambda name: False,
+    )
+
+    store = store.on_answer(card_did_pass=True)
+
+    assert store.current_medal_states == [states[0]]
+
+
+def test_engines_should_time_answers_to_the_microsecond(build_store, clock):
+    states = _multikill_states()
+    store = build_store([InitialStreakState(states, interval_s=8)])
+    clock.advance(0.0009)
+
+    for _ in range(2):
+        store = store.on_show_question()
+        # 7999.6ms, though the shown and answered milliseconds are 8000 apart
+        clock.advance(7.9996)
+        store = store.on_show_answer().on_answer(card_did_pass=True)
+        clock.advance(0.0004)
+
+    assert store.current_medal_states == [states[2]]
+
+
+def test_engines_should_get_perfection_after_50_kills(build_store, clock):
+    store = build_store(
+        [InitialStreakState(states=HALO_KILLING_SPREE_STATES, interval_s=60)]
+    )
+
+    for i in range(50):
+        store = store.on_show_question().on_show_answer()
+        store = store.on_answer(card_did_pass=True)
+
+    assert [m.name for m in store.current_displayable_medals] == ["Perfection"]
+    assert store.current_earnable_medals == store.current_displayable_medals
+
+
+def test_engines_should_return_all_displayable_medals_once(build_store, clock):
+    store = build_store(
+        [
+            InitialStreakState(states=HALO_MULTIKILL_STATES),
+            InitialStreakState(states=HALO_MULTIKILL_STATES),
+        ]
+    )
+
+    assert store.all_displayable_medals == frozenset(
+        m for m in HALO_MULTIKILL_STATES if m.is_displayable_medal
+    )
+
+
+def test_CompactStore_should_leave_the_starting_store_untouched(clock):
+    states = _multikill_states()
+    starting_store = CompactStore([(states, 8)], clock=clock.now)
+
+    running_store = starting_store.on_show_answer().on_answer(True)
+    running_store.on_show_question()
+
+    assert starting_store.current_medal_states == [states[0]]
+    assert running_store.on_show_question() is running_store
+    assert running_store.current_medal_states == [states[1]]
+
+
+@pytest.mark.parametrize("game_id", all_game_ids + ["mwr"])
+def test_CompactStore_should_earn_the_same_medals_as_Store(game_id, clock):
+    config = dict(multikill_interval_s=8, killing_spree_interval_s=60)
+    rng = random.Random(game_id)
+
+    for _ in range(20):
+        store = get_stores_by_game_id(config)[game_id]
+        compact_store = CompactStore.from_state_machines(
+            store.state_machines, clock=clock.now
+        )
+
+        for _ in range(200):
+            event = rng.choice(
+                ["on_show_question", "on_show_answer", "on_answer", "on_answer"]
+            )
+            clock.advance(
+                rng.choice(
+                    [0, 0.0004, 1, 3, 7.9, 7.9996, 8, 8.0004, 20, 59, 61]
+                )
+            )
+            if event == "on_answer":
+                card_did_pass = rng.random() < 0.85
+                store = store.on_answer(card_did_pass)
+                compact_store = compact_store.on_answer(card_did_pass)
+            else:
+                store = getattr(store, event)()
+                compact_store = getattr(compact_store, event)()
+
+            assert compact_store.current_medal_states == store.current_medal_states
+
+
+def test_get_stores_by_game_id_should_build_compact_stores_when_configured():
+    config = dict(
+        multikill_interval_s=5, killing_spree_interval_s=10, streak_engine="compact"
+    )
+
+    stores = get_stores_by_game_id(config)
+
+    assert all(isinstance(s, CompactStore) for s in stores.values())
+
+
+_all_state_lists = [
+    HALO_MULTIKILL_STATES,
+    HALO_KILLING_SPREE_STATES,
+    MW2_KILLSTREAK_STATES,
+    HALO_5_MULTIKILL_STATES,
+    HALO_5_KILLING_SPREE_STATES,
+    HALO_INFINITE_MULTIKILL_STATES,
+    HALO_INFINITE_KILLING_SPREE_STATES,
+    VANGUARD_MULTIKILL_STATES,
+    VANGUARD_KILLING_SPREE_STATES,
+    VANGUARD_KILLSTREAK_STATES,
+    MWR_MULTIKILL_STATES,
+    MWR_KILLING_SPREE_STATES,
+    MWR_KILLSTREAK_STATES,
+]
+
+
+@pytest.mark.parametrize("states", _all_state_lists)
+@pytest.mark.parametrize("interval_s", [8, 60])
+def test_TransitionTable_should_answer_like_the_state_objects(states, interval_s):
+    table = TransitionTable.compile(states, interval_s)
+    question_shown_at = datetime(2021, 1, 1, 12)
+    interval_ms = interval_s * 1000
+    elapsed_ms_around_every_boundary = [
+        -1000, -1, 0, 1, interval_ms - 1, interval_ms, interval_ms + 1, 10 ** 9
+    ]
+
+    for index, state in enumerate(states):
+        assert table.states[index] is state
+        assert table.is_earnable_medal[index] == state.is_earnable_medal
+        assert table.is_displayable_medal[index] == state.is_displayable_medal
+
+        for elapsed_ms in elapsed_ms_around_every_boundary:
+            for card_did_pass in [True, False]:
+                machine = AnswerShownState(
+                    states=states,
+                    question_shown_at=question_shown_at,
+                    answer_shown_at=question_shown_at
+                    + timedelta(milliseconds=elapsed_ms),
+                    interval_s=interval_s,
+                    current_streak_index=index,
+                )
+
+                expected_index = machine.on_answer(
+                    card_did_pass
+                )._current_streak_index
+
+                assert (
+                    table.next_streak_index(index, card_did_pass, elapsed_ms)
+                    == expected_index
+                )
+
+
+@pytest.fixture(params=["numpy", "python"])
+def replay_backend(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(streaks, "np", None)
+    return request.param
+
+
+def _review_history(rng, size, fail_rate):
+    question_shown_at_ms, answered_at_ms, eases = [], [], []
+    now_ms = 1_600_000_000_000
+    for _ in range(size):
+        now_ms += rng.choice([500, 2000, 30_000, 600_000])
+        question_shown_at_ms.append(now_ms)
+        now_ms += rng.choice([0, 1000, 4000, 7999, 8000, 20_000, 59_999, 60_000, 61_000])
+        answered_at_ms.append(now_ms)
+        eases.append(1 if rng.random() < fail_rate else rng.choice([2, 3, 4]))
+    return question_shown_at_ms, answered_at_ms, eases
+
+
+# without fails, killing sprees reach their end states, where slow answers reset
+@pytest.mark.parametrize("fail_rate", [0.1, 0.0])
+def test_replay_reviews_should_earn_what_the_stores_earn_live(replay_backend, clock, fail_rate):
+    config = dict(multikill_interval_s=8, killing_spree_interval_s=60)
+    question_shown_at_ms, answered_at_ms, eases = _review_history(
+        random.Random(0), 3000, fail_rate
+    )
+    stores_by_game_id = get_stores_by_game_id(config)
+    expected = {game_id: ([], []) for game_id in stores_by_game_id}
+
+    for review_index, (shown_ms, answered_ms, ease) in enumerate(
+        zip(question_shown_at_ms, answered_at_ms, eases)
+    ):
+        for game_id, store in stores_by_game_id.items():
+            clock.current_time = datetime.utcfromtimestamp(shown_ms / 1000)
+            store = store.on_show_question()
+            clock.current_time = datetime.utcfromtimestamp(answered_ms / 1000)
+            store = store.on_show_answer().on_answer(did_card_pass(ease))
+            stores_by_game_id[game_id] = store
+
+            for medal in store.current_earnable_medals:
+                expected[game_id][0].append(review_index)
+                expected[game_id][1].append(medal)
+
+    result = replay_reviews(question_shown_at_ms, answered_at_ms, eases, config)
+
+    assert {
+        game_id: (replayed.review_indexes, replayed.medals)
+        for game_id, replayed in result.items()
+    } == expected
+    assert result["halo_3"].streak_indexes == [
+        m._current_streak_index for m in stores_by_game_id["halo_3"].state_machines
+    ]
+    assert len(result["halo_3"]) > 0
+
+
+def test_replay_reviews_should_replay_long_unbroken_streaks_like_the_python_loop(monkeypatch):
+    pytest.importorskip("numpy")
+    config = dict(multikill_interval_s=8, killing_spree_interval_s=60)
+    rng = random.Random(1)
+    # never failed, and the 70s answers are only too slow once a killing
+    # spree reaches its end state
+    question_shown_at_ms = [i * 100_000 for i in range(5000)]
+    answered_at_ms = [
+        shown_ms + rng.choice([3000, 70_000])
+        for shown_ms in question_shown_at_ms
+    ]
+    eases = [3] * len(question_shown_at_ms)
+
+    vectorized = replay_reviews(
+        question_shown_at_ms, answered_at_ms, eases, config
+    )
+    monkeypatch.setattr(streaks, "np", None)
+    stepped = replay_reviews(question_shown_at_ms, answered_at_ms, eases, config)
+
+    assert vectorized == stepped
+    assert len(vectorized["halo_3"]) > 0
+
+
+def test_replay_reviews_should_return_to_the_start_of_the_cycle_after_the_last_medal(replay_backend):
+    config = dict(multikill_interval_s=8, killing_spree_interval_s=60)
+    question_shown_at_ms = [i * 10_000 for i in range(105)]
+    answered_at_ms = [shown_ms + 5000 for shown_ms in question_shown_at_ms]
+
+    result = replay_reviews(
+        question_shown_at_ms, answered_at_ms, [3] * 105, config
+    )
+
+    spree_names = [
+        medal.name
+        for _review_index, medal in result["halo_3"]
+        if medal in HALO_KILLING_SPREE_STATES
+    ]
+    assert spree_names.count("Perfection") == 2
+
+
+def test_replay_reviews_should_carry_on_from_earlier_streak_indexes(replay_backend):
+    config = dict(multikill_interval_s=8, killing_spree_interval_s=60)
+    history = _review_history(random.Random(1), 2000, fail_rate=0.02)
+    whole = replay_reviews(*history, config, game_ids=["halo_5"])["halo_5"]
+
+    first = replay_reviews(
+        *(column[:1234] for column in history), config, game_ids=["halo_5"]
+    )
+    second = replay_reviews(
+        *(column[1234:] for column in history),
+        config,
+        game_ids=["halo_5"],
+        streak_indexes_by_game_id={"halo_5": first["halo_5"].streak_indexes},
+    )
+
+    assert list(first) == ["halo_5"]
+    assert first["halo_5"].medals + second["halo_5"].medals == whole.medals
+    assert second["halo_5"].streak_indexes == whole.streak_indexes
@@ -19,6 +19,24 @@ def test_medal_types_should_group_achievements_and_count_medals():
     assert results[1].count == 1
 
 
+def test_medal_types_should_sort_each_games_medals_by_rank():
+    achievement_count_by_medal_id = {
+        'halo_5_overkill': 1,
+        'Overkill': 3,
+        'Killing Spree': 4,
+        'Double Kill': 5,
+    }
+
+    results = medal_types(achievement_count_by_medal_id)
+
+    assert [(r.medal.id_, r.count) for r in results] == [
+        ('Double Kill', 5),
+        ('Overkill', 3),
+        ('Killing Spree', 4),
+        ('halo_5_overkill', 1),
+    ]
+
+
 def test_MedalsOverviewJS_smoke_test():
     assert TodaysMedalsJS(
         {